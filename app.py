@@ -1,17 +1,45 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 import asyncio
 import traceback
 import os
+import time
 import json
-import smtplib
-from email.message import EmailMessage
+import re
+import weakref
+from collections import deque
 from datetime import datetime, timedelta
 
+from browser_pool import BrowserPool, PoolBusy
+from calendar_parse import ResponseCapture, SlotColumns, make_slot, slots_from_columns
+from calendar_parse import dedupe_and_sort as _dedupe_and_sort
+from page_profile import apply_profile, launch_args, meter_for
+from history_reader import HistoryReader
+from leader import LeaderLease
+import log_writer
+import metrics
+from notifier import NotificationOutbox, deliver_email, deliver_line, new_client
+from notifier import append_history as _append_history
+from slot_diff import DiffEngine, notification_key, slot_key
+from slot_store import SlotStore
+from subscriptions import SubscriptionStore
+
 app = FastAPI()
 
+# warm browser pool, created on startup (None when Playwright is unavailable
+# or BROWSER_POOL_SIZE=0; callers then launch a browser per call as before)
+_browser_pool: BrowserPool | None = None
+# a pooled page that loaded the calendar less than this many seconds ago is
+# scraped as is (the week switch fetches the week); older pages are reloaded
+BROWSER_POOL_PAGE_MAX_AGE = float(os.environ.get('BROWSER_POOL_PAGE_MAX_AGE', '20'))
+
+
+def _busy_response(e: Exception):
+    """503 load-shedding response used when the browser pool cannot lease a page."""
+    return JSONResponse({"ok": False, "error": "busy", "detail": str(e)}, status_code=503, headers={"Retry-After": "5"})
+
 # templates
 env = Environment(loader=FileSystemLoader("./templates"), autoescape=select_autoescape(["html"]))
 
@@ -40,13 +68,20 @@ async def fetch_week(start: str | None = None, end: str | None = None):
 
         url = "https://eipro.jp/takachiho1/eventCalendars/index"
 
+        if _browser_pool is not None:
+            async with _browser_pool.lease() as page:
+                await page.goto(url)
+                await wait_calendar_ready(page, 'fetch_week_ready')
+                content = await page.content()
+            return JSONResponse({"ok": True, "source": "playwright", "html": content})
+
         if async_playwright is not None:
             async with async_playwright() as p:
                 browser = await p.chromium.launch(headless=True)
                 page = await browser.new_page()
                 await page.goto(url)
-                # wait a short while for JS to render calendar; adjust if needed
-                await asyncio.sleep(2)
+                # wait until the JS-rendered calendar has slot inputs
+                await wait_calendar_ready(page, 'fetch_week_ready')
                 # grab calendar container HTML (best-effort selector)
                 content = await page.content()
                 await browser.close()
@@ -58,11 +93,35 @@ async def fetch_week(start: str | None = None, end: str | None = None):
         resp = httpx.get(url, timeout=30)
         return JSONResponse({"ok": True, "source": "requests", "html": resp.text[:20000]})
 
+    except PoolBusy as e:
+        return _busy_response(e)
     except Exception as e:
         tb = traceback.format_exc()
         return JSONResponse({"ok": False, "error": str(e), "trace": tb}, status_code=500)
 
 
+_subscriptions = None
+
+
+def subscriptions() -> SubscriptionStore:
+    """Per-recipient slot filters (subscriptions.json)."""
+    global _subscriptions
+    if _subscriptions is None:
+        _subscriptions = SubscriptionStore()
+    return _subscriptions
+
+
+_history_reader = None
+
+
+def history_reader() -> HistoryReader:
+    """Paged reader over notifications.jsonl and its rotated segments."""
+    global _history_reader
+    if _history_reader is None:
+        _history_reader = HistoryReader()
+    return _history_reader
+
+
 def _read_recipients(path='recipients.txt'):
     try:
         with open(path, 'r', encoding='utf-8') as f:
@@ -108,22 +167,187 @@ def _read_line_tokens(path='line_tokens.txt'):
         return []
 
 
+# --- scrape readiness and per-stage timings
+# Instead of fixed sleeps the scrape path waits until the set of
+# `input.service_unit_service_start_datetime` values is rendered (and, after a
+# week switch, has changed to the requested week). Timeouts follow the
+# observed p95 of each stage, but never less than READY_TIMEOUT_MIN_MS; a wait
+# that times out below READY_TIMEOUT_MS is continued once up to it.
+
+# fixed sleeps (ms) the readiness waits replaced; used to report time saved
+_FIXED_SLEEP_MS = {'fetch_week_ready': 2000, 'initial_ready': 1000, 'week_switch': 1500}
+_READY_DEFAULT_TIMEOUT_MS = int(os.environ.get('READY_TIMEOUT_MS', '10000'))
+_READY_MIN_TIMEOUT_MS = int(os.environ.get('READY_TIMEOUT_MIN_MS', '3000'))
+_stage_times: dict[str, deque] = {}
+_stage_counters: dict[str, dict] = {}
+
+_START_VALUES_JS = (
+    "() => Array.from(document.querySelectorAll('input.service_unit_service_start_datetime'))"
+    ".map(i => i.value || '')"
+)
+
+# ready when slot inputs exist, their values differ from `prev` (if given) and
+# at least one falls inside [lo, hi] (if given)
+_READY_JS = (
+    "([prev, lo, hi]) => {"
+    "const vals=Array.from(document.querySelectorAll('input.service_unit_service_start_datetime')).map(i=>i.value||'');"
+    "if(!vals.length) return false;"
+    "if(prev!==null && vals.join('|')===prev) return false;"
+    "if(!lo) return true;"
+    "return vals.some(v=>{ const m=v.match(/(\\d{4})[\\/-](\\d{2})[\\/-](\\d{2})/); if(!m) return false; const d=m[1]+'-'+m[2]+'-'+m[3]; return d>=lo && d<=hi; });"
+    "}"
+)
+
+
+def _record_stage(stage: str, ms: float):
+    dq = _stage_times.get(stage)
+    if dq is None:
+        dq = _stage_times[stage] = deque(maxlen=200)
+    dq.append(ms)
+    metrics.record_stage(stage, ms)
+
+
+def _percentile(vals, q: float):
+    if not vals:
+        return None
+    vs = sorted(vals)
+    return vs[min(len(vs) - 1, int(q * len(vs)))]
+
+
+def _adaptive_timeout_ms(stage: str) -> int:
+    """Timeout for a readiness wait: 2x the observed p95, clamped to [READY_TIMEOUT_MIN_MS, READY_TIMEOUT_MS]."""
+    samples = _stage_times.get(stage)
+    if not samples or len(samples) < 5:
+        return _READY_DEFAULT_TIMEOUT_MS
+    return int(min(_READY_DEFAULT_TIMEOUT_MS, max(_READY_MIN_TIMEOUT_MS, _percentile(samples, 0.95) * 2)))
+
+
+def _week_range(start_date: str):
+    try:
+        d = datetime.strptime(start_date, '%Y-%m-%d').date()
+    except Exception:
+        return None
+    return (d.strftime('%Y-%m-%d'), (d + timedelta(days=6)).strftime('%Y-%m-%d'))
+
+
+_DATE_RE = re.compile(r"(\d{4})[/-](\d{2})[/-](\d{2})")
+
+
+def _dates_in_range(values: list[str], week) -> bool:
+    if not week:
+        return False
+    for v in values or []:
+        m = _DATE_RE.search(v)
+        if m and week[0] <= f"{m.group(1)}-{m.group(2)}-{m.group(3)}" <= week[1]:
+            return True
+    return False
+
+
+async def _shows_week(page, start_date: str) -> bool:
+    """True when `page` already renders slots of the week starting at `start_date`."""
+    try:
+        return _dates_in_range(await page.evaluate(_START_VALUES_JS), _week_range(start_date))
+    except Exception:
+        return False
+
+
+async def _wait_ready(page, arg: list, timeout: int) -> bool:
+    try:
+        await page.wait_for_function(_READY_JS, arg=arg, timeout=timeout)
+        return True
+    except Exception:
+        return False
+
+
+async def wait_calendar_ready(page, stage: str, prev_sig: str | None = None, week=None, t0: float | None = None):
+    """Wait until the calendar's slot inputs are rendered (and changed to `week`).
+
+    Records the wait under `stage` and the time saved against the fixed sleep
+    it replaced. An adaptive timeout that expires is extended once up to
+    READY_TIMEOUT_MS (one slow render does not become a missed week). Returns
+    True when ready, False on timeout (callers then scrape whatever is
+    rendered, as the old sleep-based code did).
+    """
+    t0 = t0 if t0 is not None else time.monotonic()
+    timeout = _adaptive_timeout_ms(stage)
+    lo, hi = week if week else (None, None)
+    c = _stage_counters.setdefault(stage, {'waits': 0, 'timeouts': 0, 'retries': 0, 'saved_ms': 0})
+    ready = await _wait_ready(page, [prev_sig, lo, hi], timeout)
+    if not ready and timeout < _READY_DEFAULT_TIMEOUT_MS:
+        c['retries'] += 1
+        ready = await _wait_ready(page, [prev_sig, lo, hi], _READY_DEFAULT_TIMEOUT_MS - timeout)
+    ms = (time.monotonic() - t0) * 1000
+    _record_stage(stage, ms)
+    c['waits'] += 1
+    if not ready:
+        c['timeouts'] += 1
+    c['saved_ms'] += int(_FIXED_SLEEP_MS.get(stage, 0) - ms)
+    return ready
+
+
+def scrape_stage_stats() -> dict:
+    """p50/p95/last per scrape stage plus readiness waits, timeouts and ms saved vs. fixed sleeps."""
+    out = {}
+    for stage, dq in _stage_times.items():
+        vals = list(dq)
+        out[stage] = {
+            'count': len(vals),
+            'p50_ms': round(_percentile(vals, 0.5), 1),
+            'p95_ms': round(_percentile(vals, 0.95), 1),
+            'last_ms': round(vals[-1], 1),
+            **_stage_counters.get(stage, {}),
+        }
+    return out
+
+
 async def fetch_parsed_impl(start_date: str | None = None):
-    """Wrapper that launches Playwright and returns parsed results.
+    """Wrapper that leases a warm page (or launches Playwright) and returns parsed results.
 
     Internally this function still exists to preserve existing endpoints. New code
     extracts the DOM-evaluation logic into `fetch_parsed_with_page(page, start_date)`
     so a persistent poller can reuse a single browser/page.
+    When the app's browser pool is running the page comes from the pool and
+    `PoolBusy` is raised if it is saturated; the page is reloaded only when it
+    last loaded more than BROWSER_POOL_PAGE_MAX_AGE seconds ago, no week is
+    requested, or the page already shows the requested week (selecting it
+    again would not re-render, so its slots could be that old). Otherwise
+    (cron runner, scripts) a browser is launched for this call only.
     """
+    url = "https://eipro.jp/takachiho1/eventCalendars/index"
+    if _browser_pool is not None:
+        async with _browser_pool.lease() as page:
+            age = _browser_pool.page_age(page)
+            # without a week to switch to, the page must show the default week again
+            if (age is None or age > BROWSER_POOL_PAGE_MAX_AGE or not start_date
+                    or await _shows_week(page, start_date)):
+                capture = _response_capture(page)
+                if capture is not None:
+                    capture.reset()
+                t0 = time.monotonic()
+                if age is None:
+                    await page.goto(url, wait_until='domcontentloaded', timeout=60000)
+                else:
+                    await page.reload(wait_until='domcontentloaded', timeout=60000)
+                _browser_pool.mark_loaded(page)
+                _record_stage('goto', (time.monotonic() - t0) * 1000)
+                await wait_calendar_ready(page, 'initial_ready')
+            return await fetch_parsed_with_page(page, start_date)
+
     from playwright.async_api import async_playwright
 
-    url = "https://eipro.jp/takachiho1/eventCalendars/index"
     async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        page = await browser.new_page()
+        t0 = time.monotonic()
+        browser = await p.chromium.launch(headless=True, args=launch_args())
+        _record_stage('browser_launch', (time.monotonic() - t0) * 1000)
+        context = await browser.new_context()
+        await apply_profile(context)
+        page = await context.new_page()
+        _response_capture(page)
+        t0 = time.monotonic()
         await page.goto(url, wait_until='networkidle', timeout=60000)
-        # give extra time for any dynamic rendering
-        await asyncio.sleep(1)
+        _record_stage('goto', (time.monotonic() - t0) * 1000)
+        # wait for dynamic rendering of the slot inputs
+        await wait_calendar_ready(page, 'initial_ready')
 
         results = await fetch_parsed_with_page(page, start_date)
 
@@ -132,175 +356,535 @@ async def fetch_parsed_impl(start_date: str | None = None):
     return results
 
 
-async def fetch_parsed_with_page(page, start_date: str | None = None):
+async def fetch_parsed_with_page(page, start_date: str | None = None, compact: bool = False):
     """Evaluate the page DOM on an already-open Playwright `page` and return shapeA results.
 
     This function contains the DOM selection and post-processing logic previously
     embedded in `fetch_parsed_impl` so callers that manage the browser (poller)
     can reuse a single `page` instance.
+    With EXTRACT_MODE=network the slots come from the calendar's own responses
+    captured during the load/week switch; the DOM path remains the fallback.
+    `compact` returns SlotRecords classified in the page (see _extract_dom).
+    """
+    capture = _response_capture(page)
+    # If a start_date (YYYY-MM-DD) is provided, switch the week selector
+    ref = None
+    if start_date:
+        ref = await _switch_week(page, start_date, capture)
+    items = await _extract_slots(page, capture, start_date, compact)
+    await _verify_week(page, ref, items, start_date)
+    return items
+
+
+class WeekNotFound(Exception):
+    """The requested week has no option in the page, or the rendered week is a different one."""
+
+
+async def _switch_week(page, start_date: str, capture=None):
+    """Select the week containing `start_date` and wait until it is rendered.
+
+    The week is looked up in the page's date->option index (built once per
+    page load). Returns the index entry (with the option's `lo`/`hi` dates);
+    raises WeekNotFound instead of silently scraping whatever week is shown.
     """
-    # If a start_date (YYYY-MM-DD) is provided, try to switch the week selector
+    try:
+        before = await page.evaluate(_START_VALUES_JS)
+    except Exception:
+        before = []
+    ref = await page.evaluate(_WEEK_LOOKUP_JS, start_date)
+    if not ref:
+        raise WeekNotFound(f'no week option for {start_date}')
+    t0 = time.monotonic()
+    if capture is not None:
+        capture.reset()
+    try:
+        ok = await page.evaluate(_WEEK_SELECT_JS, ref)
+    except Exception:
+        ok = False
+    # wait for the calendar to actually show the requested week
+    if ok:
+        week = (ref['lo'], ref['hi'])
+        # if the page already shows that week a re-render may not change anything
+        prev_sig = None if _dates_in_range(before, week) else '|'.join(before)
+        await wait_calendar_ready(page, 'week_switch', prev_sig=prev_sig, week=week, t0=t0)
+    return ref
+
+
+async def _verify_week(page, ref, items: list[dict], start_date: str):
+    """Raise WeekNotFound when the extracted slots all lie outside the selected option's week."""
+    if not ref or not items:
+        return
+    if any(i.get('date') and ref['lo'] <= i['date'] <= ref['hi'] for i in items):
+        return
+    try:
+        # the option index may be stale (select re-rendered); rebuild on next lookup
+        await page.evaluate('() => { window.__anWeeks = null; }')
+    except Exception:
+        pass
+    raise WeekNotFound(f'rendered week does not match {start_date}')
+
+
+async def _extract_slots(page, capture, start_date: str | None, compact: bool = False):
+    if capture is not None:
+        net = await _network_slots(page, capture, start_date)
+        if net is not None:
+            return net
+
+    _extract_counters['dom'] += 1
+    if compact:
+        return await _extract_dom(page, compact=True, not_full_only=EXTRACT_NOT_FULL_ONLY)
+    return await _extract_dom(page)
+
+
+# --- in-page JS, shared by the DOM extractor, the fingerprint and the batch extractor
+
+# service_unit container of a start input (climb from the input's parent)
+_JS_CONTAINER_OF = (
+    "const START='input.service_unit_service_start_datetime';"
+    "const containerOf=(inp)=>{ let c=inp.parentElement;"
+    "for(let i=0;i<8 && c;i++,c=c.parentElement){ if((c.className||'').toString().indexOf('service_unit')!==-1) break; }"
+    "return c||inp.parentElement; };"
+)
+
+# raw fields of one slot (inputs + icon + computed background + text)
+_JS_COLLECT = (
+    "const collect=(c,inp)=>{"
+    "const getVal=(cls)=>{ const el=c.querySelector(cls); return el? (el.value||el.innerText||'') : ''; };"
+    "const icon=c.querySelector('i')||c.querySelector('.service_icon i');"
+    "return {start:inp.value||'', end:getVal('.service_unit_service_end_datetime')||'',"
+    "service_cd:getVal('.service_unit_service_cd')||'', multi:getVal('.service_unit_service_multi_edit_key')||'',"
+    "icon_class:icon?(icon.className||''):'', icon_color:icon?(icon.style&&icon.style.color?icon.style.color:''):'',"
+    "bg:window.getComputedStyle(c).backgroundColor||'', text:(c.innerText||'').slice(0,300)}; };"
+    "const collectAll=()=>Array.from(document.querySelectorAll(START)).map(inp=>collect(containerOf(inp),inp));"
+)
+
+# fingerprint of the rendered week: FNV-1a over slot inputs, icon class/colour,
+# container background and the 〇/砂 text markers, i.e. every input of the
+# status classification, without shipping any text to Python
+_JS_FINGERPRINT = (
+    "const fingerprint=()=>{ let h=0x811c9dc5, n=0;"
+    "const mix=(s)=>{ for(let i=0;i<s.length;i++){ h^=s.charCodeAt(i); h=Math.imul(h,0x01000193)>>>0; } h^=31; h=Math.imul(h,0x01000193)>>>0; };"
+    "for(const inp of document.querySelectorAll(START)){ const c=containerOf(inp);"
+    "const v=(cls)=>{ const el=c.querySelector(cls); return el?(el.value||el.textContent||''):''; };"
+    "const icon=c.querySelector('i'); const t=c.textContent||'';"
+    "mix(inp.value||''); mix(v('.service_unit_service_end_datetime')); mix(v('.service_unit_service_cd')); mix(v('.service_unit_service_multi_edit_key'));"
+    "mix(icon?(icon.className||''):''); mix(icon&&icon.style?(icon.style.color||''):'');"
+    "mix(window.getComputedStyle(c).backgroundColor||'');"
+    "mix((/[〇○]/.test(t)?'o':'')+(/砂/.test(t)?'s':'')); n++; }"
+    "return n+':'+h.toString(16); };"
+)
+
+# date -> week option index, built once per page load (window.__anWeeks).
+# Every date between the first and last date of an option's text maps to it
+# (a single date is taken as the week start), so a mid-week date finds its
+# week. Selects win over clickable elements, as in the old scan order.
+_JS_WEEK_INDEX = (
+    "const weekIndex=()=>{ if(window.__anWeeks) return window.__anWeeks; const idx={};"
+    "const add=(txt,ref)=>{ const re=/(\\d{4})[\\/-](\\d{2})[\\/-](\\d{2})/g; const ds=[]; let m;"
+    "while((m=re.exec(txt))!==null) ds.push(m[1]+'-'+m[2]+'-'+m[3]);"
+    "if(!ds.length) return; const lo=ds[0]; const t0=Date.parse(lo+'T00:00:00Z'); if(isNaN(t0)) return;"
+    "let hi=ds[ds.length-1]; if(hi<=lo) hi=new Date(t0+6*864e5).toISOString().slice(0,10);"
+    "for(let k=0;k<31;k++){ const d=new Date(t0+k*864e5).toISOString().slice(0,10); if(d>hi) break; if(!(d in idx)) idx[d]=Object.assign({lo,hi,txt},ref); } };"
+    "Array.from(document.querySelectorAll('select')).forEach((sel,i)=>Array.from(sel.options||[]).forEach((o,j)=>add((o.textContent||'').trim(),{kind:'select',i,j})));"
+    "Array.from(document.querySelectorAll('button,a,span')).forEach((e,i)=>{ const t=(e.textContent||'').trim(); if(t && t.length<80) add(t,{kind:'click',i}); });"
+    "window.__anWeeks=idx; return idx; };"
+    "const selectWeek=(ref)=>{"
+    "if(ref.kind==='select'){ const sel=document.querySelectorAll('select')[ref.i]; const o=sel&&sel.options[ref.j]; if(!o) return false;"
+    "sel.selectedIndex=ref.j; try{ sel.value=o.value; }catch(e){} sel.dispatchEvent(new Event('change',{bubbles:true}));"
+    "if(window.jQuery){ try{ window.jQuery(sel).val(o.value).trigger('change'); }catch(e){} }"
+    "const sel2=document.querySelector('.select2-selection__rendered'); if(sel2) sel2.textContent=ref.txt; return true; }"
+    "const e=document.querySelectorAll('button,a,span')[ref.i]; if(!e) return false; try{ e.click(); }catch(err){} return true; };"
+)
+
+# compact payload: status classified and start date/time normalised in the page
+# (same rules as calendar_parse.classify_status / parse_start), returned as
+# parallel arrays with date and service_cd dictionaries; `nf` drops full slots.
+# Background and text are only read when the icon has not decided the status.
+_JS_COMPACT = (
+    "const classify=(cls,color,c)=>{"
+    "if(cls.indexOf('fa-times')!==-1) return 1;"
+    "if(color && (color.indexOf('#f803')!==-1||color.indexOf('rgb(248')!==-1||color.indexOf('red')!==-1)) return 1;"
+    "const bg=window.getComputedStyle(c).backgroundColor||'';"
+    "if(bg.indexOf('#C0C0C0')!==-1||bg.indexOf('rgb(192')!==-1||bg.indexOf('gray')!==-1) return 1;"
+    "const text=(c.innerText||'').slice(0,300);"
+    "if(/[〇○]/.test(text)) return 0;"
+    "if(cls.indexOf('fa-circle')!==-1||cls.indexOf('fa-check')!==-1) return 0;"
+    "if(text.indexOf('砂')!==-1||cls.indexOf('hourglass')!==-1) return 2;"
+    "return 3; };"
+    "const compact=(nf)=>{ const dates=[], dIdx={}, cds=[], cIdx={}, d=[], t=[], s=[], c=[], r={};"
+    "for(const inp of document.querySelectorAll(START)){ const cont=containerOf(inp);"
+    "const raw=(inp.value||'').trim(); let date=null, tm=null;"
+    "let m=raw.match(/(\\d{4})[\\/-](\\d{2})[\\/-](\\d{2})[T\\s]?(\\d{2}):(\\d{2})/);"
+    "if(m){ date=m[1]+'-'+m[2]+'-'+m[3]; tm=m[4]+':'+m[5]; } else { m=raw.match(/(\\d{4}-\\d{2}-\\d{2})T?(\\d{2}:\\d{2})/); if(m){ date=m[1]; tm=m[2]; } }"
+    "if(date!==null && !(date in dIdx)){ dIdx[date]=dates.length; dates.push(date); }"
+    "const icon=cont.querySelector('i')||cont.querySelector('.service_icon i');"
+    "const code=classify(icon?((icon.className||'')+'').trim():'', icon&&icon.style?(icon.style.color||''):'', cont);"
+    "if(nf && code===1) continue;"
+    "const el=cont.querySelector('.service_unit_service_cd'); const cd=el?(el.value||el.innerText||''):'';"
+    "if(!(cd in cIdx)){ cIdx[cd]=cds.length; cds.push(cd); }"
+    "if(date===null || raw!==date.replace(/-/g,'/')+' '+tm+':00') r[d.length]=raw;"
+    "d.push(date===null?-1:dIdx[date]); t.push(tm); s.push(code); c.push(cIdx[cd]); }"
+    "return {dates, cds, d, t, s, c, r, nf: nf?1:0}; };"
+)
+
+_FINGERPRINT_JS = "() => {" + _JS_CONTAINER_OF + _JS_FINGERPRINT + "return fingerprint(); }"
+_COLLECT_JS = "() => {" + _JS_CONTAINER_OF + _JS_COLLECT + "return collectAll(); }"
+_COMPACT_JS = "(nf) => {" + _JS_CONTAINER_OF + _JS_COMPACT + "return compact(nf); }"
+_WEEK_LOOKUP_JS = "(d) => {" + _JS_WEEK_INDEX + "return weekIndex()[d] || null; }"
+_WEEK_SELECT_JS = "(ref) => {" + _JS_WEEK_INDEX + "return selectWeek(ref); }"
+
+# all requested weeks in one evaluate: select each week, wait (in page) until
+# its dates are rendered, verify, then return its fingerprint and rows, or
+# compact columns when `payload` is set ('unchanged' when the fingerprint
+# matches `known`)
+_BATCH_JS = (
+    "async ([weeks, known, timeoutMs, payload]) => {"
+    + _JS_CONTAINER_OF + _JS_COLLECT + _JS_COMPACT + _JS_FINGERPRINT + _JS_WEEK_INDEX +
+    "const dateOf=(v)=>{ const m=(v||'').match(/(\\d{4})[\\/-](\\d{2})[\\/-](\\d{2})/); return m? m[1]+'-'+m[2]+'-'+m[3] : null; };"
+    "const values=()=>Array.from(document.querySelectorAll(START)).map(i=>i.value||'');"
+    "const out={};"
+    "for(const d of weeks){"
+    "const ref=weekIndex()[d]; if(!ref){ out[d]={status:'not_found'}; continue; }"
+    "const inRange=()=>values().some(v=>{ const x=dateOf(v); return x && x>=ref.lo && x<=ref.hi; });"
+    "const before=values().join('|'); const already=inRange(); const t0=performance.now();"
+    "if(!selectWeek(ref)){ out[d]={status:'not_found'}; continue; }"
+    "let ready=false;"
+    "while(performance.now()-t0<timeoutMs){ await new Promise(r=>setTimeout(r,50));"
+    "if(inRange() && (already || values().join('|')!==before)){ ready=true; break; } }"
+    "const ms=performance.now()-t0;"
+    "if(!ready){ if(values().length){ window.__anWeeks=null; out[d]={status:'mismatch',ms}; } else { out[d]={status:'ok',ms,fp:null,rows:[]}; } continue; }"
+    "const fp=fingerprint();"
+    "if(known[d] && known[d]===fp){ out[d]={status:'unchanged',ms,fp}; continue; }"
+    "out[d]=payload? {status:'ok',ms,fp,cols:compact(payload==='nf')} : {status:'ok',ms,fp,rows:collectAll()};"
+    "}"
+    "return out; }"
+)
+
+
+# skip parse/diff/persist for weeks whose fingerprint did not change
+SKIP_UNCHANGED_WEEKS = os.environ.get('SKIP_UNCHANGED_WEEKS', '1') != '0'
+# result marker used by fetch_weeks_with_page for skipped weeks
+WEEK_UNCHANGED = object()
+# start -> fingerprint of the last week that was diffed and persisted
+_week_fingerprints: dict[str, str] = {}
+# start -> fingerprint seen this poll, committed once the diff was persisted
+_pending_fingerprints: dict[str, str] = {}
+
+
+async def fetch_week_if_changed(page, start_date: str | None, known_fp: str | None = None, compact: bool = False):
+    """Switch to the week and return (fingerprint, slots), slots None when `known_fp` matches."""
+    capture = _response_capture(page)
+    ref = None
     if start_date:
-        s1 = start_date.replace('-', '/')
-        s2 = start_date
+        ref = await _switch_week(page, start_date, capture)
+    try:
+        fp = await page.evaluate(_FINGERPRINT_JS)
+    except Exception:
+        fp = None
+    if fp and known_fp and fp == known_fp and not fp.startswith('0:'):
+        return fp, None
+    items = await _extract_slots(page, capture, start_date, compact)
+    await _verify_week(page, ref, items, start_date)
+    return fp, items
+
+
+def _commit_fingerprints(starts: list[str], persisted: bool = True):
+    """Keep the fingerprints seen for `starts`; drop them when the state was not saved."""
+    for s in starts:
+        fp = _pending_fingerprints.pop(s, None)
+        if fp and persisted:
+            _week_fingerprints[s] = fp
+
+
+# calendar extraction mode: 'dom' scrapes the rendered page; 'network' parses
+# the calendar's own XHR/fetch responses and falls back to the DOM when none
+# were captured or when verification against the DOM fails
+EXTRACT_MODE = os.environ.get('EXTRACT_MODE', 'dom')
+# re-verify network results against the DOM every N uses (first use always)
+NETWORK_VERIFY_EVERY = int(os.environ.get('NETWORK_VERIFY_EVERY', '20'))
+# poll paths (fetch_weeks_with_page / batch) ship 'compact' in-page classified
+# columns or the 'full' per-slot dicts; EXTRACT_NOT_FULL_ONLY=1 also leaves full
+# slots out of the compact payload
+EXTRACT_PAYLOAD = os.environ.get('EXTRACT_PAYLOAD', 'compact')
+EXTRACT_NOT_FULL_ONLY = os.environ.get('EXTRACT_NOT_FULL_ONLY', '0') == '1'
+_captures = weakref.WeakKeyDictionary()  # page -> ResponseCapture
+_extract_counters = {'network': 0, 'dom': 0, 'verify_ok': 0, 'verify_fail': 0}
+
+
+def _response_capture(page):
+    """Return the page's ResponseCapture (attached on first use), or None in DOM mode."""
+    if EXTRACT_MODE != 'network':
+        return None
+    cap = _captures.get(page)
+    if cap is None:
         try:
-            js_sel = (
-                '(function(){'
-                "const s1='" + s1 + "'; const s2='" + s2 + "';"
-                "const selects = Array.from(document.querySelectorAll('select'));"
-                "for (const selEl of selects){ const opts = Array.from(selEl.options||[]); for(let i=0;i<opts.length;i++){ const o=opts[i]; const txt=(o.textContent||'').trim(); if(!txt) continue; if(txt.indexOf(s1)!==-1||txt.indexOf(s2)!==-1){ try{ selEl.selectedIndex=i; try{ selEl.value=o.value; }catch(e){} selEl.dispatchEvent(new Event('change',{bubbles:true})); if(window.jQuery){ try{ window.jQuery(selEl).val(o.value).trigger('change'); }catch(e){} } const sel2=document.querySelector('.select2-selection__rendered'); if(sel2) sel2.textContent=txt; return true;}catch(e){} } } }"
-                "const els = Array.from(document.querySelectorAll('button,a,span')); for(const e of els){ const t=(e.textContent||'').trim(); if(t && (t.indexOf(s1)!==-1||t.indexOf(s2)!==-1)){ try{ e.click(); }catch(e){} return true; } } return false; })()"
-            )
-            ok = await page.evaluate(js_sel)
+            cap = ResponseCapture(page)
         except Exception:
-            ok = False
-        # allow time for calendar to reload
-        if ok:
-            await asyncio.sleep(1.5)
+            return None
+        _captures[page] = cap
+    return None if cap.disabled else cap
+
+
+def _status_set(items: list[dict]):
+    return {(i.get('date'), i.get('time'), i.get('attrs', {}).get('service_cd'), i.get('status')) for i in items}
+
+
+async def _network_slots(page, capture, start_date: str | None):
+    """Slots parsed from captured responses, or None to use the DOM path.
+
+    The first use of a capture and every NETWORK_VERIFY_EVERY-th use are
+    checked against the DOM; a mismatch disables network mode for that page.
+    """
+    await capture.settle()
+    slots = capture.slots
+    week = _week_range(start_date) if start_date else None
+    if week:
+        slots = [x for x in slots if x.get('date') and week[0] <= x['date'] <= week[1]]
+    if not slots:
+        return None
+    net = _dedupe_and_sort(slots)
+    capture.uses += 1
+    if capture.uses == 1 or capture.uses % max(1, NETWORK_VERIFY_EVERY) == 0:
+        dom = await _extract_dom(page, compact=True)
+        if week:
+            dom = [x for x in dom if x.get('date') and week[0] <= x['date'] <= week[1]]
+        if _status_set(dom) != _status_set(net):
+            capture.disabled = True
+            try:
+                page.remove_listener('response', capture._on_response)
+            except Exception:
+                pass
+            _extract_counters['verify_fail'] += 1
+            metrics.fallbacks.inc('network_extract')
+            log_writer.log(f'network extraction mismatch (network={len(net)} dom={len(dom)}); using DOM for this page\n')
+            return None
+        _extract_counters['verify_ok'] += 1
+    _extract_counters['network'] += 1
+    return net
+
+
+async def _extract_dom(page, compact: bool = False, not_full_only: bool = False):
+    """Collect service_unit containers from the rendered DOM and return deduped slots.
+
+    With `compact` the page classifies the slots itself and returns parallel
+    arrays (see _JS_COMPACT), decoded into SlotRecords; `not_full_only`
+    leaves full slots out of the payload.
+    """
+    if compact:
+        t0 = time.monotonic()
+        raw = await page.evaluate(_COMPACT_JS, bool(not_full_only))
+        _record_stage('evaluate', (time.monotonic() - t0) * 1000)
+        t0 = time.monotonic()
+        cols = slots_from_columns(raw)
+        out = SlotColumns(_dedupe_and_sort(cols), cols.dates, cols.not_full_only)
+        _record_stage('parse', (time.monotonic() - t0) * 1000)
+        return out
 
     # Evaluate a JS snippet that collects service_unit containers (inputs + computed styles)
-    js = (
-        "() => {"
-        "const out=[];"
-        "const inputs=Array.from(document.querySelectorAll('input.service_unit_service_start_datetime'));"
-        "for(const inp of inputs){"
-        "let container=inp.parentElement;"
-        "for(let i=0;i<8 && container;i++,container=container.parentElement){ if((container.className||'').indexOf('service_unit')!==-1) break; }"
-        "if(!container) container=inp.parentElement;"
-        "const getVal=(cls)=>{ const el=container.querySelector(cls); return el? (el.value||el.innerText||'') : ''; };"
-        "const start=inp.value||'';"
-        "const end=getVal('.service_unit_service_end_datetime')||'';"
-        "const service_cd=getVal('.service_unit_service_cd')||'';"
-        "const multi=getVal('.service_unit_service_multi_edit_key')||'';"
-        "const icon=container.querySelector('i')||container.querySelector('.service_icon i');"
-        "const icon_class=icon?(icon.className||'') : '';"
-        "const icon_color=icon?(icon.style&&icon.style.color?icon.style.color:'') : '';"
-        "const bg=window.getComputedStyle(container).backgroundColor||'';"
-        "out.push({start,end,service_cd,multi,icon_class,icon_color,bg,text:(container.innerText||'').slice(0,300)});"
-        "}"
-        "return out;"
-        "}"
-    )
+    js = _COLLECT_JS
+    t0 = time.monotonic()
     data = await page.evaluate(js)
+    _record_stage('evaluate', (time.monotonic() - t0) * 1000)
 
     # post-process (same logic as before)
+    t0 = time.monotonic()
     results = []
-    import re
     for item in data:
-        start_raw = (item.get('start') or '').strip()
-        end_raw = (item.get('end') or '').strip()
-        text = (item.get('text') or '').strip()
-        icon_class = (item.get('icon_class') or '').strip()
-        icon_color = (item.get('icon_color') or '').strip()
-        bg = (item.get('bg') or '').strip()
-
-        date = None
-        time = None
-        m = re.search(r"(\d{4})[/-](\d{2})[/-](\d{2})[T\s]?(\d{2}):(\d{2})", start_raw)
-        if m:
-            date = f"{m.group(1)}-{m.group(2)}-{m.group(3)}"
-            time = f"{m.group(4)}:{m.group(5)}"
-        else:
-            m2 = re.search(r"(\d{4}-\d{2}-\d{2})T?(\d{2}:\d{2})", start_raw)
-            if m2:
-                date = m2.group(1)
-                time = m2.group(2)
-
-        status = 'other'
-        low_text = text
-        if icon_class and 'fa-times' in icon_class:
-            status = 'full'
-        elif icon_color and ('#f803' in icon_color or 'rgb(248' in icon_color or 'red' in icon_color):
-            status = 'full'
-        elif bg and (('#C0C0C0' in bg) or ('rgb(192' in bg) or ('gray' in bg)):
-            status = 'full'
-        elif '〇' in low_text or '○' in low_text:
-            status = 'available'
-        elif icon_class and ('fa-circle' in icon_class or 'fa-check' in icon_class):
-            status = 'available'
-        elif '砂' in low_text or '砂時計' in low_text or (icon_class and 'hourglass' in icon_class):
-            status = 'not_started'
-
-        attrs = {
-            'service_cd': item.get('service_cd') or '',
-            'multi_edit_key': item.get('multi') or '',
-            'icon_class': icon_class,
-            'icon_color': icon_color,
-            'bg': bg,
-            'start_raw': start_raw,
-            'end_raw': end_raw,
-        }
+        results.append(make_slot(
+            start_raw=item.get('start'),
+            end_raw=item.get('end'),
+            service_cd=item.get('service_cd'),
+            multi=item.get('multi'),
+            icon_class=item.get('icon_class'),
+            icon_color=item.get('icon_color'),
+            bg=item.get('bg'),
+            text=item.get('text'),
+        ))
+
+    results = _dedupe_and_sort(results)
+    _record_stage('parse', (time.monotonic() - t0) * 1000)
+    return results
+
+
+# max number of weeks scraped at the same time (one page / context each)
+SCRAPE_CONCURRENCY = int(os.environ.get('SCRAPE_CONCURRENCY', '3'))
+
+# extra worker pages per browser, reused across poller ticks
+_week_pages: dict[int, list] = {}
+
+
+async def _extra_week_pages(page, n: int):
+    """Return up to `n` additional pages, each in its own BrowserContext of `page`'s browser.
+
+    Pages are cached per browser so a persistent poller only pays the
+    navigation once; closed pages (browser restarted) are recreated.
+    """
+    if n <= 0:
+        return []
+    try:
+        browser = page.context.browser
+    except Exception:
+        browser = None
+    if browser is None:
+        # persistent contexts have no browser handle; stay sequential
+        return []
+    for k in [k for k, pages in _week_pages.items() if all(p.is_closed() for p in pages)]:
+        _week_pages.pop(k, None)
+    pages = [p for p in _week_pages.get(id(browser), []) if not p.is_closed()]
+    while len(pages) < n:
+        try:
+            ctx = await browser.new_context()
+            # same blocking profile and transfer meter as the primary page
+            await apply_profile(ctx, meter_for(page.context))
+            pg = await ctx.new_page()
+            await pg.goto("https://eipro.jp/takachiho1/eventCalendars/index", wait_until='networkidle', timeout=60000)
+        except Exception as e:
+            log_writer.log(f'extra week page create failed: {e}\n')
+            break
+        pages.append(pg)
+    _week_pages[id(browser)] = pages
+    return pages[:n]
 
-        results.append({
-            'date': date,
-            'time': time,
-            'status': status,
-            'raw_text': text,
-            'attrs': attrs,
-        })
-
-    # dedupe & sort
-    seen = set()
-    deduped = []
-    for r in results:
-        key = (r.get('date'), r.get('time'), r.get('attrs', {}).get('service_cd'), r.get('attrs', {}).get('start_raw'))
-        if key in seen:
+
+def week_pages(page) -> list:
+    """`page` plus the extra week pages currently open in its browser."""
+    try:
+        browser = page.context.browser
+    except Exception:
+        browser = None
+    extras = _week_pages.get(id(browser), []) if browser is not None else []
+    return [page] + [p for p in extras if not p.is_closed()]
+
+
+# 'concurrent' (worker pages, default) or 'batch' (all weeks in one evaluate on `page`)
+WEEK_FETCH_MODE = os.environ.get('WEEK_FETCH_MODE', 'concurrent')
+
+
+async def fetch_weeks_batch(page, starts: list[str], skip_unchanged: bool = False):
+    """Scrape all `starts` on `page` in a single evaluate round trip.
+
+    The page steps through the weeks itself (select option, wait until the
+    week's dates are rendered, fingerprint, collect rows), so Python pays one
+    CDP round trip per tick instead of several per week. Returns the same
+    [(start, items|exception|WEEK_UNCHANGED)] list as fetch_weeks_with_page;
+    weeks without an option, or whose rendered dates never matched, come back
+    as WeekNotFound.
+    """
+    if not starts:
+        return []
+    known = {s: _week_fingerprints[s] for s in starts if skip_unchanged and s in _week_fingerprints}
+    timeout_ms = _adaptive_timeout_ms('week_switch')
+    payload = None
+    if EXTRACT_PAYLOAD == 'compact':
+        payload = 'nf' if EXTRACT_NOT_FULL_ONLY else 'all'
+    t0 = time.monotonic()
+    try:
+        out = await page.evaluate(_BATCH_JS, [starts, known, timeout_ms, payload])
+    except Exception as e:
+        return [(s, e) for s in starts]
+    _record_stage('evaluate', (time.monotonic() - t0) * 1000)
+
+    results = []
+    for s in starts:
+        r = (out or {}).get(s) or {'status': 'not_found'}
+        status = r.get('status')
+        if r.get('ms') is not None:
+            _record_stage('week_switch', float(r['ms']))
+        if status == 'not_found':
+            results.append((s, WeekNotFound(f'no week option for {s}')))
+            continue
+        if status == 'mismatch':
+            results.append((s, WeekNotFound(f'rendered week does not match {s}')))
+            continue
+        if r.get('fp'):
+            _pending_fingerprints[s] = r['fp']
+        if status == 'unchanged' and not r['fp'].startswith('0:'):
+            results.append((s, WEEK_UNCHANGED))
+            continue
+        t0 = time.monotonic()
+        if r.get('cols') is not None:
+            cols = slots_from_columns(r['cols'])
+            results.append((s, SlotColumns(_dedupe_and_sort(cols), cols.dates, cols.not_full_only)))
+            _record_stage('parse', (time.monotonic() - t0) * 1000)
             continue
-        seen.add(key)
-        deduped.append(r)
+        items = _dedupe_and_sort([make_slot(
+            start_raw=x.get('start'),
+            end_raw=x.get('end'),
+            service_cd=x.get('service_cd'),
+            multi=x.get('multi'),
+            icon_class=x.get('icon_class'),
+            icon_color=x.get('icon_color'),
+            bg=x.get('bg'),
+            text=x.get('text'),
+        ) for x in r.get('rows') or []])
+        _record_stage('parse', (time.monotonic() - t0) * 1000)
+        results.append((s, items))
+    return results
+
 
-    def sort_key(x):
-        d = x.get('date') or '9999-12-31'
-        t = x.get('time') or '99:99'
-        return (d, t)
+async def fetch_weeks_with_page(page, starts: list[str], concurrency: int | None = None, skip_unchanged: bool = False):
+    """Scrape several weeks concurrently, `page` plus extra pages of the same browser.
+
+    Each worker page takes the next pending week, so at most `concurrency`
+    weeks are in flight and the tick costs roughly the slowest week instead of
+    the sum. Returns a list of (start, items-or-exception) in `starts` order.
+    With `skip_unchanged` a week whose in-page fingerprint equals the last
+    persisted one is returned as WEEK_UNCHANGED without being parsed.
+    """
+    if WEEK_FETCH_MODE == 'batch' and not concurrency:
+        return await fetch_weeks_batch(page, starts, skip_unchanged=skip_unchanged)
+    limit = max(1, min(len(starts), concurrency or SCRAPE_CONCURRENCY))
+    pages = [page] + await _extra_week_pages(page, limit - 1)
+    pending = list(enumerate(starts))
+    results = [None] * len(starts)
+    compact = EXTRACT_PAYLOAD == 'compact'
+
+    async def worker(pg):
+        while pending:
+            i, s = pending.pop(0)
+            try:
+                if skip_unchanged:
+                    fp, items = await fetch_week_if_changed(pg, s, _week_fingerprints.get(s), compact=compact)
+                    if fp:
+                        _pending_fingerprints[s] = fp
+                    results[i] = WEEK_UNCHANGED if items is None else items
+                else:
+                    results[i] = await fetch_parsed_with_page(pg, s, compact=compact)
+            except Exception as e:
+                results[i] = e
 
-    deduped.sort(key=sort_key)
-    return deduped
+    await asyncio.gather(*(worker(pg) for pg in pages))
+    return list(zip(starts, results))
 
 
 # --- Notification helpers and background polling
 NOTIFIED_PATH = os.environ.get('NOTIFIED_PATH', 'notified.json')
 POLL_INTERVAL = int(os.environ.get('POLL_INTERVAL', '60'))  # seconds
 
-def _load_notified(path=NOTIFIED_PATH):
-    """Load notified state.
+# slot state lives in SQLite (NOTIFIED_DB); NOTIFIED_PATH is the legacy JSON
+# file, imported once on first open
+_slot_store = None
+
+
+def _state_store():
+    global _slot_store
+    if _slot_store is None:
+        _slot_store = SlotStore(legacy_json=NOTIFIED_PATH)
+    return _slot_store
 
-    New format: JSON object mapping serialized slot-key -> last-known status
-    (e.g. '{"[\"2025-11-09\", \"13:00\", \"service_cd\", \"...\"]": "available"}').
 
-    Backwards compatibility: if the file is a list of lists (old format), convert
-    entries to keys with status 'notified'.
-    Returns a dict mapping key_str -> status.
+def _load_notified():
+    """Load notified state: a dict mapping key_str -> last-known status
+    (e.g. '{"[\"2025-11-09\", \"13:00\", \"service_cd\", \"...\"]": "available"}').
     """
     try:
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        if isinstance(data, dict):
-            return data
-        if isinstance(data, list):
-            out = {}
-            for item in data:
-                try:
-                    key_str = json.dumps(list(item), ensure_ascii=False)
-                except Exception:
-                    key_str = json.dumps(item, ensure_ascii=False)
-                out[key_str] = 'notified'
-            return out
-        return {}
+        return _state_store().load()
     except Exception:
         return {}
 
-def _save_notified(d: dict, path=NOTIFIED_PATH):
-    """Persist notified state as a JSON object mapping key->status."""
-    try:
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(d, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
-
 def _slot_key(item: dict):
     # unique key for a slot
-    return (item.get('date'), item.get('time'), item.get('attrs', {}).get('service_cd'), item.get('attrs', {}).get('start_raw'))
+    return slot_key(item)
 
 
 def _key_to_str(key_tuple):
@@ -309,301 +893,213 @@ def _key_to_str(key_tuple):
     except Exception:
         return json.dumps(key_tuple, ensure_ascii=False)
 
-def send_email(subject: str, body: str, recipients: list[str]):
-    """Send email using available provider.
-
-    Provider selection order:
-      1) SendGrid HTTP API if SENDGRID_API_KEY is set
-      2) Mailgun HTTP API if MAILGUN_API_KEY and MAILGUN_DOMAIN are set
-      3) SMTP if SMTP_HOST/SMTP_PORT set
-      4) Otherwise dry-run (write to notification.log)
+def _run_blocking(deliver, *args) -> str:
+    """Run `deliver(client, *args)` to completion with a one-off client (legacy synchronous API).
 
-    Returns True on success, False on failure (and logs details to notification.log).
+    Inside a running event loop the coroutine runs on a helper thread, so
+    this blocks like the old httpx/smtplib calls did; prefer notify_email().
     """
-    # prepare common vars
-    from_addr = os.environ.get('FROM_EMAIL') or os.environ.get('SMTP_USER') or 'noreply@example.com'
+    async def _main():
+        async with new_client(2) as client:
+            return await deliver(client, *args)
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_main())
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(1) as ex:
+        return ex.submit(asyncio.run, _main()).result()
 
-    # 1) SendGrid
-    sendgrid_key = os.environ.get('SENDGRID_API_KEY')
-    if sendgrid_key:
-        try:
-            import httpx
-            payload = {
-                "personalizations": [{"to": [{"email": r} for r in recipients]}],
-                "from": {"email": from_addr},
-                "subject": subject,
-                "content": [{"type": "text/plain", "value": body}],
-            }
-            headers = {"Authorization": f"Bearer {sendgrid_key}", "Content-Type": "application/json"}
-            resp = httpx.post("https://api.sendgrid.com/v3/mail/send", json=payload, headers=headers, timeout=20)
-            if resp.status_code in (200, 202):
-                # record success
-                _append_history({
-                    'ts': datetime.utcnow().isoformat(),
-                    'method': 'sendgrid',
-                    'recipients': recipients,
-                    'subject': subject,
-                    'status': 'success',
-                    'detail': f'status={resp.status_code}'
-                })
-                return True
-            else:
-                with open('notification.log', 'a', encoding='utf-8') as f:
-                    f.write(f"SendGrid send failed: status={resp.status_code} body={resp.text} Subject: {subject} To: {recipients}\n")
-                _append_history({
-                    'ts': datetime.utcnow().isoformat(),
-                    'method': 'sendgrid',
-                    'recipients': recipients,
-                    'subject': subject,
-                    'status': 'failed',
-                    'detail': f'status={resp.status_code} body={resp.text}'
-                })
-                return False
-        except Exception as e:
-            with open('notification.log', 'a', encoding='utf-8') as f:
-                f.write(f"SendGrid exception: {e} Subject: {subject} To: {recipients}\n")
-            # fall through to try other providers
-
-    # 2) Mailgun
-    mailgun_key = os.environ.get('MAILGUN_API_KEY')
-    mailgun_domain = os.environ.get('MAILGUN_DOMAIN')
-    if mailgun_key and mailgun_domain:
-        try:
-            import httpx
-            url = f"https://api.mailgun.net/v3/{mailgun_domain}/messages"
-            auth = ("api", mailgun_key)
-            data = {"from": from_addr, "to": recipients, "subject": subject, "text": body}
-            resp = httpx.post(url, auth=auth, data=data, timeout=20)
-            if resp.status_code in (200, 202):
-                _append_history({
-                    'ts': datetime.utcnow().isoformat(),
-                    'method': 'mailgun',
-                    'recipients': recipients,
-                    'subject': subject,
-                    'status': 'success',
-                    'detail': f'status={resp.status_code}'
-                })
-                return True
-            else:
-                with open('notification.log', 'a', encoding='utf-8') as f:
-                    f.write(f"Mailgun send failed: status={resp.status_code} body={resp.text} Subject: {subject} To: {recipients}\n")
-                _append_history({
-                    'ts': datetime.utcnow().isoformat(),
-                    'method': 'mailgun',
-                    'recipients': recipients,
-                    'subject': subject,
-                    'status': 'failed',
-                    'detail': f'status={resp.status_code} body={resp.text}'
-                })
-                return False
-        except Exception as e:
-            with open('notification.log', 'a', encoding='utf-8') as f:
-                f.write(f"Mailgun exception: {e} Subject: {subject} To: {recipients}\n")
-            # fall through
-
-    # 3) SMTP fallback (existing behavior)
-    smtp_host = os.environ.get('SMTP_HOST')
-    smtp_port = int(os.environ.get('SMTP_PORT', '0')) if os.environ.get('SMTP_PORT') else None
-    smtp_user = os.environ.get('SMTP_USER')
-    smtp_pass = os.environ.get('SMTP_PASS')
-
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    msg['From'] = from_addr
-    msg['To'] = ', '.join(recipients)
-    msg.set_content(body)
-
-    if smtp_host and smtp_port:
-        try:
-            if smtp_port == 465:
-                with smtplib.SMTP_SSL(smtp_host, smtp_port, timeout=20) as s:
-                    if smtp_user and smtp_pass:
-                        s.login(smtp_user, smtp_pass)
-                    s.send_message(msg)
-            else:
-                with smtplib.SMTP(smtp_host, smtp_port, timeout=20) as s:
-                    s.ehlo()
-                    try:
-                        s.starttls()
-                    except Exception:
-                        pass
-                    if smtp_user and smtp_pass:
-                        s.login(smtp_user, smtp_pass)
-                    s.send_message(msg)
-            _append_history({
-                'ts': datetime.utcnow().isoformat(),
-                'method': 'smtp',
-                'recipients': recipients,
-                'subject': subject,
-                'status': 'success',
-                'detail': f'{smtp_host}:{smtp_port}'
-            })
-            return True
-        except Exception as e:
-            with open('notification.log', 'a', encoding='utf-8') as f:
-                f.write(f"SMTP send failed: {e}\nSubject: {subject}\nTo: {recipients}\n")
-            _append_history({
-                'ts': datetime.utcnow().isoformat(),
-                'method': 'smtp',
-                'recipients': recipients,
-                'subject': subject,
-                'status': 'failed',
-                'detail': str(e)
-            })
-            return False
-
-    # 4) dry-run: append to log
-    with open('notification.log', 'a', encoding='utf-8') as f:
-        f.write(f"DRY-RUN send: Subject: {subject}\nTo: {recipients}\nBody:\n{body}\n---\n")
-    _append_history({
-        'ts': datetime.utcnow().isoformat(),
-        'method': 'dry-run',
-        'recipients': recipients,
-        'subject': subject,
-        'status': 'dry-run',
-        'detail': ''
-    })
-    return False
+
+def send_email(subject: str, body: str, recipients: list[str]):
+    """Send email synchronously using the first configured provider (see notifier.deliver_email).
+
+    Returns True on success, False on failure or dry-run (details go to notification.log).
+    """
+    return _run_blocking(deliver_email, subject, body, recipients) == 'success'
 
 
 def send_line(message: str, tokens: list[str]):
     """Send a message via LINE Notify to each token in the list.
 
     tokens: list of LINE Notify access tokens.
-    Returns True if at least one send succeeded, False otherwise.
+    Returns True if at least one send succeeded, False otherwise (also when
+    every token is invalid; notifier.deliver_line tells these apart).
     """
-    if not tokens:
-        with open('notification.log', 'a', encoding='utf-8') as f:
-            f.write(f"DRY-RUN LINE send: message={message}\n---\n")
-        return False
+    return _run_blocking(deliver_line, message, tokens) == 'success'
+
+
+# notifications are stored in the durable outbox and delivered by its workers
+# while they run (app, poller); without workers (cron runner, scripts) each
+# poll delivers the jobs it stored with run_due() before returning
+_outbox = NotificationOutbox()
+
+
+def notify_email(subject: str, body: str, recipients: list[str], key: str | None = None):
+    """Queue an email; False when `key` was already queued or sent."""
+    return _outbox.enqueue_email(subject, body, recipients, key=key)
+
+
+def notify_line(message: str, tokens: list[str], key: str | None = None):
+    return _outbox.enqueue_line(message, tokens, key=key)
+
+
+async def _deliver_queued():
+    """Without outbox workers, send the jobs this poll stored (one client, worker code path)."""
+    if not _outbox.running:
+        await _outbox.run_due()
+
+
+def outbox() -> NotificationOutbox:
+    return _outbox
+
 
-    success_any = False
+@app.get('/metrics')
+async def metrics_endpoint():
+    """Prometheus metrics (poll stage histograms, restarts, fallbacks, deliveries)."""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get('/api/history')
+async def api_history(limit: int | None = 100, cursor: str | None = None, method: str | None = None,
+                      status: str | None = None, since: str | None = None, until: str | None = None):
+    """Return notification history (most recent first), one page at a time.
+
+    Filters: method, status, since (inclusive) / until (exclusive) on ts.
+    Pass the returned next_cursor to get the following (older) page; rotated
+    notifications.jsonl segments are included.
+    """
     try:
-        import httpx
+        out, next_cursor = history_reader().query(limit, cursor, method, status, since, until)
+        return JSONResponse({"ok": True, "history": out, "next_cursor": next_cursor})
+    except ValueError as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
     except Exception as e:
-        with open('notification.log', 'a', encoding='utf-8') as f:
-            f.write(f"LINE send failed (httpx not available): {e}\nMessage: {message}\n")
-        return False
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
-    for t in tokens:
-        try:
-            headers = {"Authorization": f"Bearer {t}"}
-            data = {"message": message}
-            resp = httpx.post('https://notify-api.line.me/api/notify', headers=headers, data=data, timeout=15)
-            if resp.status_code == 200:
-                success_any = True
-                _append_history({
-                    'ts': datetime.utcnow().isoformat(),
-                    'method': 'line',
-                    'tokens': [t[:8]],
-                    'subject': None,
-                    'message': message,
-                    'status': 'success',
-                    'detail': f'status={resp.status_code}'
-                })
-            else:
-                with open('notification.log', 'a', encoding='utf-8') as f:
-                    f.write(f"LINE send failed: status={resp.status_code} body={resp.text} token_prefix={t[:8]} Message: {message}\n")
-                _append_history({
-                    'ts': datetime.utcnow().isoformat(),
-                    'method': 'line',
-                    'tokens': [t[:8]],
-                    'subject': None,
-                    'message': message,
-                    'status': 'failed',
-                    'detail': f'status={resp.status_code} body={resp.text}'
-                })
-        except Exception as e:
-            with open('notification.log', 'a', encoding='utf-8') as f:
-                f.write(f"LINE exception: {e} token_prefix={t[:8]} Message: {message}\n")
-            _append_history({
-                'ts': datetime.utcnow().isoformat(),
-                'method': 'line',
-                'tokens': [t[:8]],
-                'subject': None,
-                'message': message,
-                'status': 'failed',
-                'detail': str(e)
-            })
-
-    return success_any
-
-
-def _append_history(entry: dict, path='notifications.jsonl'):
-    """Append a JSON line to notifications.jsonl. Keeps most recent entries write-only."""
+def _valid_date(s: str | None) -> bool:
     try:
-        with open(path, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        datetime.strptime(s or '', '%Y-%m-%d')
+        return True
     except Exception:
-        pass
+        return False
 
 
-@app.get('/api/history')
-async def api_history(limit: int | None = 100):
-    """Return recent notification history (most recent first)."""
-    path = 'notifications.jsonl'
+def _timeline(events: list[dict]):
+    """Group transitions per slot and derive the periods each slot was open (bookable).
+
+    Only 'available' is bookable: not_started / other neither open nor extend a period.
+    """
+    slots = {}
+    for ev in events:
+        key = (ev['date'], ev['time'], ev['service_cd'])
+        s = slots.get(key)
+        if s is None:
+            s = slots[key] = {'date': ev['date'], 'time': ev['time'], 'service_cd': ev['service_cd'],
+                              'status': None, 'open_periods': [], '_open': None}
+        ts = ev['ts']
+        if ev['new'] == 'available' and s['_open'] is None:
+            s['_open'] = ts
+        elif ev['new'] != 'available' and s['_open'] is not None:
+            s['open_periods'].append({'from': datetime.utcfromtimestamp(s['_open']).isoformat(),
+                                      'to': datetime.utcfromtimestamp(ts).isoformat(),
+                                      'seconds': int(ts - s['_open'])})
+            s['_open'] = None
+        s['status'] = ev['new']
     out = []
+    for s in slots.values():
+        if s['_open'] is not None:
+            s['open_periods'].append({'from': datetime.utcfromtimestamp(s['_open']).isoformat(), 'to': None,
+                                      'seconds': int(time.time() - s['_open'])})
+        del s['_open']
+        out.append(s)
+    out.sort(key=lambda x: (x['date'] or '', x['time'] or ''))
+    return out
+
+
+def _timeline_response(start: str, end: str | None, service_cd: str | None, limit: int):
+    if not _valid_date(start) or (end is not None and not _valid_date(end)):
+        return JSONResponse({"ok": False, "error": "dates must be YYYY-MM-DD"}, status_code=400)
+    limit = max(1, limit)
     try:
-        if not os.path.exists(path):
-            return JSONResponse({"ok": True, "history": []})
-        with open(path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        # read last `limit` lines
-        lines = lines[-limit:]
-        for ln in reversed(lines):
-            try:
-                out.append(json.loads(ln))
-            except Exception:
-                continue
-        return JSONResponse({"ok": True, "history": out})
+        events = _state_store().transitions(start, end, service_cd=service_cd, limit=limit + 1)
     except Exception as e:
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
-
-async def notify_once_for_starts(starts: list[str]):
-    """Check specified start dates (YYYY-MM-DD), return summary and send notifications for newly available slots.
-    Returns dict with summary.
+    # more than `limit` transitions: the last date returned may be incomplete (query again from it)
+    truncated = len(events) > limit
+    events = events[:limit]
+    slots = _timeline(events)
+    for ev in events:
+        ev['ts'] = datetime.utcfromtimestamp(ev['ts']).isoformat()
+    return JSONResponse({"ok": True, "slots": slots, "events": events, "truncated": truncated,
+                         "last_date": events[-1]['date'] if truncated and events else None})
+
+
+@app.get('/api/slots/timeline')
+async def api_slots_timeline(start: str, end: str | None = None, service_cd: str | None = None, limit: int = 5000):
+    """Status transitions (and open periods) of slots dated start..end.
+
+    At most `limit` transitions (oldest date first); `truncated` then says the
+    range had more and `last_date` is where to continue.
     """
-    recipients = _read_recipients()
-    if not recipients:
-        # nothing to do, but return candidates
-        recipients = []
+    return _timeline_response(start, end, service_cd, limit)
 
-    prev = _load_notified()  # dict: key_str -> last_status
-    new_notified = dict(prev)
-    produced = []
 
-    for s in starts:
+@app.get('/api/slots/{date}/timeline')
+async def api_slot_timeline(date: str, service_cd: str | None = None, limit: int = 5000):
+    """Status transitions (and open periods) of the slots on one date."""
+    return _timeline_response(date, None, service_cd, limit)
+
+async def _fetch_weeks_one_browser(starts: list[str]):
+    """Scrape `starts` in one Chromium (extra weeks in contexts of it); for callers without the pool."""
+    from playwright.async_api import async_playwright
+
+    url = "https://eipro.jp/takachiho1/eventCalendars/index"
+    async with async_playwright() as p:
+        t0 = time.monotonic()
+        browser = await p.chromium.launch(headless=True, args=launch_args())
+        _record_stage('browser_launch', (time.monotonic() - t0) * 1000)
         try:
-            items = await fetch_parsed_impl(s)
-        except Exception:
-            continue
-        for c in items:
-            key_tuple = _slot_key(c)
-            key_str = _key_to_str(key_tuple)
-            current_status = (c.get('status') or '')
-            prev_status = prev.get(key_str)
-
-            # if it's currently not full (available/other) and the previous
-            # recorded status was 'full' or absent or different, treat as new
-            if current_status != 'full':
-                if prev_status != current_status:
-                    produced.append(c)
-            # always update recorded status to current
-            new_notified[key_str] = current_status
-
-    # if there are new produced, send email
-    if produced and recipients:
-        subj = f"予約枠の空き候補が見つかりました ({len(produced)}件)"
-        lines = []
-        for p in produced:
-            lines.append(f"{p.get('date')} {p.get('time')}  status={p.get('status')} service_cd={p.get('attrs',{}) .get('service_cd')}\n  text={p.get('raw_text')}\n")
-        body = "\n".join(lines)
-        send_email(subj, body, recipients)
+            context = await browser.new_context()
+            await apply_profile(context)
+            page = await context.new_page()
+            _response_capture(page)
+            t0 = time.monotonic()
+            await page.goto(url, wait_until='networkidle', timeout=60000)
+            _record_stage('goto', (time.monotonic() - t0) * 1000)
+            await wait_calendar_ready(page, 'initial_ready')
+            return await fetch_weeks_with_page(page, starts)
+        finally:
+            await browser.close()
+
+
+async def _fetch_weeks_pool(starts: list[str]):
+    """Scrape `starts` concurrently on leased pool pages; PoolBusy is raised, not skipped."""
+    sem = asyncio.Semaphore(max(1, SCRAPE_CONCURRENCY))
+
+    async def _one(s):
+        async with sem:
+            return await fetch_parsed_impl(s)
+
+    fetched = await asyncio.gather(*(_one(s) for s in starts), return_exceptions=True)
+    for r in fetched:
+        if isinstance(r, PoolBusy):
+            # let the caller shed load instead of silently skipping weeks
+            raise r
+    return list(zip(starts, fetched))
 
-    # persist new_notified dict
-    _save_notified(new_notified)
 
-    return {'new_count': len(produced), 'notified': [_slot_key(x) for x in produced], 'recipients': recipients}
+async def notify_once_for_starts(starts: list[str]):
+    """Check specified start dates (YYYY-MM-DD), return summary and send notifications for newly available slots.
+    Returns dict with summary.
+
+    With the browser pool each week is scraped on its own leased page;
+    without it (cron runner, scripts) all weeks are scraped in a single
+    browser launched for this call.
+    """
+    fetch_weeks = _fetch_weeks_pool if _browser_pool is not None else _fetch_weeks_one_browser
+    return await notify_once_with_fetcher(fetch_weeks, starts)
 
 
 async def notify_once_with_page(page, starts: list[str]):
@@ -612,42 +1108,179 @@ async def notify_once_with_page(page, starts: list[str]):
     This mirrors notify_once_for_starts but calls `fetch_parsed_with_page` to avoid
     launching a new browser for each check.
     """
+    return await notify_once_with_fetcher(
+        lambda st: fetch_weeks_with_page(page, st, skip_unchanged=SKIP_UNCHANGED_WEEKS), starts)
+
+
+async def notify_once_with_fetcher(fetch_weeks, starts: list[str]):
+    """Diff and notify using `fetch_weeks(starts)` -> [(start, items-or-exception)].
+
+    Used by notify_once_for_starts, notify_once_with_page and by the
+    poller's HTTP engine, which all return the per-week shape of
+    `fetch_weeks_with_page`.
+    """
     recipients = _read_recipients()
     if not recipients:
         recipients = []
+    if not leadership().acquire():
+        return _follower_result(recipients)
+
+    try:
+        t0 = time.monotonic()
+        fetched = await fetch_weeks(starts)
+        scrape_ms = int((time.monotonic() - t0) * 1000)
+        weeks = []
+        changed = []
+        skipped = 0
+        missing = []
+        for s, r in fetched:
+            if r is WEEK_UNCHANGED:
+                skipped += 1
+                metrics.skipped_weeks.inc('unchanged')
+                continue
+            if isinstance(r, WeekNotFound):
+                missing.append(s)
+                metrics.skipped_weeks.inc('missing')
+            if isinstance(r, BaseException):
+                log_writer.log(f'fetch_with_page error for {s}: {r}\n')
+                continue
+            weeks.append(r)
+            changed.append(s)
 
-    prev = _load_notified()
-    new_notified = dict(prev)
-    produced = []
+        if not weeks:
+            # every week unchanged (or failed): nothing to diff or persist
+            res = {'new_count': 0, 'notified': [], 'recipients': recipients, 'scrape_ms': scrape_ms, 'skipped_weeks': skipped, 'missing_weeks': missing}
+            leadership().publish(res)
+            if len(missing) + skipped == len(fetched):
+                metrics.poll_succeeded()
+            return res
 
-    for s in starts:
-        try:
-            items = await fetch_parsed_with_page(page, s)
-        except Exception as e:
-            with open('notification.log', 'a', encoding='utf-8') as f:
-                f.write(f'fetch_with_page error for {s}: {e}\n')
-            continue
-        for c in items:
-            key_tuple = _slot_key(c)
-            key_str = _key_to_str(key_tuple)
-            current_status = (c.get('status') or '')
-            prev_status = prev.get(key_str)
-            if current_status != 'full':
-                if prev_status != current_status:
-                    produced.append(c)
-            new_notified[key_str] = current_status
+        # merge weeks into one deduped, sorted list (same shape as fetch_parsed_with_page)
+        items = _dedupe_and_sort([c for w in weeks for c in w])
+        # dates the weeks rendered (compact payloads list them even when full slots were filtered out)
+        dates = set()
+        for w in weeks:
+            dates.update(getattr(w, 'dates', None) or (c.get('date') for c in w if c.get('date')))
+        not_full_only = any(getattr(w, 'not_full_only', False) for w in weeks)
+        produced, events, persisted = _diff_and_notify(items, recipients, dates=dates, not_full_only=not_full_only)
+        # a week is only skipped later if its state is in the store; otherwise it is diffed again next poll
+        _commit_fingerprints(changed, persisted)
+        await _deliver_queued()
+
+        res = {'new_count': len(produced), 'notified': [_slot_key(x) for x in produced], 'recipients': recipients, 'scrape_ms': scrape_ms, 'skipped_weeks': skipped, 'missing_weeks': missing, 'events': _event_counts(events)}
+        leadership().publish(res)
+        if persisted:
+            metrics.poll_succeeded()
+        return res
+    finally:
+        # fingerprints not committed above (unchanged, failed or unsaved weeks) must not linger
+        _commit_fingerprints(starts, persisted=False)
+
+
+# only the holder of the scraper lease polls and notifies (see leader.py);
+# scripts call leadership('poller' / 'cron') first to label their lease
+_leader_lease = None
+
+
+def leadership(role: str | None = None) -> LeaderLease:
+    global _leader_lease
+    if _leader_lease is None:
+        _leader_lease = LeaderLease(role=role or 'app')
+    return _leader_lease
+
+
+def _follower_result(recipients: list[str]) -> dict:
+    """Result of a notify call made by a follower: the leader's last published poll."""
+    cur = leadership().current()
+    return {'new_count': 0, 'notified': [], 'recipients': recipients, 'follower': True,
+            'leader': cur['leader'], 'snapshot': cur['snapshot'], 'published_at': cur['published_at']}
+
+
+_diff = None
+
+
+def _diff_engine():
+    global _diff
+    if _diff is None:
+        _diff = DiffEngine(_state_store())
+    return _diff
+
+
+def _event_counts(events) -> dict:
+    out = {}
+    for ev in events:
+        out[ev.kind] = out.get(ev.kind, 0) + 1
+    return out
+
+
+def _slot_lines(slots: list) -> list[str]:
+    lines = []
+    for p in slots:
+        # compact records carry no text
+        text = f"\n  text={p.get('raw_text')}" if p.get('raw_text') else ''
+        lines.append(f"{p.get('date')} {p.get('time')}  status={p.get('status')} service_cd={p.get('attrs',{}) .get('service_cd')}{text}\n")
+    return lines
+
+
+def _slots_email(slots: list) -> tuple[str, str]:
+    subj = f"予約枠の空き候補が見つかりました ({len(slots)}件)"
+    return subj, "\n".join(_slot_lines(slots))
+
+
+def _diff_and_notify(items: list[dict], recipients: list[str], dates=None, not_full_only: bool = False):
+    """Diff `items` against the last known state, email slots that became not-full, persist.
+
+    Each recipient gets the slots its subscription filters match (all of
+    them without filters). `dates` are the dates the scrape covered (known slots missing there are
+    reported as disappeared, or as full with the not-full-only payload).
+    Returns (produced slots, change events, whether the new state was saved).
+    """
+    engine = _diff_engine()
+    t0 = time.monotonic()
+    events = engine.diff(items, dates, not_full_only=not_full_only)
+    _record_stage('diff', (time.monotonic() - t0) * 1000)
+    produced = [ev.item for ev in events if ev.notify]
 
     if produced and recipients:
-        subj = f"予約枠の空き候補が見つかりました ({len(produced)}件)"
-        lines = []
-        for p in produced:
-            lines.append(f"{p.get('date')} {p.get('time')}  status={p.get('status')} service_cd={p.get('attrs',{}) .get('service_cd')}\n  text={p.get('raw_text')}\n")
-        body = "\n".join(lines)
-        send_email(subj, body, recipients)
+        by_item = {id(ev.item): ev for ev in events if ev.notify}
+        urgent = set()
+        routes = subscriptions().index().route(produced, recipients, urgent)
+        if _outbox.digest_enabled:
+            # per-recipient digests: changes are collected for DIGEST_WINDOW seconds (see notifier)
+            for email, slots in routes.items():
+                _outbox.add_digest(email, "予約枠の空き候補が見つかりました ({n}件)", _slot_lines(slots),
+                                   [notification_key([by_item[id(x)]]) for x in slots], urgent=email in urgent)
+        else:
+            # one email per distinct slot set: recipients with the same matches share a job
+            groups = {}
+            for email, slots in routes.items():
+                groups.setdefault(tuple(id(x) for x in slots), (slots, []))[1].append(email)
+            for slots, emails in groups.values():
+                subj, body = _slots_email(slots)
+                # the job is stored before the state commit: a crash in between re-detects
+                # the same transitions next poll, and the same key makes that a no-op
+                notify_email(subj, body, emails,
+                             key=notification_key([by_item[id(x)] for x in slots], 'email:' + ','.join(sorted(emails))))
+
+    t0 = time.monotonic()
+    persisted = True
+    try:
+        engine.commit(events)
+    except Exception as e:
+        persisted = False
+        log_writer.log(f'state save error: {e}\n')
+    _record_stage('persist', (time.monotonic() - t0) * 1000)
+    return produced, events, persisted
 
-    _save_notified(new_notified)
 
-    return {'new_count': len(produced), 'notified': [_slot_key(x) for x in produced], 'recipients': recipients}
+async def notify_changed_slots(items: list[dict]):
+    """Push-mode entry point: diff and notify only the slots a page observer reported."""
+    recipients = _read_recipients() or []
+    if not leadership().acquire():
+        return _follower_result(recipients)
+    produced, events, _ = _diff_and_notify(_dedupe_and_sort(items), recipients)
+    await _deliver_queued()
+    return {'new_count': len(produced), 'notified': [_slot_key(x) for x in produced], 'recipients': recipients, 'pushed': len(items), 'events': _event_counts(events)}
 
 _bg_task = None
 _bg_task_cancel = False
@@ -662,8 +1295,7 @@ async def _background_loop():
             s2 = (today + timedelta(days=7)).strftime('%Y-%m-%d')
             await notify_once_for_starts([s1, s2])
         except Exception as e:
-            with open('notification.log', 'a', encoding='utf-8') as f:
-                f.write(f'Background error: {e}\n')
+            log_writer.log(f'Background error: {e}\n')
         await asyncio.sleep(POLL_INTERVAL)
 
 
@@ -672,6 +1304,10 @@ async def fetch_parsed(start: str | None = None):
     try:
         data = await fetch_parsed_impl(start)
         return JSONResponse({"ok": True, "source": "playwright", "data": data})
+    except PoolBusy as e:
+        return _busy_response(e)
+    except WeekNotFound as e:
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=404)
     except Exception as e:
         import traceback as _tb
         return JSONResponse({"ok": False, "error": str(e), "trace": _tb.format_exc()}, status_code=500)
@@ -698,6 +1334,8 @@ async def api_notify_now(start: str | None = None):
 
         res = await notify_once_for_starts(starts)
         return JSONResponse({"ok": True, "result": res})
+    except PoolBusy as e:
+        return _busy_response(e)
     except Exception as e:
         import traceback as _tb
         return JSONResponse({"ok": False, "error": str(e), "trace": _tb.format_exc()}, status_code=500)
@@ -706,22 +1344,42 @@ async def api_notify_now(start: str | None = None):
 @app.get('/api/recipients')
 async def api_recipients():
     lst = _read_recipients()
-    return JSONResponse({"ok": True, "count": len(lst), "recipients": lst})
+    subs = subscriptions().all()
+    return JSONResponse({"ok": True, "count": len(lst), "recipients": lst,
+                         "subscriptions": {e: subs[e] for e in lst if e in subs}})
 
 
 @app.post('/api/recipients')
 async def api_add_recipient(request: Request):
-    """Add a recipient. JSON body: {"email": "addr@example.com"} """
+    """Add a recipient and/or set its subscription filters.
+
+    JSON body: {"email": "addr@example.com", "filters": [{...}]} ("filters"
+    is optional; see subscriptions.py for the fields; [] or null removes them
+    so the recipient gets every slot again).
+    """
     try:
         data = await request.json()
         email = (data.get('email') or '').strip()
         if not email:
             return JSONResponse({"ok": False, "error": "email required"}, status_code=400)
-        ok = _add_recipient(email)
-        if ok:
-            return JSONResponse({"ok": True, "added": email})
-        else:
-            return JSONResponse({"ok": False, "error": "already exists or write failed"}, status_code=400)
+        if 'filters' not in data:
+            ok = _add_recipient(email)
+            if ok:
+                return JSONResponse({"ok": True, "added": email})
+            else:
+                return JSONResponse({"ok": False, "error": "already exists or write failed"}, status_code=400)
+        filters = data.get('filters')
+        if filters is not None and not isinstance(filters, list):
+            filters = [filters]
+        try:
+            ok = subscriptions().set(email, filters)
+        except ValueError as e:
+            return JSONResponse({"ok": False, "error": str(e)}, status_code=400)
+        if not ok:
+            return JSONResponse({"ok": False, "error": "write failed"}, status_code=500)
+        added = _add_recipient(email)
+        return JSONResponse({"ok": True, "added" if added else "updated": email,
+                             "filters": subscriptions().get(email)})
     except Exception as e:
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
@@ -734,6 +1392,7 @@ async def api_delete_recipient(email: str | None = None):
             return JSONResponse({"ok": False, "error": "email required"}, status_code=400)
         ok = _remove_recipient(email)
         if ok:
+            subscriptions().set(email, None)
             return JSONResponse({"ok": True, "removed": email})
         else:
             return JSONResponse({"ok": False, "error": "not found or write failed"}, status_code=400)
@@ -749,29 +1408,76 @@ async def api_check(start: str | None = None):
         notify = [d for d in data if (d.get('status') or '') != 'full']
         recips = _read_recipients()
         return JSONResponse({"ok": True, "candidates": notify, "recipients": recips})
+    except PoolBusy as e:
+        return _busy_response(e)
     except Exception as e:
         import traceback as _tb
         return JSONResponse({"ok": False, "error": str(e), "trace": _tb.format_exc()}, status_code=500)
 
 
+@app.get('/api/scrape_stats')
+async def api_scrape_stats():
+    """Per-stage scrape timings (goto, readiness waits, week switch, evaluate)."""
+    return JSONResponse({"ok": True, "stages": scrape_stage_stats(), "extract": {"mode": EXTRACT_MODE, **_extract_counters}})
+
+
+@app.get('/api/pool')
+async def api_pool():
+    """Browser pool status (idle/leased pages, waiters, rejections, replacements)."""
+    if _browser_pool is None:
+        return JSONResponse({"ok": True, "pool": None})
+    return JSONResponse({"ok": True, "pool": _browser_pool.status()})
+
+
+@app.get('/api/outbox')
+async def api_outbox():
+    """Notification outbox: queue depth, in-flight deliveries, outcomes and latency."""
+    return JSONResponse({"ok": True, "outbox": _outbox.status()})
+
+
+@app.get('/api/leader')
+async def api_leader():
+    """Scraper lease holder and the snapshot it last published."""
+    cur = leadership().current()
+    return JSONResponse({"ok": True, "me": leadership().holder, **cur})
+
+
 @app.on_event('startup')
 async def _startup():
-    global _bg_task
+    global _bg_task, _browser_pool
     # create sample recipients.txt if missing
     if not os.path.exists('recipients.txt'):
         with open('recipients.txt', 'w', encoding='utf-8') as f:
             f.write('# Add one email per line, for example:\n# your@email.example\n')
-    # start background notifier
+    # start the warm browser pool before anything scrapes
+    if _browser_pool is None and os.environ.get('BROWSER_POOL_SIZE', '2') != '0':
+        pool = BrowserPool()
+        try:
+            await pool.start()
+            _browser_pool = pool
+        except Exception as e:
+            log_writer.log(f'Browser pool start failed, falling back to per-call browsers: {e}\n')
+            await pool.stop()
+    # deliver notifications off the request/poll path
+    await _outbox.start()
+    # start background notifier (it only scrapes while this process holds the scraper lease)
+    leadership().keepalive()
     if _bg_task is None:
         _bg_task = asyncio.create_task(_background_loop())
 
 
 @app.on_event('shutdown')
 async def _shutdown():
-    global _bg_task_cancel, _bg_task
+    global _bg_task_cancel, _bg_task, _browser_pool
     _bg_task_cancel = True
     if _bg_task:
         try:
             await _bg_task
         except Exception:
             pass
+    if _browser_pool is not None:
+        pool, _browser_pool = _browser_pool, None
+        await pool.stop()
+    await _outbox.stop()
+    log_writer.close()
+    leadership().release()
@@ -0,0 +1,207 @@
+"""Warm Playwright browser pool shared by the FastAPI endpoints and the background loop.
+
+Launching Chromium costs several seconds, so the app starts a small number of
+browsers once (on startup) and keeps pre-navigated pages in separate
+BrowserContexts. Callers lease a page with::
+
+    async with pool.lease() as page:
+        await fetch_parsed_with_page(page, start)
+
+Concurrency is bounded by the number of pages. Callers beyond that wait in a
+queue; when the queue is full (or the wait times out) `PoolBusy` is raised so
+the HTTP layer can answer 503 instead of launching more browsers.
+Leased pages are health-checked and replaced (browser relaunched if needed)
+when they have died. The pool remembers when each page last loaded the
+calendar (`page_age()`), so callers can reuse a recently loaded page instead
+of navigating again on every lease.
+"""
+import asyncio
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager
+
+import metrics
+from page_profile import apply_profile, launch_args
+
+CALENDAR_URL = "https://eipro.jp/takachiho1/eventCalendars/index"
+
+
+class PoolBusy(Exception):
+    """No page could be leased: wait queue full, acquire timed out or pool not started."""
+
+
+class BrowserPool:
+    def __init__(self, size: int | None = None, browsers: int | None = None,
+                 max_waiters: int | None = None, acquire_timeout: float | None = None,
+                 url: str = CALENDAR_URL):
+        self.size = max(1, size or int(os.environ.get('BROWSER_POOL_SIZE', '2')))
+        self.browsers = max(1, browsers or int(os.environ.get('BROWSER_POOL_BROWSERS', '1')))
+        self.max_waiters = max_waiters if max_waiters is not None else int(os.environ.get('BROWSER_POOL_MAX_WAITERS', '8'))
+        self.acquire_timeout = acquire_timeout or float(os.environ.get('BROWSER_POOL_ACQUIRE_TIMEOUT', '30'))
+        self.url = url
+        self._pw = None
+        self._browsers = []
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._waiters = 0
+        self._leased = 0
+        self._started = False
+        self._launch_lock = asyncio.Lock()
+        self._loaded_at = weakref.WeakKeyDictionary()   # page -> monotonic time of its last load
+        self.stats = {'leases': 0, 'rejected': 0, 'replaced': 0, 'browser_restarts': 0}
+
+    async def start(self):
+        from playwright.async_api import async_playwright
+
+        self._pw = await async_playwright().start()
+        for _ in range(self.browsers):
+            self._browsers.append(await self._launch())
+        for i in range(self.size):
+            self._idle.put_nowait(await self._new_entry(i % self.browsers))
+        self._started = True
+
+    async def stop(self):
+        self._started = False
+        while not self._idle.empty():
+            entry = self._idle.get_nowait()
+            await self._close_entry(entry)
+        for b in self._browsers:
+            try:
+                await b.close()
+            except Exception:
+                pass
+        self._browsers = []
+        if self._pw is not None:
+            try:
+                await self._pw.stop()
+            except Exception:
+                pass
+            self._pw = None
+
+    async def _launch(self):
+        t0 = time.monotonic()
+        browser = await self._pw.chromium.launch(headless=True, args=launch_args())
+        metrics.record_stage('browser_launch', (time.monotonic() - t0) * 1000)
+        return browser
+
+    async def _browser(self, idx: int):
+        """Return browser `idx`, relaunching it if it has disconnected."""
+        async with self._launch_lock:
+            browser = self._browsers[idx]
+            if not browser.is_connected():
+                try:
+                    await browser.close()
+                except Exception:
+                    pass
+                browser = await self._launch()
+                self._browsers[idx] = browser
+                self.stats['browser_restarts'] += 1
+                metrics.browser_restarts.inc('pool')
+            return browser
+
+    async def _new_entry(self, idx: int):
+        browser = await self._browser(idx)
+        context = await browser.new_context()
+        await apply_profile(context)
+        page = await context.new_page()
+        try:
+            await page.goto(self.url, wait_until='networkidle', timeout=60000)
+            self.mark_loaded(page)
+        except Exception:
+            # page stays usable; callers navigate again before scraping
+            pass
+        return {'browser': idx, 'context': context, 'page': page}
+
+    def mark_loaded(self, page):
+        """Record that `page` has just (re)loaded the calendar."""
+        self._loaded_at[page] = time.monotonic()
+
+    def page_age(self, page) -> float | None:
+        """Seconds since `page` last loaded the calendar; None if it never did."""
+        loaded = self._loaded_at.get(page)
+        return None if loaded is None else time.monotonic() - loaded
+
+    async def _close_entry(self, entry):
+        try:
+            await entry['context'].close()
+        except Exception:
+            pass
+
+    async def _healthy(self, entry) -> bool:
+        page = entry['page']
+        try:
+            if page.is_closed() or not self._browsers[entry['browser']].is_connected():
+                return False
+            await asyncio.wait_for(page.evaluate('1'), timeout=5)
+            return True
+        except Exception:
+            return False
+
+    async def _replace(self, entry):
+        await self._close_entry(entry)
+        new_entry = await self._new_entry(entry['browser'])
+        self.stats['replaced'] += 1
+        return new_entry
+
+    async def _acquire(self):
+        if not self._started:
+            raise PoolBusy('browser pool not started')
+        # callers already waiting first consume the idle pages; shed load once
+        # the queue of callers that will really have to wait is full
+        if self._waiters - self._idle.qsize() >= self.max_waiters:
+            self.stats['rejected'] += 1
+            raise PoolBusy(f'browser pool saturated ({self._waiters} waiting)')
+        self._waiters += 1
+        try:
+            entry = await asyncio.wait_for(self._idle.get(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.stats['rejected'] += 1
+            raise PoolBusy(f'no page available within {self.acquire_timeout}s')
+        finally:
+            self._waiters -= 1
+        if not await self._healthy(entry):
+            try:
+                entry = await self._replace(entry)
+            except Exception:
+                # keep pool capacity: return the dead entry, it is retried on next lease
+                self._idle.put_nowait(entry)
+                raise
+        self._leased += 1
+        self.stats['leases'] += 1
+        return entry
+
+    def _release(self, entry):
+        self._leased -= 1
+        if self._started:
+            self._idle.put_nowait(entry)
+        else:
+            asyncio.ensure_future(self._close_entry(entry))
+
+    @asynccontextmanager
+    async def lease(self):
+        """Lease a warm page. Raises PoolBusy when the pool cannot serve the request."""
+        entry = await self._acquire()
+        try:
+            yield entry['page']
+        except Exception:
+            # scrape failed: replace the page now if it is the page that broke
+            if not await self._healthy(entry):
+                try:
+                    entry = await self._replace(entry)
+                except Exception:
+                    pass
+            raise
+        finally:
+            self._release(entry)
+
+    def status(self) -> dict:
+        return {
+            'started': self._started,
+            'size': self.size,
+            'browsers': self.browsers,
+            'idle': self._idle.qsize(),
+            'leased': self._leased,
+            'waiters': self._waiters,
+            'max_waiters': self.max_waiters,
+            **self.stats,
+        }
@@ -0,0 +1,363 @@
+"""Turn calendar data into slot dicts (the shape returned by `app.fetch_parsed_with_page`).
+
+    {'date': 'YYYY-MM-DD', 'time': 'HH:MM', 'status': 'available'|'full'|'not_started'|'other',
+     'raw_text': '...', 'attrs': {'service_cd', 'multi_edit_key', 'icon_class',
+                                  'icon_color', 'bg', 'start_raw', 'end_raw'}}
+
+Shared by the DOM path (classification of evaluated containers) and the
+network-response extraction mode, which parses the calendar's own XHR/fetch
+responses (JSON, or HTML fragments containing the service_unit markup)
+instead of scraping the rendered DOM.
+
+The poller's compact DOM path classifies in the page and ships parallel
+arrays instead; `slots_from_columns` decodes them into `SlotRecord`s, which
+answer the same `.get()` / `[]` lookups as the slot dicts.
+"""
+import asyncio
+import json
+import re
+
+_START_RE = re.compile(r"(\d{4})[/-](\d{2})[/-](\d{2})[T\s]?(\d{2}):(\d{2})")
+_START_RE2 = re.compile(r"(\d{4}-\d{2}-\d{2})T?(\d{2}:\d{2})")
+_STYLE_COLOR_RE = re.compile(r"(?:^|;)\s*color\s*:\s*([^;]+)", re.I)
+_STYLE_BG_RE = re.compile(r"background(?:-color)?\s*:\s*([^;]+)", re.I)
+
+
+def parse_start(start_raw: str):
+    """Return (date 'YYYY-MM-DD', time 'HH:MM') from a service start datetime, or (None, None)."""
+    m = _START_RE.search(start_raw or '')
+    if m:
+        return f"{m.group(1)}-{m.group(2)}-{m.group(3)}", f"{m.group(4)}:{m.group(5)}"
+    m2 = _START_RE2.search(start_raw or '')
+    if m2:
+        return m2.group(1), m2.group(2)
+    return None, None
+
+
+def classify_status(icon_class: str, icon_color: str, bg: str, text: str) -> str:
+    """Classify a slot from its icon, icon colour, container background and text."""
+    if icon_class and 'fa-times' in icon_class:
+        return 'full'
+    if icon_color and ('#f803' in icon_color or 'rgb(248' in icon_color or 'red' in icon_color):
+        return 'full'
+    if bg and (('#C0C0C0' in bg) or ('rgb(192' in bg) or ('gray' in bg)):
+        return 'full'
+    if '〇' in text or '○' in text:
+        return 'available'
+    if icon_class and ('fa-circle' in icon_class or 'fa-check' in icon_class):
+        return 'available'
+    if '砂' in text or '砂時計' in text or (icon_class and 'hourglass' in icon_class):
+        return 'not_started'
+    return 'other'
+
+
+def make_slot(start_raw='', end_raw='', service_cd='', multi='', icon_class='', icon_color='', bg='', text='', status=None):
+    """Build one slot dict; `status` is classified from the other fields when not given."""
+    start_raw = (start_raw or '').strip()
+    end_raw = (end_raw or '').strip()
+    text = (text or '').strip()
+    icon_class = (icon_class or '').strip()
+    icon_color = (icon_color or '').strip()
+    bg = (bg or '').strip()
+    date, tm = parse_start(start_raw)
+    return {
+        'date': date,
+        'time': tm,
+        'status': status or classify_status(icon_class, icon_color, bg, text),
+        'raw_text': text,
+        'attrs': {
+            'service_cd': service_cd or '',
+            'multi_edit_key': multi or '',
+            'icon_class': icon_class,
+            'icon_color': icon_color,
+            'bg': bg,
+            'start_raw': start_raw,
+            'end_raw': end_raw,
+        },
+    }
+
+
+# status codes of the compact payload (index = code; must match the in-page classifier)
+STATUS_CODES = ('available', 'full', 'not_started', 'other')
+
+
+class SlotRecord:
+    """Slot decoded from the compact payload: the fields the diff and notifications use.
+
+    `get('attrs')` returns the service_cd/start_raw subset of the dict
+    shape; `raw_text` is not shipped and reads as ''. `to_dict()` gives the
+    full dict shape for JSON output.
+    """
+
+    __slots__ = ('date', 'time', 'status', 'service_cd', 'start_raw')
+
+    def __init__(self, date, time, status, service_cd, start_raw):
+        self.date = date
+        self.time = time
+        self.status = status
+        self.service_cd = service_cd
+        self.start_raw = start_raw
+
+    def get(self, key, default=None):
+        if key == 'attrs':
+            return {'service_cd': self.service_cd, 'start_raw': self.start_raw}
+        if key == 'raw_text':
+            return ''
+        if key in self.__slots__:
+            return getattr(self, key)
+        return default
+
+    def __getitem__(self, key):
+        if key not in self.__slots__ and key not in ('attrs', 'raw_text'):
+            raise KeyError(key)
+        return self.get(key)
+
+    def __repr__(self):
+        return f'SlotRecord({self.date} {self.time} {self.status} {self.service_cd})'
+
+    def to_dict(self) -> dict:
+        d = make_slot(start_raw=self.start_raw, service_cd=self.service_cd, status=self.status)
+        d['date'], d['time'] = self.date, self.time
+        return d
+
+
+class SlotColumns(list):
+    """Decoded compact payload: SlotRecords plus the dates the page rendered.
+
+    With the not-full-only filter `dates` still lists every rendered date, so
+    the diff can tell a filtered (full) slot from a date it never saw.
+    """
+
+    def __init__(self, records=(), dates=(), not_full_only=False):
+        super().__init__(records)
+        self.dates = set(dates)
+        self.not_full_only = not_full_only
+
+
+def slots_from_columns(cols: dict) -> SlotColumns:
+    """Decode the compact in-page payload.
+
+    `cols` holds parallel arrays `d` (index into `dates`), `t` ('HH:MM'),
+    `s` (STATUS_CODES index) and `c` (index into `cds`, the service_cd
+    dictionary); `nf` is set when full slots were filtered out; `r` maps a row index to its raw start value when that is not
+    the canonical 'YYYY/MM/DD HH:MM:00' rebuilt from date and time.
+    """
+    if not cols:
+        return SlotColumns()
+    dates, cds, raw = cols.get('dates') or [], cols.get('cds') or [], cols.get('r') or {}
+    out = []
+    for i, (di, tm, sc, ci) in enumerate(zip(cols.get('d') or [], cols.get('t') or [], cols.get('s') or [], cols.get('c') or [])):
+        date = dates[di] if di is not None and di >= 0 else None
+        start_raw = raw.get(str(i))
+        if start_raw is None:
+            start_raw = f"{date.replace('-', '/')} {tm}:00" if date and tm else ''
+        out.append(SlotRecord(date, tm, STATUS_CODES[sc] if 0 <= sc < len(STATUS_CODES) else 'other', cds[ci], start_raw))
+    return SlotColumns(out, dates, bool(cols.get('nf')))
+
+
+def dedupe_and_sort(results: list[dict]):
+    """Drop duplicate slots (same date/time/service_cd/start_raw) and sort by date, time."""
+    seen = set()
+    deduped = []
+    for r in results:
+        key = (r.get('date'), r.get('time'), r.get('attrs', {}).get('service_cd'), r.get('attrs', {}).get('start_raw'))
+        if key in seen:
+            continue
+        seen.add(key)
+        deduped.append(r)
+
+    def sort_key(x):
+        d = x.get('date') or '9999-12-31'
+        t = x.get('time') or '99:99'
+        return (d, t)
+
+    deduped.sort(key=sort_key)
+    return deduped
+
+
+def slots_from_html(html: str) -> list[dict]:
+    """Parse service_unit markup (page or XHR fragment) into slot dicts.
+
+    Mirrors the DOM evaluate snippet. Only inline styles are available here, so
+    a background colour that comes from a stylesheet is not seen; the network
+    mode is verified against the DOM path for that reason.
+    """
+    if not html or 'service_unit_service_start_datetime' not in html:
+        return []
+    try:
+        from bs4 import BeautifulSoup
+    except Exception:
+        return []
+    soup = BeautifulSoup(html, 'html.parser')
+    out = []
+    for inp in soup.select('input.service_unit_service_start_datetime'):
+        container = inp.parent
+        c = container
+        for _ in range(8):
+            if c is None:
+                break
+            if 'service_unit' in ' '.join(c.get('class') or []):
+                container = c
+                break
+            c = c.parent
+
+        def val(cls):
+            el = container.select_one(cls)
+            if el is None:
+                return ''
+            return el.get('value') or el.get_text() or ''
+
+        icon = container.find('i')
+        icon_class = ' '.join(icon.get('class') or []) if icon is not None else ''
+        m = _STYLE_COLOR_RE.search(icon.get('style') or '') if icon is not None else None
+        icon_color = m.group(1).strip() if m else ''
+        m = _STYLE_BG_RE.search(container.get('style') or '')
+        bg = m.group(1).strip() if m else ''
+        out.append(make_slot(
+            start_raw=inp.get('value') or '',
+            end_raw=val('.service_unit_service_end_datetime'),
+            service_cd=val('.service_unit_service_cd'),
+            multi=val('.service_unit_service_multi_edit_key'),
+            icon_class=icon_class,
+            icon_color=icon_color,
+            bg=bg,
+            text=container.get_text(' ', strip=True)[:300],
+        ))
+    return out
+
+
+def _truthy(v) -> bool:
+    return str(v).strip().lower() in ('1', 'true', 't', 'yes')
+
+
+def _json_status(obj: dict) -> str | None:
+    for k in ('ordable', 'is_ordable', 'orderable'):
+        if k in obj:
+            return 'available' if _truthy(obj[k]) else 'full'
+    for k, v in obj.items():
+        lk = k.lower()
+        if any(w in lk for w in ('remain', 'stock', 'vacan', 'rest_')):
+            try:
+                return 'available' if float(v) > 0 else 'full'
+            except Exception:
+                continue
+    return None
+
+
+def _field(obj: dict, suffix: str):
+    for k, v in obj.items():
+        if k.lower().endswith(suffix) and isinstance(v, (str, int, float)):
+            return str(v)
+    return ''
+
+
+def slots_from_json(data) -> list[dict]:
+    """Walk a decoded JSON document and collect slot-like objects.
+
+    An object is a slot when it has a `*start_datetime` field. String values
+    that carry service_unit HTML are parsed with `slots_from_html`.
+    """
+    out = []
+    stack = [data]
+    while stack:
+        cur = stack.pop()
+        if isinstance(cur, dict):
+            start_raw = _field(cur, 'start_datetime')
+            if start_raw:
+                icon_class = _field(cur, 'icon_class') or _field(cur, 'icon')
+                icon_color = _field(cur, 'icon_color') or _field(cur, 'color')
+                bg = _field(cur, 'bg') or _field(cur, 'background_color')
+                text = _field(cur, 'text') or _field(cur, 'mark')
+                status = _json_status(cur)
+                if status is None and not (icon_class or icon_color or bg or text):
+                    status = 'other'
+                out.append(make_slot(
+                    start_raw=start_raw,
+                    end_raw=_field(cur, 'end_datetime'),
+                    service_cd=_field(cur, 'service_cd'),
+                    multi=_field(cur, 'multi_edit_key'),
+                    icon_class=icon_class,
+                    icon_color=icon_color,
+                    bg=bg,
+                    text=text,
+                    status=status,
+                ))
+                continue
+            stack.extend(cur.values())
+        elif isinstance(cur, list):
+            stack.extend(cur)
+        elif isinstance(cur, str) and 'service_unit_service_start_datetime' in cur:
+            out.extend(slots_from_html(cur))
+    return out
+
+
+def slots_from_body(body: str, content_type: str = '') -> list[dict]:
+    """Parse a response body (JSON or HTML) into slot dicts; [] when nothing matches."""
+    ctype = (content_type or '').lower()
+    if 'json' in ctype or body[:1] in ('{', '['):
+        try:
+            return slots_from_json(json.loads(body))
+        except Exception:
+            pass
+    return slots_from_html(body)
+
+
+class ResponseCapture:
+    """Collect slots from a page's own calendar responses via Playwright response events.
+
+    `reset()` before triggering a load (goto or week switch), `await settle()`
+    after the calendar is rendered, then read `slots`. `disabled` is set by the
+    caller when the captured data failed verification against the DOM.
+
+    Only XHR/fetch responses are read: the calendar document itself is large
+    and its slots are already rendered, so the initial page load is left to
+    the DOM path.
+    """
+
+    RESOURCE_TYPES = ('xhr', 'fetch')
+    MAX_BODY = 2 * 1024 * 1024
+
+    def __init__(self, page, host: str = 'eipro.jp'):
+        self.host = host
+        self.slots: list[dict] = []
+        self.responses = 0
+        self.uses = 0
+        self.disabled = False
+        self._pending = set()
+        page.on('response', self._on_response)
+
+    def reset(self):
+        self.slots = []
+        self.responses = 0
+
+    def _on_response(self, response):
+        try:
+            if response.request.resource_type not in self.RESOURCE_TYPES:
+                return
+            if self.host not in response.url:
+                return
+            ctype = (response.headers.get('content-type') or '').lower()
+            if 'json' not in ctype and 'html' not in ctype:
+                return
+        except Exception:
+            return
+        task = asyncio.ensure_future(self._read(response, ctype))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _read(self, response, ctype: str):
+        try:
+            body = await response.text()
+        except Exception:
+            return
+        if len(body) > self.MAX_BODY:
+            return
+        slots = slots_from_body(body, ctype)
+        if slots:
+            self.slots.extend(slots)
+            self.responses += 1
+
+    async def settle(self, timeout: float = 2.0):
+        """Wait for response bodies still being read."""
+        if self._pending:
+            await asyncio.wait(list(self._pending), timeout=timeout)
@@ -0,0 +1,240 @@
+"""Paged, newest-first reads of notifications.jsonl and its rotated segments.
+
+The live file is read backwards in HISTORY_BLOCK byte blocks, so a page
+costs the lines it returns (plus the ones filters drop), not the size of
+the file. A sparse offset index (the byte offset and ts of every
+HISTORY_INDEX_EVERY-th line) is extended incrementally as the file grows
+and lets a cursor or `until` jump straight to the right place; it is
+rebuilt when the file is truncated (logrotate copytruncate) or replaced.
+
+Rotated segments (notifications.jsonl.1, .2.gz, ... or dateext -YYYYMMDD
+names, see scripts/logrotate_auto_notification) are read newest first after
+the live file. Plain segments are read like the live file; gzip segments
+cannot seek, so the decompressed lines of the last HISTORY_GZ_CACHE of them
+are kept in memory (they never change once rotated).
+
+Entries are assumed to be appended in ts order (the ts written by
+notifier). A cursor is the ts of the last returned entry plus how many
+entries with that same ts were already passed.
+"""
+import base64
+import bisect
+import glob
+import gzip
+import json
+import os
+import re
+from collections import OrderedDict
+
+_TS_RE = re.compile(rb'"ts":\s*"([^"]*)"')
+
+
+def _ts(line: bytes) -> str:
+    m = _TS_RE.search(line)
+    return m.group(1).decode('ascii', 'replace') if m else ''
+
+
+def encode_cursor(ts: str, skip: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([ts, skip]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    """(ts, skip) of a cursor; ValueError when it is malformed."""
+    try:
+        ts, skip = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return str(ts), int(skip)
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+def _backward(f, end: int, block: int):
+    """Yield the complete lines of `f` before byte `end`, last first."""
+    pos = end
+    buf = b''
+    while pos > 0:
+        step = min(block, pos)
+        pos -= step
+        f.seek(pos)
+        buf = f.read(step) + buf
+        lines = buf.split(b'\n')
+        buf = lines[0]
+        for ln in reversed(lines[1:]):
+            if ln.strip():
+                yield ln
+    if buf.strip():
+        yield buf
+
+
+class _PlainSegment:
+    """Seekable file with a sparse (ts, offset) index; used for the live file too."""
+
+    def __init__(self, path: str, block: int, every: int):
+        self.path = path
+        self.block = block
+        self.every = every
+        self._ident = None
+        self._end = 0           # bytes indexed so far (always at a line start)
+        self._lines = 0
+        self._ts: list[str] = []
+        self._offsets: list[int] = []
+        self.first_ts = None
+        self.last_ts = None
+
+    def refresh(self):
+        """Extend the index over appended lines (rebuild after truncation/replacement)."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            self._ident, self._end, self._lines, self._ts, self._offsets = None, 0, 0, [], []
+            self.first_ts = self.last_ts = None
+            return
+        ident = (st.st_dev, st.st_ino)
+        if ident != self._ident or st.st_size < self._end:
+            self._ident, self._end, self._lines, self._ts, self._offsets = ident, 0, 0, [], []
+            self.first_ts = None
+        if st.st_size == self._end:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._end)
+            pos = self._end
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break       # being written; index it next time
+                if line.strip():
+                    if self.first_ts is None:
+                        self.first_ts = _ts(line)
+                    if self._lines % self.every == 0:
+                        self._ts.append(_ts(line))
+                        self._offsets.append(pos)
+                    self._lines += 1
+                    self.last_ts = _ts(line)
+                pos += len(line)
+            self._end = pos
+
+    def iter_before(self, before: str | None):
+        """(ts, line) newest first, starting near the last entry with ts <= `before`."""
+        end = self._end
+        if before is not None:
+            # lines from the first indexed line after `before` on cannot qualify;
+            # one more index step is kept as slack for slightly out-of-order ts
+            i = bisect.bisect_right(self._ts, before) + 1
+            if i < len(self._offsets):
+                end = self._offsets[i]
+        with open(self.path, 'rb') as f:
+            for line in _backward(f, end, self.block):
+                yield _ts(line), line
+
+
+class _GzipSegment:
+    def __init__(self, path: str, lines: list[bytes]):
+        self.path = path
+        self._lines = lines
+        self._ts = [_ts(ln) for ln in lines]
+        self.first_ts = self._ts[0] if lines else None
+        self.last_ts = self._ts[-1] if lines else None
+
+    def refresh(self):
+        pass
+
+    def iter_before(self, before: str | None):
+        end = len(self._lines) if before is None else bisect.bisect_right(self._ts, before)
+        for i in range(min(len(self._lines), end + 1) - 1, -1, -1):
+            yield self._ts[i], self._lines[i]
+
+
+class HistoryReader:
+    def __init__(self, path: str = 'notifications.jsonl'):
+        env = os.environ
+        self.path = path
+        self.block = int(env.get('HISTORY_BLOCK', '65536'))
+        self.every = int(env.get('HISTORY_INDEX_EVERY', '1000'))
+        self.max_limit = int(env.get('HISTORY_MAX_LIMIT', '500'))
+        self.gz_cache = int(env.get('HISTORY_GZ_CACHE', '2'))
+        self._live = _PlainSegment(path, self.block, self.every)
+        self._rotated: dict[tuple, _PlainSegment] = {}
+        self._gz: OrderedDict = OrderedDict()
+
+    def _rotated_paths(self) -> list[str]:
+        paths = set(glob.glob(glob.escape(self.path) + '.*')) | set(glob.glob(glob.escape(self.path) + '-*'))
+        paths = [p for p in paths if not p.endswith('.tmp')]
+        return sorted(paths, key=lambda p: os.path.getmtime(p), reverse=True)
+
+    def _segment(self, path: str):
+        st = os.stat(path)
+        key = (path, st.st_mtime, st.st_size)
+        if path.endswith('.gz'):
+            seg = self._gz.get(key)
+            if seg is None:
+                with gzip.open(path, 'rb') as f:
+                    seg = _GzipSegment(path, [ln for ln in f.read().split(b'\n') if ln.strip()])
+                self._gz[key] = seg
+                while len(self._gz) > self.gz_cache:
+                    self._gz.popitem(last=False)
+            else:
+                self._gz.move_to_end(key)
+            return seg
+        seg = self._rotated.get(key)
+        if seg is None:
+            for k in [k for k in self._rotated if k[0] == path]:
+                del self._rotated[k]
+            seg = self._rotated[key] = _PlainSegment(path, self.block, self.every)
+            seg.refresh()
+        return seg
+
+    def segments(self):
+        """Live file first, then rotated segments newest first."""
+        self._live.refresh()
+        yield self._live
+        for path in self._rotated_paths():
+            try:
+                yield self._segment(path)
+            except (OSError, EOFError, gzip.BadGzipFile):
+                continue
+
+    def query(self, limit: int | None = 100, cursor: str | None = None, method: str | None = None,
+              status: str | None = None, since: str | None = None, until: str | None = None):
+        """Entries newest first and the cursor of the next page (None at the end).
+
+        `since` (inclusive) and `until` (exclusive) compare against the ts
+        string, so '2025-11-09' and full ISO timestamps both work.
+        """
+        limit = max(1, min(int(limit or 100), self.max_limit))
+        before, skip, strict = None, 0, False
+        if cursor:
+            before, skip = decode_cursor(cursor)
+        elif until:
+            before, strict = until, True
+        skipped = skip
+        out = []
+        last_ts, same = None, 0
+        for seg in self.segments():
+            if before is not None and seg.first_ts is not None and seg.first_ts > before:
+                continue
+            if since and seg.last_ts is not None and seg.last_ts < since:
+                break
+            for ts, line in seg.iter_before(before):
+                if before is not None:
+                    if ts > before or (strict and ts == before):
+                        continue
+                    if ts == before and skip:
+                        skip -= 1
+                        continue
+                if since and ts < since:
+                    return out, None
+                # entries passed with this ts (filtered or not), for the next cursor
+                if ts == last_ts:
+                    same += 1
+                else:
+                    last_ts, same = ts, 1 + (skipped if cursor and ts == before else 0)
+                try:
+                    entry = json.loads(line)
+                except Exception:
+                    continue
+                if method and entry.get('method') != method:
+                    continue
+                if status and entry.get('status') != status:
+                    continue
+                out.append(entry)
+                if len(out) == limit:
+                    return out, encode_cursor(ts, same)
+        return out, None
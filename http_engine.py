@@ -0,0 +1,204 @@
+"""Browserless calendar polling over a pooled `httpx.AsyncClient`.
+
+`HttpCalendarEngine` requests the calendar with the same week parameter the
+Playwright path sets by selecting the week option: it reads the week
+`<select>` from the index page once (cached for HTTP_ENGINE_INDEX_TTL
+seconds) and sends `{select name: option value}` to HTTP_ENGINE_DATA_URL
+(defaults to the index page itself). Responses are parsed with
+`calendar_parse`, so the slot dicts are the ones `fetch_parsed_with_page`
+returns.
+
+`EngineWithFallback` runs the engine first and falls back to a Playwright
+fetch when the engine fails, returns nothing, or diverges from the browser
+result (the engine is then disabled for HTTP_ENGINE_COOLDOWN seconds). The
+engine is verified on the first poll, every HTTP_ENGINE_VERIFY_EVERY polls
+and whenever a slot turns not-full. A verification the browser could not
+run is counted (`verify_error`); weeks where a slot turned not-full are then
+returned as EngineError (skipped this poll, checked again on the next), the
+other weeks keep the engine result. So no notification rests on an
+unverified engine result.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+import metrics
+from calendar_parse import dedupe_and_sort, slots_from_body
+
+CALENDAR_URL = "https://eipro.jp/takachiho1/eventCalendars/index"
+
+
+class EngineError(Exception):
+    """The HTTP engine could not produce a trustworthy result for a week."""
+
+
+def _week_range(start_date: str):
+    d = datetime.strptime(start_date, '%Y-%m-%d').date()
+    return d.strftime('%Y-%m-%d'), (d + timedelta(days=6)).strftime('%Y-%m-%d')
+
+
+def week_options_from_html(html: str) -> list[tuple[str, str, str]]:
+    """Return (select name, option value, option text) for every named select option."""
+    try:
+        from bs4 import BeautifulSoup
+    except Exception:
+        return []
+    soup = BeautifulSoup(html or '', 'html.parser')
+    out = []
+    for sel in soup.find_all('select'):
+        name = sel.get('name') or sel.get('id')
+        if not name:
+            continue
+        for opt in sel.find_all('option'):
+            txt = opt.get_text(strip=True)
+            if txt:
+                out.append((name, opt.get('value') if opt.get('value') is not None else txt, txt))
+    return out
+
+
+class HttpCalendarEngine:
+    def __init__(self, url: str | None = None, data_url: str | None = None,
+                 client: httpx.AsyncClient | None = None, timeout: float | None = None):
+        self.url = url or os.environ.get('HTTP_ENGINE_URL', CALENDAR_URL)
+        self.data_url = data_url or os.environ.get('HTTP_ENGINE_DATA_URL') or self.url
+        self.index_ttl = float(os.environ.get('HTTP_ENGINE_INDEX_TTL', '600'))
+        self._client = client or httpx.AsyncClient(
+            timeout=timeout or float(os.environ.get('HTTP_ENGINE_TIMEOUT', '15')),
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+            headers={'User-Agent': 'Mozilla/5.0 (auto_notification)'},
+            follow_redirects=True,
+        )
+        self._options: list[tuple[str, str, str]] = []
+        self._options_at = 0.0
+        self._index_lock = asyncio.Lock()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def _week_options(self):
+        async with self._index_lock:
+            if self._options and time.monotonic() - self._options_at < self.index_ttl:
+                return self._options
+            resp = await self._client.get(self.url)
+            resp.raise_for_status()
+            self._options = week_options_from_html(resp.text)
+            self._options_at = time.monotonic()
+            return self._options
+
+    async def _week_params(self, start_date: str) -> dict:
+        s1 = start_date.replace('-', '/')
+        for name, value, txt in await self._week_options():
+            if s1 in txt or start_date in txt:
+                return {name: value}
+        raise EngineError(f'no week option for {start_date}')
+
+    async def fetch_week(self, start_date: str) -> list[dict]:
+        """Fetch one week and return its slots (deduped, sorted); EngineError when empty."""
+        params = await self._week_params(start_date)
+        resp = await self._client.get(self.data_url, params=params)
+        resp.raise_for_status()
+        slots = slots_from_body(resp.text, resp.headers.get('content-type', ''))
+        lo, hi = _week_range(start_date)
+        slots = [x for x in slots if x.get('date') and lo <= x['date'] <= hi]
+        if not slots:
+            raise EngineError(f'no slots in response for {start_date}')
+        return dedupe_and_sort(slots)
+
+    async def fetch_weeks(self, starts: list[str]):
+        """Fetch weeks concurrently; returns [(start, items-or-exception)] like app.fetch_weeks_with_page."""
+        res = await asyncio.gather(*(self.fetch_week(s) for s in starts), return_exceptions=True)
+        return list(zip(starts, res))
+
+
+def _status_set(fetched) -> set:
+    out = set()
+    for s, items in fetched:
+        for i in items:
+            out.add((s, i.get('date'), i.get('time'), i.get('attrs', {}).get('service_cd'), i.get('status')))
+    return out
+
+
+def _statuses(fetched) -> dict:
+    return {k[:-1]: k[-1] for k in _status_set(fetched)}
+
+
+class EngineWithFallback:
+    """Use the HTTP engine, falling back to `browser_fetch(starts)` (Playwright) when needed.
+
+    `browser_fetch` has the same contract as `HttpCalendarEngine.fetch_weeks`.
+    `on_verified` (optional, async) is called after a verification passed so
+    the caller can close its browser until it is needed again.
+    """
+
+    def __init__(self, engine: HttpCalendarEngine, browser_fetch, on_verified=None,
+                 verify_every: int | None = None, cooldown: float | None = None):
+        self.engine = engine
+        self.browser_fetch = browser_fetch
+        self.on_verified = on_verified
+        self.verify_every = verify_every or int(os.environ.get('HTTP_ENGINE_VERIFY_EVERY', '30'))
+        self.cooldown = cooldown if cooldown is not None else float(os.environ.get('HTTP_ENGINE_COOLDOWN', '3600'))
+        self.disabled_until = 0.0
+        self.polls = 0
+        self.last_source = None
+        self.stats = {'http': 0, 'fallbacks': 0, 'verify_ok': 0, 'verify_fail': 0, 'verify_error': 0,
+                      'unverified_weeks': 0}
+        self._statuses: dict = {}               # slot -> status of the last result returned
+
+    async def _fallback(self, reason: str):
+        self.stats['fallbacks'] += 1
+        metrics.fallbacks.inc('http_engine')
+        self.last_source = f'playwright ({reason})'
+
+    async def fetch_weeks(self, starts: list[str]):
+        if time.monotonic() < self.disabled_until:
+            await self._fallback('engine disabled')
+            return await self.browser_fetch(starts)
+
+        try:
+            fetched = await self.engine.fetch_weeks(starts)
+        except Exception as e:
+            fetched = [(s, e) for s in starts]
+        errors = [r for _, r in fetched if isinstance(r, BaseException)]
+        if errors:
+            await self._fallback(f'engine error: {errors[0]}')
+            return await self.browser_fetch(starts)
+
+        self.polls += 1
+        statuses = _statuses(fetched)
+        # weeks where a slot turned not-full: these would be notified
+        opened = {k[0] for k, st in statuses.items() if st != 'full' and self._statuses.get(k) != st}
+        if self.polls == 1 or self.polls % max(1, self.verify_every) == 0 or opened:
+            browser = await self.browser_fetch(starts)
+            if any(isinstance(r, BaseException) for _, r in browser):
+                self.stats['verify_error'] += 1
+                metrics.engine_verifications.inc('error')
+                if opened:
+                    # cannot verify the change now: skip those weeks (verified again next poll)
+                    self.stats['unverified_weeks'] += len(opened)
+                    kept = {k: st for k, st in self._statuses.items() if k[0] in opened}
+                    self._statuses = {k: st for k, st in statuses.items() if k[0] not in opened}
+                    self._statuses.update(kept)
+                    self.stats['http'] += 1
+                    self.last_source = 'http (unverified weeks skipped)'
+                    return [(s, EngineError(f'unverified change in week {s}: browser check failed'))
+                            if s in opened else (s, r) for s, r in fetched]
+            elif _status_set(browser) != _status_set(fetched):
+                self.stats['verify_fail'] += 1
+                metrics.engine_verifications.inc('fail')
+                self.disabled_until = time.monotonic() + self.cooldown
+                self._statuses = _statuses(browser)
+                await self._fallback('engine diverged from browser')
+                return browser
+            else:
+                self.stats['verify_ok'] += 1
+                metrics.engine_verifications.inc('ok')
+                if self.on_verified is not None:
+                    await self.on_verified()
+
+        self._statuses = statuses
+        self.stats['http'] += 1
+        self.last_source = 'http'
+        return fetched
@@ -0,0 +1,135 @@
+"""Single-scraper leader election through a SQLite lease.
+
+The app's background loop, scripts/poller.py and the cron runner
+(scripts/run_notify.py) may run at the same time, and uvicorn may start
+several workers. Only the holder of the 'scraper' lease scrapes and
+notifies; the others are followers and read the snapshot the leader
+publishes after every poll.
+
+The lease lives in its own database (LEADER_DB, default leader.db) so its
+frequent renewals do not invalidate the slot-state cache of notified.db.
+A lease expires LEADER_TTL seconds after its last renewal; `acquire()`
+renews it and is called on every tick, `keepalive()` renews it in the
+background while the holder sleeps (push mode). `release()` runs at exit
+so a cron run hands the lease back immediately.
+"""
+import asyncio
+import atexit
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS leases ("
+    " name TEXT PRIMARY KEY,"
+    " holder TEXT NOT NULL,"
+    " expires REAL NOT NULL,"
+    " snapshot TEXT,"
+    " published_at REAL)"
+)
+
+
+class LeaderLease:
+    def __init__(self, path: str | None = None, name: str = 'scraper', ttl: float | None = None, role: str = ''):
+        self.path = path or os.environ.get('LEADER_DB', 'leader.db')
+        self.name = name
+        self.ttl = ttl or float(os.environ.get('LEADER_TTL', '90'))
+        self.enabled = os.environ.get('LEADER_ELECTION', '1') != '0'
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{role or "app"}:{uuid.uuid4().hex[:8]}'
+        self.is_leader = False
+        self._conn = None
+        self._task = None
+        atexit.register(self.release)
+
+    def _db(self):
+        if self._conn is None:
+            # autocommit; transactions are opened explicitly with BEGIN IMMEDIATE
+            self._conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(_SCHEMA)
+        return self._conn
+
+    def acquire(self) -> bool:
+        """Take or renew the lease; True when this process is the leader."""
+        if not self.enabled:
+            self.is_leader = True
+            return True
+        now = time.time()
+        try:
+            db = self._db()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute('SELECT holder, expires FROM leases WHERE name=?', (self.name,)).fetchone()
+                ok = row is None or row[0] == self.holder or row[1] < now
+                if ok:
+                    db.execute(
+                        'INSERT INTO leases(name, holder, expires) VALUES(?,?,?) '
+                        'ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires=excluded.expires',
+                        (self.name, self.holder, now + self.ttl),
+                    )
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+        except Exception:
+            # database busy or unavailable: keep the current role until the next attempt
+            return self.is_leader
+        self.is_leader = ok
+        return ok
+
+    def release(self):
+        if self._task is not None:
+            try:
+                self._task.cancel()
+            except Exception:
+                # event loop already closed (atexit)
+                pass
+            self._task = None
+        if not self.is_leader or self._conn is None:
+            return
+        try:
+            self._conn.execute('UPDATE leases SET expires=0 WHERE name=? AND holder=?', (self.name, self.holder))
+        except Exception:
+            pass
+        self.is_leader = False
+
+    def current(self) -> dict:
+        """Holder, expiry and last published snapshot of the lease."""
+        try:
+            row = self._db().execute(
+                'SELECT holder, expires, snapshot, published_at FROM leases WHERE name=?', (self.name,)).fetchone()
+        except Exception:
+            row = None
+        if row is None:
+            return {'leader': None, 'expires': None, 'snapshot': None, 'published_at': None, 'is_me': False}
+        try:
+            snapshot = json.loads(row[2]) if row[2] else None
+        except Exception:
+            snapshot = None
+        return {'leader': row[0], 'expires': row[1], 'snapshot': snapshot, 'published_at': row[3],
+                'is_me': row[0] == self.holder and row[1] >= time.time()}
+
+    def publish(self, snapshot: dict):
+        """Store the leader's latest poll result for followers (no-op when not leading)."""
+        if not self.enabled or not self.is_leader:
+            return
+        try:
+            self._db().execute(
+                'UPDATE leases SET snapshot=?, published_at=? WHERE name=? AND holder=?',
+                (json.dumps(snapshot, ensure_ascii=False, default=str), time.time(), self.name, self.holder),
+            )
+        except Exception:
+            pass
+
+    async def _renew_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            self.acquire()
+
+    def keepalive(self):
+        """Start renewing the lease in the background (idempotent)."""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self._renew_loop())
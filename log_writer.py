@@ -0,0 +1,178 @@
+"""Group-commit writer for notification.log, notifications.jsonl and poller.log.
+
+Callers hand a complete record (one JSON line, or a log message that may
+span several lines) to `write()`, which only appends it to an in-memory
+queue. A background thread wakes every LOG_FLUSH_INTERVAL seconds (or as
+soon as LOG_MAX_PENDING bytes are queued), and writes everything queued for
+a file with a single O_APPEND write. Records are never split, so lines of
+concurrent writers (threads, tasks, or the app and poller processes sharing
+a file) do not interleave. The file is opened per batch, so both logrotate
+modes (copytruncate and create) keep working.
+
+LOG_FSYNC picks the durability policy: "none" leaves it to the OS,
+"batch" fsyncs every file after each batch, "interval" at most every
+LOG_FSYNC_INTERVAL seconds. `flush()` waits until everything written so
+far is on disk (in the file); `close()` flushes and stops the thread and is
+also run at interpreter exit. A LOG_FLUSH_INTERVAL of 0 writes
+synchronously in the caller, as before.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+NOTIFICATION_LOG = 'notification.log'
+
+
+class LogWriter:
+    def __init__(self, interval: float | None = None, fsync: str | None = None):
+        env = os.environ
+        self.interval = float(env.get('LOG_FLUSH_INTERVAL', '0.2') if interval is None else interval)
+        self.fsync = (fsync or env.get('LOG_FSYNC', 'none')).lower()
+        self.fsync_interval = float(env.get('LOG_FSYNC_INTERVAL', '1'))
+        self.max_pending = int(env.get('LOG_MAX_PENDING', '1048576'))
+        self._cond = threading.Condition()
+        self._pending: list[tuple[str, bytes]] = []
+        self._bytes = 0
+        self._queued = 0        # records accepted
+        self._done = 0          # records written (or failed)
+        self._urgent = False
+        self._closed = False
+        self._thread = None
+        self._pid = None
+        self._last_fsync = 0.0
+        self.stats = {'records': 0, 'batches': 0, 'bytes': 0, 'errors': 0, 'last_error': None}
+
+    def write(self, path: str, text: str):
+        """Queue one record for `path` (text ends with a newline)."""
+        data = text.encode('utf-8')
+        with self._cond:
+            if self._closed or self.interval <= 0 or not self._running():
+                self._write_batch([(path, data)])
+                return
+            if not self._pending:
+                self._cond.notify_all()     # starts the flush interval
+            self._pending.append((path, data))
+            self._bytes += len(data)
+            self._queued += 1
+            if self._bytes >= self.max_pending:
+                self._urgent = True
+                self._cond.notify_all()
+
+    def _running(self) -> bool:
+        # (re)start the thread lazily, also in a forked child
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return True
+        self._pending, self._bytes, self._queued, self._done = [], 0, 0, 0
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        try:
+            self._thread.start()
+        except RuntimeError:    # interpreter shutting down
+            self._thread = None
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._urgent and not self._closed:
+                    self._cond.wait(self.interval)
+                batch, self._pending, self._bytes, self._urgent = self._pending, [], 0, False
+                closed = self._closed
+            if batch:
+                self._write_batch(batch)
+            with self._cond:
+                self._done += len(batch)
+                self._cond.notify_all()
+                if closed and not self._pending:
+                    return
+
+    def _write_batch(self, batch: list[tuple[str, bytes]]):
+        by_path: dict[str, list[bytes]] = {}
+        for path, data in batch:
+            by_path.setdefault(path, []).append(data)
+        now = time.monotonic()
+        sync = self.fsync == 'batch' or (self.fsync == 'interval' and now - self._last_fsync >= self.fsync_interval)
+        for path, chunks in by_path.items():
+            data = b''.join(chunks)
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    view = memoryview(data)
+                    while view:
+                        view = view[os.write(fd, view):]
+                    if sync:
+                        os.fsync(fd)
+                finally:
+                    os.close(fd)
+                self.stats['bytes'] += len(data)
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.stats['last_error'] = f'{path}: {e}'
+        if sync:
+            self._last_fsync = now
+        self.stats['records'] += len(batch)
+        self.stats['batches'] += 1
+
+    def flush(self, timeout: float | None = 5.0) -> bool:
+        """Wait until every record queued so far is written; False on timeout."""
+        with self._cond:
+            if self._thread is None or self._pid != os.getpid():
+                return True
+            target = self._queued
+            self._urgent = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._done >= target, timeout)
+
+    def close(self, timeout: float | None = 5.0):
+        """Write what is queued and stop the thread; later writes go straight to disk."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+
+    def status(self) -> dict:
+        with self._cond:
+            return dict(self.stats, pending=len(self._pending), fsync=self.fsync, interval=self.interval)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def log_writer() -> LogWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = LogWriter()
+            atexit.register(_writer.close)
+        return _writer
+
+
+def write(path: str, text: str):
+    log_writer().write(path, text)
+
+
+def log(text: str, path: str = NOTIFICATION_LOG):
+    """Append a message to notification.log (a newline is added when missing)."""
+    log_writer().write(path, text if text.endswith('\n') else text + '\n')
+
+
+def append_jsonl(path: str, entries: list[dict]):
+    """Append entries as JSON lines, written together."""
+    if entries:
+        log_writer().write(path, ''.join(json.dumps(e, ensure_ascii=False, default=str) + '\n' for e in entries))
+
+
+def flush(timeout: float | None = 5.0) -> bool:
+    return log_writer().flush(timeout)
+
+
+def close(timeout: float | None = 5.0):
+    log_writer().close(timeout)
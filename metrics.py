@@ -0,0 +1,185 @@
+"""Prometheus metrics shared by app.py and scripts/poller.py.
+
+A small in-process registry rendered in the Prometheus text format (no
+client library needed). The app serves it at GET /metrics; the poller,
+which imports app and therefore shares the registry, serves it on
+POLLER_METRICS_PORT (default 9108, bound to METRICS_BIND, 127.0.0.1; 0
+disables it).
+
+    auto_notification_poll_stage_seconds{stage}   histogram: browser_launch, goto,
+        week_switch, evaluate, parse, diff, persist, send (and readiness waits)
+    auto_notification_browser_restarts_total{source}
+    auto_notification_fallbacks_total{kind}       http_engine, network_extract
+    auto_notification_engine_verifications_total{result}  ok, fail, error
+    auto_notification_skipped_weeks_total{reason} unchanged, missing
+    auto_notification_deliveries_total{method,status}
+    auto_notification_last_poll_success_timestamp_seconds
+    auto_notification_last_poll_success_age_seconds
+
+`record_stage(stage, ms)` is fed by app._record_stage, so every stage
+timing already kept for scrape_stage_stats() also lands in the histogram.
+"""
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = 'auto_notification_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ''
+    esc = [str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values]
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, esc)) + '}'
+
+
+def _num(v: float) -> str:
+    if v == math.inf:
+        return '+Inf'
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = PREFIX + name, help, labels
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *values, amount: float = 1):
+        with _lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def get(self, *values) -> float:
+        return self._values.get(values, 0)
+
+    def samples(self):
+        for values, v in sorted(self._values.items()):
+            yield self.name, _labels(self.labels, values), v
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), func=None):
+        super().__init__(name, help, labels)
+        self._func = func   # computed at render time (unlabelled), None to omit
+
+    def set(self, value: float, *values):
+        with _lock:
+            self._values[values] = value
+
+    def samples(self):
+        if self._func is not None:
+            v = self._func()
+            if v is not None:
+                yield self.name, '', v
+            return
+        yield from super().samples()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets=BUCKETS):
+        self.name, self.help, self.labels = PREFIX + name, help, labels
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values: dict[tuple, list] = {}     # labels -> [bucket counts..., sum]
+
+    def observe(self, value: float, *values):
+        with _lock:
+            row = self._values.get(values)
+            if row is None:
+                row = self._values[values] = [0] * len(self.buckets) + [0.0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+                    break
+            row[-1] += value
+
+    def count(self, *values) -> int:
+        row = self._values.get(values)
+        return sum(row[:-1]) if row else 0
+
+    def samples(self):
+        for values, row in sorted(self._values.items()):
+            cum = 0
+            for b, n in zip(self.buckets, row):
+                cum += n
+                yield self.name + '_bucket', _labels(self.labels + ('le',), values + (_num(b),)), cum
+            yield self.name + '_sum', _labels(self.labels, values), row[-1]
+            yield self.name + '_count', _labels(self.labels, values), cum
+
+
+_last_poll = {'ts': None}
+
+
+def _poll_age():
+    return None if _last_poll['ts'] is None else max(0.0, time.time() - _last_poll['ts'])
+
+
+poll_stage_seconds = Histogram('poll_stage_seconds', 'Duration of poll stages.', ('stage',))
+browser_restarts = Counter('browser_restarts_total', 'Chromium relaunches after a failure.', ('source',))
+fallbacks = Counter('fallbacks_total', 'Polls or pages that fell back to the browser/DOM path.', ('kind',))
+engine_verifications = Counter('engine_verifications_total', 'HTTP engine results checked against the browser.',
+                               ('result',))
+skipped_weeks = Counter('skipped_weeks_total', 'Weeks not parsed in a poll.', ('reason',))
+deliveries = Counter('deliveries_total', 'Notification delivery attempts by outcome.', ('method', 'status'))
+last_poll_success = Gauge('last_poll_success_timestamp_seconds', 'Unix time of the last successful poll.',
+                          func=lambda: _last_poll['ts'])
+last_poll_age = Gauge('last_poll_success_age_seconds', 'Seconds since the last successful poll.', func=_poll_age)
+
+REGISTRY = [poll_stage_seconds, browser_restarts, fallbacks, engine_verifications, skipped_weeks, deliveries,
+            last_poll_success, last_poll_age]
+
+
+def record_stage(stage: str, ms: float):
+    poll_stage_seconds.observe(ms / 1000.0, stage)
+
+
+def poll_succeeded():
+    _last_poll['ts'] = time.time()
+
+
+def render() -> str:
+    out = []
+    with _lock:
+        for m in REGISTRY:
+            out.append(f'# HELP {m.name} {m.help}')
+            out.append(f'# TYPE {m.name} {m.kind}')
+            for name, labels, v in m.samples():
+                out.append(f'{name}{labels} {_num(v)}')
+    return '\n'.join(out) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int | None = None, host: str | None = None):
+    """Serve /metrics from a daemon thread; returns the server, None when disabled."""
+    port = int(os.environ.get('POLLER_METRICS_PORT', '9108')) if port is None else port
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host or os.environ.get('METRICS_BIND', '127.0.0.1'), port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
@@ -0,0 +1,840 @@
+"""Notification delivery (SendGrid / Mailgun / SMTP / LINE Notify) and the durable outbox.
+
+`deliver_email` and `deliver_line` are the provider implementations; they
+post through a shared `httpx.AsyncClient` and record every attempt in
+notifications.jsonl. SMTP goes through the keep-alive sessions of smtp_pool,
+in a thread (smtplib is blocking).
+
+`NotificationOutbox` decouples delivery from polling. `enqueue_*()` stores
+the notification as a job in a SQLite database (OUTBOX_DB, default
+outbox.db) and returns; OUTBOX_WORKERS tasks deliver due jobs in the
+background over one pooled client. One-shot runners without workers call
+`run_due()`, which delivers them the same way. A failed delivery is retried
+with exponential backoff (OUTBOX_BACKOFF_BASE doubling up to
+OUTBOX_BACKOFF_MAX seconds) until OUTBOX_MAX_ATTEMPTS, after which the job
+is marked dead.
+
+Every job has an idempotency key (derived from the slot transitions it
+reports); enqueueing a key that is already stored is a no-op, so a poll
+repeated after a crash does not send the same alert twice. A job being
+sent is claimed for OUTBOX_CLAIM_TTL seconds; if the process dies before
+recording the outcome the claim expires and the job is sent again (at
+least once). Jobs left pending at shutdown are picked up by the next start.
+
+Digests (DIGEST_WINDOW > 0 or NOTIFY_RATE_PER_HOUR > 0) are per-recipient
+jobs: `add_digest()` opens a job due DIGEST_WINDOW seconds later and merges
+further changes for that recipient into it until it is sent. An urgent
+change (high-priority subscription) that is the first of a burst is sent
+at once. Before a digest is sent the recipient's token bucket (stored in
+the same database, NOTIFY_BURST tokens refilled at NOTIFY_RATE_PER_HOUR)
+must give a token; otherwise the digest is postponed and keeps collecting.
+"""
+import asyncio
+import json
+import os
+import random
+import smtplib
+import sqlite3
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from email.message import EmailMessage
+from email.utils import parsedate_to_datetime
+from functools import partial
+
+import httpx
+
+import log_writer
+import metrics
+from provider_health import CLOSED, health, health_status, rank
+from smtp_pool import pools_status, session_dropped, smtp_pool
+
+HISTORY_PATH = 'notifications.jsonl'
+
+
+def append_history(entry: dict, path=HISTORY_PATH):
+    """Append a JSON line to notifications.jsonl (through the background log writer)."""
+    metrics.deliveries.inc(entry.get('method'), entry.get('status'))
+    log_writer.append_jsonl(path, [entry])
+
+
+def append_history_many(entries: list[dict], path=HISTORY_PATH):
+    """Append several JSON lines as one record."""
+    for e in entries:
+        metrics.deliveries.inc(e.get('method'), e.get('status'))
+    log_writer.append_jsonl(path, entries)
+
+
+def _log(text: str):
+    log_writer.log(text)
+
+
+def _history(method: str, recipients, subject, status: str, detail: str):
+    append_history({
+        'ts': datetime.utcnow().isoformat(),
+        'method': method,
+        'recipients': recipients,
+        'subject': subject,
+        'status': status,
+        'detail': detail,
+    })
+
+
+def new_client(max_connections: int = 8) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=20,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+    )
+
+
+def email_configured() -> bool:
+    """True when any email provider (SendGrid, Mailgun, SMTP) is configured."""
+    env = os.environ
+    return bool(env.get('SENDGRID_API_KEY') or (env.get('MAILGUN_API_KEY') and env.get('MAILGUN_DOMAIN'))
+                or (env.get('SMTP_HOST') and env.get('SMTP_PORT')))
+
+
+def _provider_timeout() -> float:
+    return float(os.environ.get('EMAIL_PROVIDER_TIMEOUT', '10'))
+
+
+def _provider_error(resp: httpx.Response) -> bool:
+    """Responses that say the provider (not the message) is at fault: 5xx and 429."""
+    return resp.status_code >= 500 or resp.status_code == 429
+
+
+def _smtp_unavailable(err: Exception) -> bool:
+    """Connection/auth trouble (try another provider); refused recipients or data are not."""
+    if isinstance(err, smtplib.SMTPRecipientsRefused):
+        return False
+    if isinstance(err, (smtplib.SMTPAuthenticationError, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(err, smtplib.SMTPResponseException) and err.smtp_code >= 500:
+        return False
+    return session_dropped(err) or isinstance(err, OSError) and not isinstance(err, smtplib.SMTPException)
+
+
+async def _sendgrid_batch(client, key: str, from_addr: str, subject: str, body: str, chunk: list[str]):
+    # one personalization per recipient: each gets its own message and sees only its address
+    payload = {
+        "personalizations": [{"to": [{"email": r}]} for r in chunk],
+        "from": {"email": from_addr},
+        "subject": subject,
+        "content": [{"type": "text/plain", "value": body}],
+    }
+    headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
+    try:
+        resp = await client.post("https://api.sendgrid.com/v3/mail/send", json=payload, headers=headers,
+                                 timeout=_provider_timeout())
+    except Exception as e:
+        _log(f"SendGrid exception: {e} Subject: {subject} To: {len(chunk)} recipients\n")
+        return [], chunk
+    if resp.status_code in (200, 202):
+        _history('sendgrid', chunk, subject, 'success', f'status={resp.status_code}')
+        return [], []
+    if _provider_error(resp):
+        _log(f"SendGrid unavailable: status={resp.status_code} Subject: {subject} To: {len(chunk)} recipients\n")
+        return [], chunk
+    _log(f"SendGrid send failed: status={resp.status_code} body={resp.text} Subject: {subject} To: {chunk}\n")
+    _history('sendgrid', chunk, subject, 'failed', f'status={resp.status_code} body={resp.text}')
+    return chunk, []
+
+
+async def _mailgun_batch(client, key: str, domain: str, from_addr: str, subject: str, body: str, chunk: list[str]):
+    # recipient-variables make Mailgun send one message per recipient (batch sending)
+    data = {"from": from_addr, "to": chunk, "subject": subject, "text": body,
+            "recipient-variables": json.dumps({r: {} for r in chunk})}
+    try:
+        resp = await client.post(f"https://api.mailgun.net/v3/{domain}/messages", auth=("api", key), data=data,
+                                 timeout=_provider_timeout())
+    except Exception as e:
+        _log(f"Mailgun exception: {e} Subject: {subject} To: {len(chunk)} recipients\n")
+        return [], chunk
+    if resp.status_code in (200, 202):
+        _history('mailgun', chunk, subject, 'success', f'status={resp.status_code}')
+        return [], []
+    if _provider_error(resp):
+        _log(f"Mailgun unavailable: status={resp.status_code} Subject: {subject} To: {len(chunk)} recipients\n")
+        return [], chunk
+    _log(f"Mailgun send failed: status={resp.status_code} body={resp.text} Subject: {subject} To: {chunk}\n")
+    _history('mailgun', chunk, subject, 'failed', f'status={resp.status_code} body={resp.text}')
+    return chunk, []
+
+
+async def _smtp_batch(host: str, port: int, user, password, from_addr: str, subject: str, body: str, chunk: list[str]):
+    msgs = []
+    for r in chunk:
+        msg = EmailMessage()
+        msg['Subject'] = subject
+        msg['From'] = from_addr
+        msg['To'] = r
+        msg.set_content(body)
+        msgs.append(msg)
+    try:
+        results = await asyncio.to_thread(smtp_pool(host, port, user, password).send_many, msgs)
+    except Exception as e:
+        results = [e] * len(chunk)
+    sent = [r for r, err in zip(chunk, results) if err is None]
+    # a dropped session / refused connection is the server's fault: try another provider
+    errored = [r for r, err in zip(chunk, results) if err is not None and _smtp_unavailable(err)]
+    failed = [r for r, err in zip(chunk, results) if err is not None and not _smtp_unavailable(err)]
+    if sent:
+        _history('smtp', sent, subject, 'success', f'{host}:{port}')
+    if failed or errored:
+        err = next(e for e in results if e is not None)
+        _log(f"SMTP send failed: {err}\nSubject: {subject}\nTo: {failed + errored}\n")
+    if failed:
+        _history('smtp', failed, subject, 'failed', str(err))
+    return failed, errored
+
+
+async def _fan_out(send_batch, recipients: list[str], size: int, limit: asyncio.Semaphore, breaker=None,
+                   probe: bool = False):
+    """Run `send_batch(chunk)` over `size`-recipient chunks, at most `limit` at a time.
+
+    Returns (failed, errored): recipients the provider rejected, and those
+    whose batch hit a provider error (they may still go through the next
+    provider). Each batch is recorded in `breaker` (ProviderHealth). With
+    `probe` (half-open breaker) the first batch is sent alone and the rest
+    only follows if it went through.
+    """
+    async def run(chunk):
+        async with limit:
+            t0 = time.monotonic()
+            failed, errored = await send_batch(chunk)
+            if breaker is not None:
+                breaker.record(not errored, (time.monotonic() - t0) * 1000)
+            return failed, errored
+
+    failed, errored = [], []
+    chunks = [recipients[i:i + size] for i in range(0, len(recipients), size)]
+    if probe and chunks:
+        failed, errored = await run(chunks.pop(0))
+        if errored:
+            # the provider is still down (its breaker opened again): the rest goes elsewhere
+            return failed, errored + [r for c in chunks for r in c]
+    for f, e in await asyncio.gather(*(run(c) for c in chunks)):
+        failed += f
+        errored += e
+    return failed, errored
+
+
+async def deliver_email(client: httpx.AsyncClient, subject: str, body: str, recipients: list[str],
+                        failed_recipients: list | None = None) -> str:
+    """Send the email to every recipient individually with the first configured provider.
+
+    Configured providers:
+      - SendGrid HTTP API if SENDGRID_API_KEY is set
+      - Mailgun HTTP API if MAILGUN_API_KEY and MAILGUN_DOMAIN are set
+      - SMTP if SMTP_HOST/SMTP_PORT set
+      - none: dry-run (write to notification.log)
+
+    Providers are tried in the order of `provider_health.rank()`: providers
+    whose circuit breaker is open are skipped, the healthy one with the
+    lowest recent latency goes first (configured order on ties). A
+    half-open provider gets one batch as its probe before the rest.
+
+    Recipients are split into provider-sized batches (SENDGRID_BATCH_SIZE
+    personalizations, MAILGUN_BATCH_SIZE recipient-variables, SMTP_BATCH_SIZE
+    messages per SMTP session) sent EMAIL_FANOUT_CONCURRENCY at a time. A
+    batch that hits a provider error (exception, timeout after
+    EMAIL_PROVIDER_TIMEOUT seconds, 5xx, 429) is retried with the next
+    provider; a batch the provider rejects is failed.
+
+    Returns 'success', 'failed' (any recipient failed; they are appended to
+    `failed_recipients`) or 'dry-run' (details go to notification.log).
+    """
+    env = os.environ
+    from_addr = env.get('FROM_EMAIL') or env.get('SMTP_USER') or 'noreply@example.com'
+    recipients = list(dict.fromkeys(recipients))
+    limit = asyncio.Semaphore(int(env.get('EMAIL_FANOUT_CONCURRENCY', '4')))
+
+    providers = {}
+    if env.get('SENDGRID_API_KEY'):
+        providers['sendgrid'] = (partial(_sendgrid_batch, client, env['SENDGRID_API_KEY'], from_addr, subject, body),
+                                 int(env.get('SENDGRID_BATCH_SIZE', '1000')))
+    if env.get('MAILGUN_API_KEY') and env.get('MAILGUN_DOMAIN'):
+        providers['mailgun'] = (partial(_mailgun_batch, client, env['MAILGUN_API_KEY'], env['MAILGUN_DOMAIN'],
+                                        from_addr, subject, body),
+                                int(env.get('MAILGUN_BATCH_SIZE', '1000')))
+    if env.get('SMTP_HOST') and env.get('SMTP_PORT'):
+        providers['smtp'] = (partial(_smtp_batch, env['SMTP_HOST'], int(env['SMTP_PORT']), env.get('SMTP_USER'),
+                                     env.get('SMTP_PASS'), from_addr, subject, body),
+                             int(env.get('SMTP_BATCH_SIZE', '50')))
+
+    if not providers:
+        # dry-run: append to log
+        _log(f"DRY-RUN send: Subject: {subject}\nTo: {recipients}\nBody:\n{body}\n---\n")
+        _history('dry-run', recipients, subject, 'dry-run', '')
+        return 'dry-run'
+
+    failed, remaining = [], recipients
+    for name in rank(list(providers)):
+        if not remaining:
+            break
+        breaker = health(name)
+        probe = breaker.state != CLOSED
+        if not breaker.acquire():
+            continue
+        send_batch, size = providers[name]
+        try:
+            f, remaining = await _fan_out(send_batch, remaining, max(1, size), limit, breaker, probe)
+        finally:
+            if probe:
+                breaker.release()
+        failed += f
+    if remaining:
+        # every usable provider errored (or all breakers are open): report a failure so they are retried
+        _log(f"email not delivered to {len(remaining)} recipient(s), providers: {health_status()}\n")
+        _history('email', remaining, subject, 'failed', 'all providers failed or unavailable')
+        failed += remaining
+    if failed_recipients is not None:
+        failed_recipients.extend(failed)
+    return 'failed' if failed else 'success'
+
+
+# per-token LINE state shared by all deliveries of this process
+_line_invalid: set[str] = set()               # tokens LINE answered 401 for
+_line_blocked_until: dict[str, float] = {}    # token -> monotonic time its 429 backoff ends
+
+
+def _retry_after(resp: httpx.Response, default: float) -> float:
+    """Seconds from a Retry-After header (delta seconds or HTTP date)."""
+    value = resp.headers.get('Retry-After')
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return default
+
+
+def line_status() -> dict:
+    now = time.monotonic()
+    return {'invalid_tokens': len(_line_invalid),
+            'backing_off': sum(1 for until in _line_blocked_until.values() if until > now)}
+
+
+async def _line_send(client, message: str, token: str, max_wait: float) -> dict:
+    entry = {'ts': None, 'method': 'line', 'tokens': [token[:8]], 'subject': None, 'message': message}
+    for attempt in range(2):
+        wait = _line_blocked_until.get(token, 0) - time.monotonic()
+        if wait > max_wait:
+            entry.update(status='failed', detail=f'rate limited for {wait:.0f}s')
+            break
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            resp = await client.post('https://notify-api.line.me/api/notify',
+                                     headers={"Authorization": f"Bearer {token}"}, data={"message": message}, timeout=15)
+        except Exception as e:
+            _log(f"LINE exception: {e} token_prefix={token[:8]} Message: {message}\n")
+            entry.update(status='failed', detail=str(e))
+            break
+        if resp.status_code == 200:
+            _line_blocked_until.pop(token, None)
+            entry.update(status='success', detail=f'status={resp.status_code}')
+            break
+        if resp.status_code == 401:
+            _line_invalid.add(token)
+            _log(f"LINE token invalid (401), skipping it from now on: token_prefix={token[:8]}\n")
+            entry.update(status='invalid', detail=f'status=401 body={resp.text}')
+            break
+        if resp.status_code == 429:
+            delay = _retry_after(resp, float(os.environ.get('LINE_RETRY_AFTER', '60')))
+            _line_blocked_until[token] = time.monotonic() + delay
+            entry.update(status='failed', detail=f'status=429 retry_after={delay:.0f}s')
+            continue    # waits (when short enough) and tries once more
+        _log(f"LINE send failed: status={resp.status_code} body={resp.text} token_prefix={token[:8]} Message: {message}\n")
+        entry.update(status='failed', detail=f'status={resp.status_code} body={resp.text}')
+        break
+    entry['ts'] = datetime.utcnow().isoformat()
+    return entry
+
+
+async def deliver_line(client: httpx.AsyncClient, message: str, tokens: list[str],
+                       failed_tokens: list | None = None) -> str:
+    """Send a message via LINE Notify to each token; 'success' if at least one send succeeded.
+
+    Tokens are sent LINE_CONCURRENCY at a time. A 429 backs that token off
+    for Retry-After seconds: waits up to LINE_MAX_WAIT are slept through,
+    longer ones fail the token for now. Tokens that got a 401 are skipped
+    until restart. Failed (not invalid) tokens are appended to
+    `failed_tokens`; history is written once per call. Returns 'invalid'
+    when every token is invalid (nothing can ever be delivered) and
+    'dry-run' when there are no tokens at all.
+    """
+    given = list(dict.fromkeys(tokens))
+    tokens = [t for t in given if t not in _line_invalid]
+    if not tokens:
+        if given:
+            _log(f"LINE not sent: all {len(given)} token(s) invalid: message={message}\n---\n")
+            return 'invalid'
+        _log(f"DRY-RUN LINE send: message={message}\n---\n")
+        return 'dry-run'
+
+    limit = asyncio.Semaphore(int(os.environ.get('LINE_CONCURRENCY', '32')))
+    max_wait = float(os.environ.get('LINE_MAX_WAIT', '5'))
+
+    async def run(token):
+        async with limit:
+            return await _line_send(client, message, token, max_wait)
+
+    entries = await asyncio.gather(*(run(t) for t in tokens))
+    append_history_many(entries)
+    if failed_tokens is not None:
+        failed_tokens.extend(t for t, e in zip(tokens, entries) if e['status'] == 'failed')
+    if any(e['status'] == 'success' for e in entries):
+        return 'success'
+    return 'invalid' if all(e['status'] == 'invalid' for e in entries) else 'failed'
+
+
+def _percentile(vals, q: float):
+    if not vals:
+        return None
+    vs = sorted(vals)
+    return vs[min(len(vs) - 1, int(q * len(vs)))]
+
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS jobs ("
+    " id INTEGER PRIMARY KEY,"
+    " key TEXT NOT NULL UNIQUE,"
+    " kind TEXT NOT NULL,"
+    " payload TEXT NOT NULL,"
+    " state TEXT NOT NULL,"          # pending | sending | sent | dead
+    " attempts INTEGER NOT NULL DEFAULT 0,"
+    " next_at REAL NOT NULL,"        # due time (pending) or claim expiry (sending)
+    " created REAL NOT NULL,"
+    " updated REAL NOT NULL,"
+    " last_error TEXT)",
+    "CREATE INDEX IF NOT EXISTS jobs_due ON jobs(state, next_at)",
+    "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)",
+)
+
+
+class NotificationOutbox:
+    """Durable notification queue delivered by a pool of worker tasks."""
+
+    def __init__(self, workers: int | None = None, path: str | None = None):
+        env = os.environ
+        self.workers = workers or int(env.get('OUTBOX_WORKERS', '4'))
+        self.path = path or env.get('OUTBOX_DB', 'outbox.db')
+        self.max_attempts = int(env.get('OUTBOX_MAX_ATTEMPTS', '8'))
+        self.backoff_base = float(env.get('OUTBOX_BACKOFF_BASE', '30'))
+        self.backoff_max = float(env.get('OUTBOX_BACKOFF_MAX', '3600'))
+        self.claim_ttl = float(env.get('OUTBOX_CLAIM_TTL', '120'))
+        self.retention_days = int(env.get('OUTBOX_RETENTION_DAYS', '7'))
+        self.digest_window = float(env.get('DIGEST_WINDOW', '0'))
+        self.rate_per_hour = float(env.get('NOTIFY_RATE_PER_HOUR', '0'))
+        self.burst = float(env.get('NOTIFY_BURST', '3'))
+        self.client: httpx.AsyncClient | None = None
+        self._conn = None
+        self._queue: asyncio.Queue | None = None
+        self._wake: asyncio.Event | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._direct: set[asyncio.Task] = set()   # non-durable deliveries (store errors)
+        self._held: list[tuple[str, dict]] = []   # the same without workers, until run_due()
+        self.in_flight = 0
+        self.stats = {'enqueued': 0, 'duplicate': 0, 'success': 0, 'failed': 0, 'dry-run': 0, 'invalid': 0,
+                      'retried': 0, 'dead': 0, 'dropped': 0,
+                      'digest_merged': 0, 'deferred': 0}
+        self._latency = deque(maxlen=500)   # enqueue -> delivered (ms)
+        self._send_ms = deque(maxlen=500)   # provider call only (ms)
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            for stmt in _SCHEMA:
+                self._conn.execute(stmt)
+        return self._conn
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self.running:
+            return
+        self.prune()
+        # enough connections for one LINE fan-out at full concurrency
+        self.client = new_client(max(self.workers * 2, int(os.environ.get('LINE_CONCURRENCY', '32'))))
+        self._queue = asyncio.Queue()
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._scheduler()))
+
+    async def stop(self, timeout: float = 10.0):
+        """Deliver what is due (up to `timeout` seconds), then stop; the rest stays on disk."""
+        if not self.running:
+            return
+        await self.drain(timeout)
+        if self._direct:
+            await asyncio.wait(list(self._direct), timeout=timeout)
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # jobs claimed but not started go back to pending
+        while not self._queue.empty():
+            self._release(self._queue.get_nowait())
+        await self.client.aclose()
+        self.client = None
+
+    async def drain(self, timeout: float = 10.0):
+        """Wait until no job is due or in flight (jobs backing off are not waited for)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.in_flight and (self._queue is None or self._queue.empty()) and not self._due_count():
+                return
+            self._kick()
+            await asyncio.sleep(0.05)
+
+    # -- job table -------------------------------------------------------
+
+    def add(self, kind: str, payload: dict, key: str | None = None, due: float | None = None):
+        """Store a job (due at `due`, default now); returns its id, None when `key` is
+        already stored, 0 when the store failed."""
+        now = time.time()
+        try:
+            cur = self._db().execute(
+                'INSERT OR IGNORE INTO jobs(key, kind, payload, state, next_at, created, updated) '
+                "VALUES(?,?,?,'pending',?,?,?)",
+                (key or uuid.uuid4().hex, kind, json.dumps(payload, ensure_ascii=False), due or now, now, now),
+            )
+        except Exception as e:
+            _log(f"outbox store error, {kind} notification is not durable: {e}\n")
+            self.stats['dropped'] += 1
+            return 0
+        if not cur.rowcount:
+            self.stats['duplicate'] += 1
+            return None
+        self.stats['enqueued'] += 1
+        return cur.lastrowid
+
+    def _claim(self, job_id: int) -> bool:
+        now = time.time()
+        cur = self._db().execute(
+            "UPDATE jobs SET state='sending', next_at=?, updated=? "
+            "WHERE id=? AND state IN ('pending','sending') AND next_at<=?",
+            (now + self.claim_ttl, now, job_id, now),
+        )
+        return cur.rowcount == 1
+
+    def _release(self, job_id: int):
+        try:
+            self._db().execute("UPDATE jobs SET state='pending', next_at=? WHERE id=? AND state='sending'",
+                               (time.time(), job_id))
+        except Exception:
+            pass
+
+    def backoff(self, attempts: int) -> float:
+        """Seconds before retry number `attempts` (+-20% jitter)."""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def mark(self, job_id: int | None, outcome: str, error: str = ''):
+        """Record a delivery outcome: sent, or pending with backoff, or dead after max attempts.
+
+        'invalid' (no valid destination left) is dead at once: a retry cannot succeed.
+        """
+        if not job_id:
+            return
+        now = time.time()
+        db = self._db()
+        try:
+            if outcome in ('success', 'dry-run'):
+                db.execute("UPDATE jobs SET state='sent', attempts=attempts+1, updated=?, last_error=NULL WHERE id=?",
+                           (now, job_id))
+                return
+            row = db.execute('SELECT attempts FROM jobs WHERE id=?', (job_id,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            if attempts >= self.max_attempts or outcome == 'invalid':
+                db.execute("UPDATE jobs SET state='dead', attempts=?, updated=?, last_error=? WHERE id=?",
+                           (attempts, now, error or outcome, job_id))
+                self.stats['dead'] += 1
+                _log(f"outbox job {job_id} dead after {attempts} attempts: {error or outcome}\n")
+            else:
+                db.execute("UPDATE jobs SET state='pending', attempts=?, next_at=?, updated=?, last_error=? WHERE id=?",
+                           (attempts, now + self.backoff(attempts), now, error or outcome, job_id))
+                self.stats['retried'] += 1
+                self._kick()
+        except Exception as e:
+            _log(f"outbox mark error (job {job_id}): {e}\n")
+
+    def _due(self, limit: int) -> list[int]:
+        try:
+            return [r[0] for r in self._db().execute(
+                "SELECT id FROM jobs WHERE state IN ('pending','sending') AND next_at<=? ORDER BY next_at LIMIT ?",
+                (time.time(), limit))]
+        except Exception:
+            return []
+
+    def _due_count(self) -> int:
+        try:
+            return self._db().execute(
+                "SELECT COUNT(*) FROM jobs WHERE state='pending' AND next_at<=?", (time.time(),)).fetchone()[0]
+        except Exception:
+            return 0
+
+    def _next_due(self):
+        try:
+            return self._db().execute(
+                "SELECT MIN(next_at) FROM jobs WHERE state IN ('pending','sending')").fetchone()[0]
+        except Exception:
+            return None
+
+    def prune(self) -> int:
+        """Delete sent and dead jobs older than OUTBOX_RETENTION_DAYS."""
+        try:
+            cur = self._db().execute("DELETE FROM jobs WHERE state IN ('sent','dead') AND updated < ?",
+                                     (time.time() - self.retention_days * 86400,))
+            return cur.rowcount
+        except Exception:
+            return 0
+
+    # -- digests and rate caps -------------------------------------------
+
+    @property
+    def digest_enabled(self) -> bool:
+        return self.digest_window > 0 or self.rate_per_hour > 0
+
+    def add_digest(self, recipient: str, subject: str, lines: list[str], event_keys: list[str],
+                   urgent: bool = False) -> bool:
+        """Add changes for `recipient` to its open digest (or open one).
+
+        `subject` may contain {n} (number of lines at send time). Event keys
+        already in the open digest or in the last sent one are skipped, so a
+        poll repeated after a crash does not repeat changes. Returns False
+        when nothing new was added.
+        """
+        now = time.time()
+        lo = f'digest:{recipient}:'
+        hi = lo[:-1] + ';'
+        db = self._db()
+        try:
+            rows = db.execute(
+                'SELECT id, payload, state, created FROM jobs WHERE kind=\'digest\' AND key >= ? AND key < ? '
+                'ORDER BY created DESC LIMIT 2', (lo, hi)).fetchall()
+        except Exception as e:
+            _log(f"outbox digest error: {e}\n")
+            rows = []
+        seen = set()
+        for _, payload, _, _ in rows:
+            seen.update(json.loads(payload).get('events', ()))
+        new = [(k, line) for k, line in zip(event_keys, lines) if k not in seen]
+        if not new:
+            self.stats['duplicate'] += 1
+            return False
+        for job_id, payload, state, _ in rows:
+            if state != 'pending':
+                continue
+            data = json.loads(payload)
+            data['lines'] += [line for _, line in new]
+            data['events'] += [k for k, _ in new]
+            cur = db.execute("UPDATE jobs SET payload=?, updated=? WHERE id=? AND state='pending'",
+                             (json.dumps(data, ensure_ascii=False), now, job_id))
+            if cur.rowcount:
+                self.stats['digest_merged'] += len(new)
+                return True
+        # first alert of a burst goes out at once for urgent subscriptions
+        recent = rows and now - rows[0][3] < self.digest_window
+        due = now if urgent and not recent else now + self.digest_window
+        job_id = self.add('digest', {'recipient': recipient, 'subject': subject,
+                                     'lines': [line for _, line in new], 'events': [k for k, _ in new]},
+                          f'{lo}{now:.6f}', due=due)
+        if job_id:
+            self._kick()
+        return bool(job_id)
+
+    def take_token(self, name: str) -> float:
+        """Take one token from `name`'s bucket; 0 when taken, else seconds until one is available."""
+        if self.rate_per_hour <= 0:
+            return 0.0
+        rate = self.rate_per_hour / 3600
+        now = time.time()
+        db = self._db()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute('SELECT tokens, updated FROM buckets WHERE name=?', (name,)).fetchone()
+                tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * rate)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+                if not wait:
+                    tokens -= 1
+                db.execute('INSERT OR REPLACE INTO buckets(name, tokens, updated) VALUES(?,?,?)', (name, tokens, now))
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+        except Exception as e:
+            _log(f"outbox rate limit error: {e}\n")
+            return 0.0
+        return wait
+
+    def _defer(self, job_id: int, delay: float):
+        self._db().execute("UPDATE jobs SET state='pending', next_at=?, updated=? WHERE id=?",
+                           (time.time() + delay, time.time(), job_id))
+        self._kick()
+
+    def _kick(self):
+        """Make the scheduler recompute its next wake-up."""
+        if self._wake is not None:
+            self._wake.set()
+
+    # -- enqueue / deliver -----------------------------------------------
+
+    def _enqueue(self, kind: str, payload: dict, key: str | None) -> bool:
+        job_id = self.add(kind, payload, key)
+        if job_id is None:
+            return False
+        if job_id == 0:
+            # store unavailable: still deliver once, without retries
+            if not self.running:
+                self._held.append((kind, payload))   # sent by the caller's next run_due()
+                return True
+            task = asyncio.ensure_future(self._deliver(kind, payload))
+            self._direct.add(task)
+            task.add_done_callback(self._direct.discard)
+            return True
+        self._kick()
+        return True
+
+    def enqueue_email(self, subject: str, body: str, recipients: list[str], key: str | None = None) -> bool:
+        return self._enqueue('email', {'subject': subject, 'body': body, 'recipients': list(recipients)}, key)
+
+    def enqueue_line(self, message: str, tokens: list[str], key: str | None = None) -> bool:
+        return self._enqueue('line', {'message': message, 'tokens': list(tokens)}, key)
+
+    async def _deliver(self, kind: str, payload: dict, job_id: int | None = None) -> str:
+        if kind == 'digest':
+            subject = payload['subject'].replace('{n}', str(len(payload['lines'])))
+            return await deliver_email(self.client, subject, '\n'.join(payload['lines']), [payload['recipient']])
+        if kind == 'email':
+            failed = []
+            outcome = await deliver_email(self.client, payload['subject'], payload['body'], payload['recipients'],
+                                          failed_recipients=failed)
+            if outcome == 'failed' and job_id and 0 < len(failed) < len(payload['recipients']):
+                # the retry goes only to the recipients that did not get the message
+                self._db().execute('UPDATE jobs SET payload=? WHERE id=?',
+                                   (json.dumps(dict(payload, recipients=failed), ensure_ascii=False), job_id))
+            return outcome
+        failed = []
+        outcome = await deliver_line(self.client, payload['message'], payload['tokens'], failed_tokens=failed)
+        if job_id and failed and len(failed) < len(payload['tokens']):
+            # retry only the tokens that failed (rate limited, network errors)
+            self._db().execute('UPDATE jobs SET payload=? WHERE id=?',
+                               (json.dumps(dict(payload, tokens=failed), ensure_ascii=False), job_id))
+            outcome = 'failed'
+        return outcome
+
+    async def _run_job(self, job_id: int) -> str:
+        row = self._db().execute('SELECT kind, payload, created FROM jobs WHERE id=?', (job_id,)).fetchone()
+        if row is None:
+            return 'failed'
+        if row[0] == 'digest':
+            wait = self.take_token(json.loads(row[1])['recipient'])
+            if wait:
+                # over the recipient's rate cap: keep collecting until a token is free
+                self._defer(job_id, wait)
+                self.stats['deferred'] += 1
+                return 'deferred'
+        self.in_flight += 1
+        t0 = time.monotonic()
+        error = ''
+        try:
+            outcome = await self._deliver(row[0], json.loads(row[1]), job_id)
+        except Exception as e:
+            _log(f"outbox delivery error: {e}\n")
+            outcome, error = 'failed', str(e)
+        finally:
+            self.in_flight -= 1
+        self._send_ms.append((time.monotonic() - t0) * 1000)
+        metrics.record_stage('send', self._send_ms[-1])
+        self.mark(job_id, outcome, error)
+        if outcome not in ('failed', 'invalid'):
+            self._latency.append((time.time() - row[2]) * 1000)
+        self.stats[outcome] = self.stats.get(outcome, 0) + 1
+        return outcome
+
+    async def run_due(self, limit: int = 100) -> int:
+        """Deliver due jobs inline (one-shot runners without workers). Returns the number attempted.
+
+        Without workers, enqueue_email()/enqueue_line() only store the job;
+        this sends it through the same path (per-recipient retries, timings).
+        """
+        own_client = self.client is None
+        if own_client:
+            self.client = new_client(2)
+        n = 0
+        try:
+            while self._held:
+                kind, payload = self._held.pop(0)
+                try:
+                    await self._deliver(kind, payload)
+                except Exception as e:
+                    _log(f"outbox delivery error: {e}\n")
+                n += 1
+            for job_id in self._due(limit):
+                if self._claim(job_id):
+                    await self._run_job(job_id)
+                    n += 1
+        finally:
+            if own_client:
+                await self.client.aclose()
+                self.client = None
+        return n
+
+    async def _scheduler(self):
+        """Claim due jobs for the workers; sleep until the next one is due or a job is enqueued."""
+        while True:
+            # claim a little ahead of the workers only: queued claims must not expire
+            room = self.workers * 2 - self._queue.qsize()
+            if room > 0:
+                for job_id in self._due(room):
+                    if self._claim(job_id):
+                        self._queue.put_nowait(job_id)
+            next_at = self._next_due()
+            wait = 5.0 if next_at is None else min(5.0, max(0.05, next_at - time.time()))
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                _log(f"outbox worker error (job {job_id}): {e}\n")
+            finally:
+                self._queue.task_done()
+
+    def status(self) -> dict:
+        try:
+            states = dict(self._db().execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+        except Exception:
+            states = {}
+        return {
+            'running': self.running,
+            'workers': self.workers,
+            'depth': states.get('pending', 0),
+            'in_flight': self.in_flight,
+            'jobs': states,
+            'stats': dict(self.stats),
+            'latency_ms': {'p50': _percentile(self._latency, 0.5), 'p95': _percentile(self._latency, 0.95),
+                           'max': max(self._latency) if self._latency else None},
+            'send_ms': {'p50': _percentile(self._send_ms, 0.5), 'p95': _percentile(self._send_ms, 0.95)},
+            'providers': health_status(),
+            'smtp': pools_status(),
+            'line': line_status(),
+        }
@@ -0,0 +1,152 @@
+"""Circuit breakers and latency ranking for the email providers.
+
+Each provider (sendgrid, mailgun, smtp) has a `ProviderHealth` with a
+rolling window of recent calls (PROVIDER_WINDOW seconds, outcome and
+latency). The breaker opens when PROVIDER_MAX_FAILURES calls in a row
+failed, or when at least PROVIDER_MIN_CALLS calls in the window failed at
+PROVIDER_ERROR_RATE or more. An open provider is skipped for
+PROVIDER_COOLDOWN seconds (doubling on every failed probe, up to
+PROVIDER_COOLDOWN_MAX); then it is half-open and one delivery is let
+through as a probe: success closes the breaker, failure opens it again.
+
+`rank()` orders the usable providers: closed before half-open, measured
+before unmeasured, then by median latency in the window, where a failed
+call counts as at least PROVIDER_FAILURE_PENALTY_MS, then by the configured
+order. A provider without samples (a cold fallback, or any provider after a
+restart) thus does not take traffic from a measured one, except on every
+PROVIDER_EXPLORE_EVERY-th ranking (0 disables it), where unmeasured closed
+providers go first so a fallback is measured before it is needed.
+"""
+import os
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def _median(vals):
+    if not vals:
+        return None
+    vs = sorted(vals)
+    return vs[len(vs) // 2]
+
+
+class ProviderHealth:
+    def __init__(self, name: str):
+        env = os.environ
+        self.name = name
+        self.window = float(env.get('PROVIDER_WINDOW', '300'))
+        self.max_failures = int(env.get('PROVIDER_MAX_FAILURES', '3'))
+        self.min_calls = int(env.get('PROVIDER_MIN_CALLS', '5'))
+        self.error_rate = float(env.get('PROVIDER_ERROR_RATE', '0.5'))
+        self.base_cooldown = float(env.get('PROVIDER_COOLDOWN', '30'))
+        self.max_cooldown = float(env.get('PROVIDER_COOLDOWN_MAX', '600'))
+        self.failure_penalty = float(env.get('PROVIDER_FAILURE_PENALTY_MS', '10000'))
+        self.state = CLOSED
+        self.cooldown = self.base_cooldown
+        self.opened_at = 0.0
+        self.probing = False
+        self.consecutive_failures = 0
+        self._calls = deque()    # (monotonic ts, ok, latency ms)
+
+    def _trim(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def available(self) -> bool:
+        """True when a call may go to this provider now (without taking the probe)."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return not self.probing
+
+    def acquire(self) -> bool:
+        """Let a call through; in half-open state only one (the probe) at a time."""
+        if not self.available():
+            return False
+        if self.state != CLOSED:
+            self.state = HALF_OPEN
+            self.probing = True
+        return True
+
+    def release(self):
+        """Give back a probe that was acquired but not used."""
+        self.probing = False
+
+    def record(self, ok: bool, latency_ms: float):
+        now = time.monotonic()
+        self._calls.append((now, ok, latency_ms))
+        self._trim(now)
+        if ok:
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self.cooldown = self.base_cooldown
+                self.probing = False
+            return
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            self._open(now, self.cooldown * 2)
+            return
+        failures = sum(1 for c in self._calls if not c[1])
+        if self.consecutive_failures >= self.max_failures or (
+                len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.error_rate):
+            self._open(now, self.base_cooldown)
+
+    def _open(self, now: float, cooldown: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.cooldown = min(self.max_cooldown, cooldown)
+        self.probing = False
+
+    def latency(self):
+        """Median latency (ms) in the window with failures penalized, None without samples."""
+        self._trim(time.monotonic())
+        return _median([c[2] if c[1] else max(c[2], self.failure_penalty) for c in self._calls])
+
+    def status(self) -> dict:
+        self._trim(time.monotonic())
+        calls = len(self._calls)
+        failures = sum(1 for c in self._calls if not c[1])
+        retry_in = None
+        if self.state == OPEN:
+            retry_in = max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+        return {'state': self.state, 'calls': calls, 'failures': failures,
+                'error_rate': failures / calls if calls else 0.0, 'latency_ms': self.latency(),
+                'retry_in': retry_in}
+
+
+_health: dict[str, ProviderHealth] = {}
+
+
+def health(name: str) -> ProviderHealth:
+    h = _health.get(name)
+    if h is None:
+        h = _health[name] = ProviderHealth(name)
+    return h
+
+
+_rankings = 0
+
+
+def rank(names: list[str]) -> list[str]:
+    """Usable providers of `names`, best first (see module docstring)."""
+    global _rankings
+    _rankings += 1
+    every = int(os.environ.get('PROVIDER_EXPLORE_EVERY', '20'))
+    explore = every > 0 and _rankings % every == 0
+
+    def key(item):
+        i, name = item
+        h = health(name)
+        latency = h.latency()
+        return (h.state != CLOSED, (latency is None) != explore, latency or 0.0, i)
+
+    return [name for _, name in sorted(enumerate(names), key=key) if health(name).available()]
+
+
+def health_status() -> dict:
+    return {name: h.status() for name, h in _health.items()}
@@ -0,0 +1,91 @@
+"""Push-mode change detection: a MutationObserver inside the open calendar page.
+
+The observer collects the service_unit containers touched by DOM mutations,
+debounces them for PUSH_DEBOUNCE_MS and reports only those containers to
+Python through `page.expose_binding`. The callback receives slot dicts (same
+shape as `fetch_parsed_with_page`) so only changed slots are classified,
+diffed and notified.
+
+The poller keeps a light periodic reload as a safety net (the site may not
+re-render by itself, and observers are lost on navigation); call `install()`
+again after every reload.
+"""
+import asyncio
+import os
+import weakref
+
+from calendar_parse import make_slot
+
+BINDING_NAME = '__anSlotsChanged'
+
+_OBSERVER_JS = (
+    "(debounce) => {"
+    "if (window.__anObserver) return false;"
+    "const START='input.service_unit_service_start_datetime';"
+    # same container lookup as the DOM extractor: climb from the input
+    "const containerOf=(inp)=>{ let c=inp.parentElement; for(let i=0;i<8 && c;i++,c=c.parentElement){ if((c.className||'').toString().indexOf('service_unit')!==-1) break; } return c||inp.parentElement; };"
+    "const collect=(c)=>{"
+    "const inp=c.querySelector(START);"
+    "const getVal=(cls)=>{ const el=c.querySelector(cls); return el? (el.value||el.innerText||'') : ''; };"
+    "const icon=c.querySelector('i')||c.querySelector('.service_icon i');"
+    "return {start:inp?(inp.value||''):'', end:getVal('.service_unit_service_end_datetime'),"
+    "service_cd:getVal('.service_unit_service_cd'), multi:getVal('.service_unit_service_multi_edit_key'),"
+    "icon_class:icon?(icon.className||''):'', icon_color:icon&&icon.style?(icon.style.color||''):'',"
+    "bg:window.getComputedStyle(c).backgroundColor||'', text:(c.innerText||'').slice(0,300)};"
+    "};"
+    "const pending=new Set(); let timer=null;"
+    "const flush=()=>{ timer=null; const out=[]; for(const c of pending){ if(c.isConnected && c.querySelector(START)) out.push(collect(c)); } pending.clear(); if(out.length) window." + BINDING_NAME + "(out); };"
+    # a mutated node belongs to the slots whose inputs it (or its nearest ancestors) contains
+    "const touch=(node)=>{ let el=node.nodeType===1?node:node.parentElement;"
+    "for(let i=0;i<10 && el;i++,el=el.parentElement){ const inps=el.querySelectorAll?el.querySelectorAll(START):[]; if(inps.length){ for(const inp of inps) pending.add(containerOf(inp)); return; } } };"
+    "const obs=new MutationObserver((muts)=>{ for(const m of muts){ touch(m.target); for(const n of m.addedNodes) touch(n); }"
+    "if(pending.size && !timer) timer=setTimeout(flush, debounce); });"
+    "obs.observe(document.body,{subtree:true,childList:true,characterData:true,attributes:true,attributeFilter:['class','style','value']});"
+    "window.__anObserver=obs; return true;"
+    "}"
+)
+
+
+class SlotWatcher:
+    """Installs the observer on pages and forwards changed slots to `on_slots(items)` (async).
+
+    Calls are serialized so the diff/persist step never runs concurrently.
+    `paused` drops reports, e.g. while the poller itself switches weeks.
+    """
+
+    def __init__(self, on_slots, debounce_ms: int | None = None):
+        self.on_slots = on_slots
+        self.debounce_ms = debounce_ms or int(os.environ.get('PUSH_DEBOUNCE_MS', '200'))
+        self.paused = False
+        self.stats = {'pushes': 0, 'slots': 0, 'errors': 0}
+        self._lock = asyncio.Lock()
+        self._bound = weakref.WeakSet()
+
+    async def install(self, page) -> bool:
+        """Expose the binding (once per page) and (re)install the observer in the current document."""
+        if page not in self._bound:
+            await page.expose_binding(BINDING_NAME, self._on_binding)
+            self._bound.add(page)
+        return await page.evaluate(_OBSERVER_JS, self.debounce_ms)
+
+    async def _on_binding(self, source, rows):
+        if self.paused or not rows:
+            return
+        items = [make_slot(
+            start_raw=r.get('start'),
+            end_raw=r.get('end'),
+            service_cd=r.get('service_cd'),
+            multi=r.get('multi'),
+            icon_class=r.get('icon_class'),
+            icon_color=r.get('icon_color'),
+            bg=r.get('bg'),
+            text=r.get('text'),
+        ) for r in rows]
+        self.stats['pushes'] += 1
+        self.stats['slots'] += len(items)
+        async with self._lock:
+            try:
+                await self.on_slots(items)
+            except Exception:
+                self.stats['errors'] += 1
+                raise
@@ -5,6 +5,12 @@ Run this directly (recommended in systemd service). It imports the notify helper
 from `app.py` and reuses a single Playwright page for efficiency.
 
 Usage: set environment variables (SMTP_*, FROM_EMAIL, POLL_INTERVAL optional) and run.
+With POLL_ENGINE=http the calendar is polled over plain HTTP (see http_engine.py)
+and Chromium is only started for fallback and periodic verification.
+With POLL_MODE=push changed slots are reported by an in-page MutationObserver
+(see push_watch.py) and the full poll becomes a periodic resync.
+The poller only launches Chromium while it holds the scraper lease (see
+leader.py); otherwise it waits as a follower.
 """
 import asyncio
 import os
@@ -13,9 +19,18 @@ import time
 from datetime import datetime, timedelta, timezone
 import traceback
 
+import log_writer
+import metrics
+
 # import the page-based notify helper
 from app import notify_once_with_page
 from app import POLL_INTERVAL
+from app import scrape_stage_stats
+from app import fetch_weeks_with_page, notify_once_with_fetcher
+from app import notify_changed_slots, week_pages
+from app import leadership, outbox
+from page_profile import TransferMeter, apply_profile, launch_args
+from push_watch import SlotWatcher
 
 STOP = False
 
@@ -106,18 +121,115 @@ def dump_env_status(path: str = 'poller.log'):
     for k in keys:
         v = os.environ.get(k)
         pairs.append(f"{k}={_mask_val(k, v)}")
+    log_writer.write(path, f"[{datetime.now(timezone.utc).isoformat()}] env: " + ', '.join(pairs) + '\n')
+
+
+async def _sleep_until_next(tick_start: float, interval: int | None = None):
+    elapsed = time.time() - tick_start
+    if interval is None:
+        interval = int(os.environ.get('POLL_INTERVAL', str(POLL_INTERVAL or 60)))
+    to_sleep = max(0, interval - elapsed)
+    # sleep in small chunks to be responsive to STOP
+    slept = 0
+    while slept < to_sleep and not STOP:
+        await asyncio.sleep(min(1, to_sleep - slept))
+        slept += min(1, to_sleep - slept)
+
+
+async def _wait_for_leadership():
+    """Block (as a follower) until this process holds the scraper lease; False when stopping."""
+    lease = leadership()
+    lease.keepalive()
+    logged = False
+    while not STOP:
+        if lease.acquire():
+            return True
+        if not logged:
+            log_writer.log(f"[{datetime.now(timezone.utc).isoformat()}] follower: leader is {lease.current()['leader']}\n")
+            logged = True
+        await _sleep_until_next(time.time())
+    return False
+
+
+async def run_http_poller():
+    """Poll with the browserless HTTP engine; Playwright is only launched for fallback/verification.
+
+    Enabled with POLL_ENGINE=http. The browser is started lazily when the
+    engine fails or is due for verification, and closed again once the
+    engine's output matched it.
+    """
+    from http_engine import HttpCalendarEngine, EngineWithFallback
+
+    url = "https://eipro.jp/takachiho1/eventCalendars/index"
+    holder = {'pw': None, 'browser': None, 'page': None}
+
+    async def browser_close():
+        for k in ('browser', 'pw'):
+            obj = holder[k]
+            holder[k] = None
+            if obj is None:
+                continue
+            try:
+                await (obj.close() if k == 'browser' else obj.stop())
+            except Exception:
+                pass
+        holder['page'] = None
+
+    async def browser_fetch(starts):
+        if holder['page'] is None or holder['page'].is_closed():
+            await browser_close()
+            from playwright.async_api import async_playwright
+            holder['pw'] = await async_playwright().start()
+            t0 = time.monotonic()
+            holder['browser'] = await holder['pw'].chromium.launch(headless=True, args=launch_args())
+            metrics.record_stage('browser_launch', (time.monotonic() - t0) * 1000)
+            context = await holder['browser'].new_context()
+            await apply_profile(context)
+            holder['page'] = await context.new_page()
+            t0 = time.monotonic()
+            try:
+                await holder['page'].goto(url, wait_until='networkidle', timeout=60000)
+            except Exception:
+                pass
+            metrics.record_stage('goto', (time.monotonic() - t0) * 1000)
+        return await fetch_weeks_with_page(holder['page'], starts)
+
+    load_env_files()
+    engine = HttpCalendarEngine()
+    hybrid = EngineWithFallback(engine, browser_fetch, on_verified=browser_close)
+    await outbox().start()
     try:
-        with open(path, 'a', encoding='utf-8') as f:
-            f.write(f"[{datetime.now(timezone.utc).isoformat()}] env: " + ', '.join(pairs) + '\n')
-    except Exception:
-        # best-effort only
-        pass
+        while not STOP:
+            if not leadership().acquire():
+                # lost the lease: drop the browser and wait as a follower
+                await browser_close()
+                if not await _wait_for_leadership():
+                    break
+            tick_start = time.time()
+            try:
+                load_env_files()
+                today = datetime.now(timezone.utc).date()
+                s1 = today.strftime('%Y-%m-%d')
+                s2 = (today + timedelta(days=7)).strftime('%Y-%m-%d')
+                res = await notify_once_with_fetcher(hybrid.fetch_weeks, [s1, s2])
+                res['engine'] = hybrid.last_source
+                log_writer.log(f"[{datetime.now(timezone.utc).isoformat()}] poll result: {res}\n")
+            except Exception as e:
+                log_writer.log(f"[{datetime.now(timezone.utc).isoformat()}] poll exception: {e}\n{traceback.format_exc()}\n")
+                # drop the browser; it is relaunched on the next fallback
+                await browser_close()
+            await _sleep_until_next(tick_start)
+    finally:
+        await browser_close()
+        await engine.aclose()
+        await outbox().stop()
 
 
 async def run_poller():
     global STOP
     backoff = 1
     max_backoff = 300
+    launched = False
     url = "https://eipro.jp/takachiho1/eventCalendars/index"
 
     from playwright.async_api import async_playwright
@@ -129,21 +241,53 @@ async def run_poller():
     except Exception:
         pass
 
+    # push mode: a MutationObserver in the page reports changed slots between
+    # full polls; the full poll (with page reload) runs every PUSH_RESYNC_INTERVAL
+    push = None
+    if os.environ.get('POLL_MODE', 'interval') == 'push':
+        async def _on_push(items):
+            res = await notify_changed_slots(items)
+            log_writer.log(f"[{datetime.now(timezone.utc).isoformat()}] push result: {res}\n")
+
+        push = SlotWatcher(_on_push)
+
+    # notifications are delivered by the outbox workers; polls never wait on providers
+    await outbox().start()
+
     while not STOP:
+        # followers do not launch a browser
+        if not await _wait_for_leadership():
+            break
         try:
             async with async_playwright() as p:
-                browser = await p.chromium.launch(headless=True)
-                page = await browser.new_page()
+                t0 = time.monotonic()
+                browser = await p.chromium.launch(headless=True, args=launch_args())
+                metrics.record_stage('browser_launch', (time.monotonic() - t0) * 1000)
+                if launched:
+                    metrics.browser_restarts.inc('poller')
+                launched = True
+                context = await browser.new_context()
+                # lean profile: block resources the extractor never reads, meter transfer
+                meter = TransferMeter()
+                await apply_profile(context, meter)
+                page = await context.new_page()
+                load_start = time.time()
                 try:
                     await page.goto(url, wait_until='networkidle', timeout=60000)
                 except Exception:
                     # proceed anyway; page navigation may or may not be required before selecting weeks
                     pass
+                load_ms = int((time.time() - load_start) * 1000)
+                metrics.record_stage('goto', load_ms)
 
                 # reset backoff on successful create
                 backoff = 1
+                ticks = 0
 
                 while not STOP:
+                    if not leadership().acquire():
+                        # another process took over the lease: close the browser, wait as a follower
+                        break
                     tick_start = time.time()
                     try:
                         # reload env each iteration so changes to env files take effect without restarting
@@ -156,23 +300,43 @@ async def run_poller():
                         today = datetime.now(timezone.utc).date()
                         s1 = today.strftime('%Y-%m-%d')
                         s2 = (today + timedelta(days=7)).strftime('%Y-%m-%d')
+                        if push is not None:
+                            # our own week switching must not be reported as pushes
+                            push.paused = True
                         res = await notify_once_with_page(page, [s1, s2])
-                        with open('notification.log', 'a', encoding='utf-8') as f:
-                            f.write(f"[{datetime.now(timezone.utc).isoformat()}] poll result: {res}\n")
+                        # bytes/requests transferred since the last report (first one includes the page load)
+                        res['transfer'] = meter.take()
+                        if load_ms is not None:
+                            res['transfer']['load_ms'] = load_ms
+                            load_ms = None
+                        log_writer.log(f"[{datetime.now(timezone.utc).isoformat()}] poll result: {res}\n")
+                        ticks += 1
+                        if ticks % 10 == 1:
+                            # per-stage scrape timings (readiness waits vs. the old fixed sleeps)
+                            now = datetime.now(timezone.utc).isoformat()
+                            log_writer.log(f"[{now}] scrape stages: {scrape_stage_stats()}\n"
+                                           f"[{now}] outbox: {outbox().status()}\n")
                     except Exception as e:
-                        with open('notification.log', 'a', encoding='utf-8') as f:
-                            f.write(f"[{datetime.now(timezone.utc).isoformat()}] poll exception: {e}\n{traceback.format_exc()}\n")
+                        log_writer.log(f"[{datetime.now(timezone.utc).isoformat()}] poll exception: {e}\n{traceback.format_exc()}\n")
                         # break to recreate browser/page with backoff
                         break
 
-                    elapsed = time.time() - tick_start
-                    interval = int(os.environ.get('POLL_INTERVAL', str(POLL_INTERVAL or 60)))
-                    to_sleep = max(0, interval - elapsed)
-                    # sleep in small chunks to be responsive to STOP
-                    slept = 0
-                    while slept < to_sleep and not STOP:
-                        await asyncio.sleep(min(1, to_sleep - slept))
-                        slept += min(1, to_sleep - slept)
+                    if push is None:
+                        await _sleep_until_next(tick_start)
+                        continue
+
+                    try:
+                        for pg in week_pages(page):
+                            await push.install(pg)
+                        push.paused = False
+                        await _sleep_until_next(tick_start, int(os.environ.get('PUSH_RESYNC_INTERVAL', '300')))
+                        # safety net: reload so the next full poll sees fresh server data
+                        push.paused = True
+                        for pg in week_pages(page):
+                            await pg.reload(wait_until='networkidle', timeout=60000)
+                    except Exception as e:
+                        log_writer.log(f"[{datetime.now(timezone.utc).isoformat()}] push watch error: {e}\n{traceback.format_exc()}\n")
+                        break
 
                 try:
                     await page.close()
@@ -184,8 +348,7 @@ async def run_poller():
                     pass
 
         except Exception as e:
-            with open('notification.log', 'a', encoding='utf-8') as f:
-                f.write(f"[{datetime.now(timezone.utc).isoformat()}] browser launch error: {e}\n{traceback.format_exc()}\n")
+            log_writer.log(f"[{datetime.now(timezone.utc).isoformat()}] browser launch error: {e}\n{traceback.format_exc()}\n")
 
         if STOP:
             break
@@ -194,13 +357,25 @@ async def run_poller():
         await asyncio.sleep(backoff)
         backoff = min(max_backoff, backoff * 2)
 
+    # deliver what is still queued before exiting
+    await outbox().stop()
+
 
 def main():
     _install_signal_handlers()
+    load_env_files()
+    leadership('poller')
+    try:
+        metrics.serve()
+    except Exception as e:
+        log_writer.log(f"[{datetime.now(timezone.utc).isoformat()}] metrics server not started: {e}\n")
+    runner = run_http_poller if os.environ.get('POLL_ENGINE', 'playwright') == 'http' else run_poller
     try:
-        asyncio.run(run_poller())
+        asyncio.run(runner())
     except KeyboardInterrupt:
         pass
+    finally:
+        log_writer.close()
 
 
 if __name__ == '__main__':
@@ -14,7 +14,18 @@ import os
 # Ensure current working directory is project root
 os.chdir(os.path.dirname(os.path.dirname(__file__)))
 
-from app import notify_once_for_starts
+from app import leadership, notify_once_for_starts, outbox
+
+
+async def _run(starts):
+    # retry notifications a previous run failed to deliver, then poll
+    retried = await outbox().run_due()
+    if retried:
+        print(f"Retried {retried} queued notification(s)")
+    res = await notify_once_for_starts(starts)
+    # urgent alerts and digests that came due while polling
+    await outbox().run_due()
+    return res
 
 
 def main():
@@ -22,8 +33,12 @@ def main():
     s1 = today.strftime('%Y-%m-%d')
     s2 = (today + timedelta(days=7)).strftime('%Y-%m-%d')
     print(f"Running notify for: {s1}, {s2}")
+    # skip the scrape when the poller or the app already holds the scraper lease
+    leadership('cron')
     try:
-        res = asyncio.run(notify_once_for_starts([s1, s2]))
+        res = asyncio.run(_run([s1, s2]))
+        if res.get('follower'):
+            print(f"Follower (leader is {res.get('leader')})")
         print('Result:', res)
     except Exception as e:
         print('Error running notify:', e)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Local SMTP stand-in for delivery and throughput tests.
+
+Accepts any sender and recipient except addresses starting with "bounce",
+which are refused with 550 (no such user); discards the message and counts it. It
+speaks plain SMTP (no STARTTLS, no AUTH), so point the app at it without
+SMTP_USER/SMTP_PASS. `--connect-ms` delays the greeting to model the
+TCP/TLS/AUTH cost of a real server, `--reply-ms` delays every reply, and
+`--idle-timeout` closes sessions idle for that many seconds (like Gmail does).
+
+Usage (from project root):
+  python scripts/smtp_sink.py --port 2525 --connect-ms 300 --reply-ms 5
+  SMTP_HOST=127.0.0.1 SMTP_PORT=2525 python scripts/run_notify.py
+"""
+import argparse
+import socket
+import socketserver
+import threading
+import time
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, addr, connect_ms: float = 0, reply_ms: float = 0, idle_timeout: float | None = None):
+        super().__init__(addr, _Handler)
+        self.connect_ms = connect_ms
+        self.reply_ms = reply_ms
+        self.idle_timeout = idle_timeout
+        self.messages = 0
+        self.sessions = 0
+        self._lock = threading.Lock()
+
+    def count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line: str):
+        if self.server.reply_ms:
+            time.sleep(self.server.reply_ms / 1000)
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        srv = self.server
+        srv.count('sessions')
+        if srv.connect_ms:
+            time.sleep(srv.connect_ms / 1000)
+        self.request.settimeout(srv.idle_timeout)
+        self.reply('220 smtp-sink ready')
+        in_data = False
+        while True:
+            try:
+                line = self.rfile.readline()
+            except socket.timeout:
+                self.reply('421 idle timeout, closing')
+                return
+            if not line:
+                return
+            if in_data:
+                if line in (b'.\r\n', b'.\n'):
+                    in_data = False
+                    srv.count('messages')
+                    self.reply('250 queued')
+                continue
+            cmd = line.decode('ascii', 'replace').strip().split(' ', 1)[0].upper()
+            if cmd == 'EHLO':
+                self.wfile.write(b'250-smtp-sink\r\n250-8BITMIME\r\n')
+                self.reply('250 SMTPUTF8')
+            elif cmd == 'RCPT' and b'<bounce' in line.lower():
+                self.reply('550 no such user')
+            elif cmd in ('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 ok')
+            elif cmd == 'DATA':
+                in_data = True
+                self.reply('354 end with .')
+            elif cmd == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 not implemented')
+
+
+def start_sink(port: int = 0, **kwargs) -> SinkServer:
+    """Start a sink on 127.0.0.1 in a daemon thread; the bound port is `server.server_address[1]`."""
+    srv = SinkServer(('127.0.0.1', port), **kwargs)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--port', type=int, default=2525)
+    ap.add_argument('--connect-ms', type=float, default=0)
+    ap.add_argument('--reply-ms', type=float, default=0)
+    ap.add_argument('--idle-timeout', type=float, default=None)
+    args = ap.parse_args()
+    srv = SinkServer(('127.0.0.1', args.port), args.connect_ms, args.reply_ms, args.idle_timeout)
+    print(f'smtp sink listening on 127.0.0.1:{args.port}')
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        print(f'sessions={srv.sessions} messages={srv.messages}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Test: BrowserPool leasing, load shedding and page replacement with fake Playwright objects.
+
+No Chromium is started: `_launch` returns a fake browser whose contexts hand
+out fake pages. Checks that callers beyond the idle pages wait, that the pool
+sheds load with PoolBusy once `max_waiters` callers wait or the acquire
+timeout passes (and that the app answers that with 503 + Retry-After), that a
+dead page is replaced on lease, and that `page_age()` follows `mark_loaded()`.
+Also checks that the app sees when a pooled page already shows the requested
+week (it then reloads instead of trusting the old render), and that a poll
+through the pool reports missing weeks and raises PoolBusy to its caller.
+
+Run from the project root: PYTHONPATH=. python scripts/test_browser_pool.py
+"""
+import asyncio
+import os
+import tempfile
+
+os.chdir(tempfile.mkdtemp())
+os.environ.update(PAGE_PROFILE='full', LOG_FLUSH_INTERVAL='0')
+
+import app  # noqa: E402
+from browser_pool import BrowserPool, PoolBusy  # noqa: E402
+
+
+class FakePage:
+    def __init__(self, values=()):
+        self.closed = False
+        self.gotos = 0
+        self.values = list(values)
+
+    async def goto(self, url, **kw):
+        self.gotos += 1
+
+    async def evaluate(self, js, *args):
+        if self.closed:
+            raise RuntimeError('page closed')
+        return self.values if 'service_unit_service_start_datetime' in js else 1
+
+    def is_closed(self):
+        return self.closed
+
+
+class FakeContext:
+    def __init__(self, pages):
+        self.pages = pages
+
+    async def new_page(self):
+        page = FakePage()
+        self.pages.append(page)
+        return page
+
+    async def close(self):
+        pass
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.pages = []
+
+    def is_connected(self):
+        return True
+
+    async def new_context(self):
+        return FakeContext(self.pages)
+
+    async def close(self):
+        pass
+
+
+async def started_pool(**kw) -> BrowserPool:
+    pool = BrowserPool(**kw)
+
+    async def launch():
+        return FakeBrowser()
+
+    pool._launch = launch
+    pool._browsers = [await pool._launch()]
+    for i in range(pool.size):
+        pool._idle.put_nowait(await pool._new_entry(0))
+    pool._started = True
+    return pool
+
+
+async def main():
+    pool = await started_pool(size=2, max_waiters=1, acquire_timeout=0.3)
+    assert all(p.gotos == 1 for p in pool._browsers[0].pages)
+
+    # two pages leased, one caller waits, the next is shed
+    release = asyncio.Event()
+    leased = []
+
+    async def hold():
+        async with pool.lease() as page:
+            leased.append(page)
+            await release.wait()
+
+    holders = [asyncio.create_task(hold()) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    waiter = asyncio.create_task(hold())
+    await asyncio.sleep(0.01)
+    assert pool.status()['waiters'] == 1 and pool.status()['leased'] == 2, pool.status()
+    try:
+        async with pool.lease():
+            raise AssertionError('lease beyond max_waiters must be rejected')
+    except PoolBusy as e:
+        resp = app._busy_response(e)
+        assert resp.status_code == 503 and resp.headers['retry-after'] == '5'
+        print('saturated:', e)
+    release.set()
+    await asyncio.gather(*holders, waiter)
+    assert pool.stats['leases'] == 3 and pool.stats['rejected'] == 1, pool.stats
+    print('max_waiters OK')
+
+    # a caller that cannot get a page within acquire_timeout is shed as well
+    pool = await started_pool(size=1, max_waiters=5, acquire_timeout=0.1)
+    async with pool.lease():
+        try:
+            async with pool.lease():
+                raise AssertionError('lease must time out')
+        except PoolBusy as e:
+            assert 'within' in str(e), e
+    assert pool.stats['rejected'] == 1 and pool.status()['idle'] == 1
+    print('acquire timeout OK')
+
+    # a page that died while idle is replaced on the next lease
+    async with pool.lease() as page:
+        first = page
+    first.closed = True
+    async with pool.lease() as page:
+        assert page is not first and not page.is_closed()
+    assert pool.stats['replaced'] == 1 and pool.status()['idle'] == 1
+    print('replace unhealthy page OK')
+
+    # page_age follows mark_loaded; a page that never loaded has no age
+    fresh = FakePage()
+    assert pool.page_age(fresh) is None
+    pool.mark_loaded(fresh)
+    assert 0 <= pool.page_age(fresh) < 1
+    await asyncio.sleep(0.05)
+    assert pool.page_age(fresh) >= 0.05
+    print('page_age OK')
+
+    # a pooled page already showing the requested week must be reloaded, not re-selected
+    page = FakePage(['2025/11/18 09:00:00', '2025/11/19 09:00:00'])
+    assert await app._shows_week(page, '2025-11-16')
+    assert not await app._shows_week(page, '2025-11-23')
+    print('stale week reload OK')
+
+    # with the pool, notify_once_for_starts reports missing weeks and sheds load on PoolBusy
+    async def fetch(start_date=None):
+        if start_date == '2030-01-13':
+            raise app.WeekNotFound(f'no week option for {start_date}')
+        if start_date == 'busy':
+            raise PoolBusy('browser pool saturated (8 waiting)')
+        return [{'date': '2030-01-07', 'time': '09:00', 'status': 'full', 'raw_text': '',
+                 'attrs': {'service_cd': 'boat-1', 'start_raw': '2030/01/07 09:00:00'}}]
+
+    real_fetch, real_pool = app.fetch_parsed_impl, app._browser_pool
+    app.fetch_parsed_impl, app._browser_pool = fetch, pool
+    try:
+        res = await app.notify_once_for_starts(['2030-01-06', '2030-01-13'])
+        assert res['missing_weeks'] == ['2030-01-13'] and res['new_count'] == 0, res
+        try:
+            await app.notify_once_for_starts(['2030-01-06', 'busy'])
+            raise AssertionError('PoolBusy must reach the caller')
+        except PoolBusy:
+            pass
+    finally:
+        app.fetch_parsed_impl, app._browser_pool = real_fetch, real_pool
+    print('pool poll OK')
+    print('OK')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Test: calendar_parse on representative response bodies.
+
+Parses a JSON document (slot objects with ordable / remaining fields, plus a
+string value carrying service_unit HTML), an HTML fragment with the
+service_unit markup, and bodies that match neither (which give []). Checks
+that `slots_from_body` picks JSON or HTML by content type and leading
+character, and that `ResponseCapture` only reads XHR/fetch responses of the
+calendar host. Finally the compact column payload is built from the same
+inputs as `make_slot` (the way the in-page `compact()` builds it) and
+`slots_from_columns` must decode it to the same slots, with and without the
+not-full-only filter.
+
+Run from the project root: PYTHONPATH=. python scripts/test_calendar_parse.py
+"""
+import asyncio
+import json
+
+from calendar_parse import (STATUS_CODES, ResponseCapture, make_slot, slots_from_body, slots_from_columns,
+                            slots_from_html, slots_from_json)
+
+HTML = (
+    '<div class="calendar">'
+    '<div class="service_unit">'
+    '<input class="service_unit_service_start_datetime" value="2025/11/16 09:00:00">'
+    '<input class="service_unit_service_end_datetime" value="2025/11/16 10:00:00">'
+    '<input class="service_unit_service_cd" value="boat-1">'
+    '<input class="service_unit_service_multi_edit_key" value="k1">'
+    '<i class="fa fa-circle"></i> 〇</div>'
+    '<div class="service_unit" style="background-color: #C0C0C0">'
+    '<input class="service_unit_service_start_datetime" value="2025/11/16 10:00:00">'
+    '<input class="service_unit_service_cd" value="boat-1"><i class="fa fa-circle"></i></div>'
+    '<div class="service_unit">'
+    '<input class="service_unit_service_start_datetime" value="2025/11/17 09:00:00">'
+    '<input class="service_unit_service_cd" value="boat-2">'
+    '<i class="fa fa-times" style="color: red"></i></div>'
+    '<div class="service_unit">'
+    '<input class="service_unit_service_start_datetime" value="2025/11/17 11:00:00">'
+    '<input class="service_unit_service_cd" value="boat-2"><i class="fa fa-hourglass"></i> 砂時計</div>'
+    '</div>'
+)
+
+DOC = {
+    'result': 'ok',
+    'data': {
+        'units': [
+            {'service_start_datetime': '2025-11-18 09:00:00', 'service_end_datetime': '2025-11-18 10:00:00',
+             'service_cd': 'boat-1', 'ordable': 1},
+            {'service_start_datetime': '2025-11-18 10:00:00', 'service_cd': 'boat-1', 'remaining_count': '0'},
+            {'service_start_datetime': '2025-11-18T11:00', 'service_cd': 'boat-1'},
+        ],
+        'fragment': HTML,
+    },
+}
+
+
+def summary(slots):
+    return sorted((s['date'], s['time'], s['attrs']['service_cd'], s['status']) for s in slots)
+
+
+# make_slot keyword inputs for the column round trip
+COLUMN_INPUTS = [
+    dict(start_raw='2025/11/16 09:00:00', service_cd='boat-1', icon_class='fa fa-circle', text='〇'),
+    dict(start_raw='2025/11/16 10:00:00', service_cd='boat-1', icon_class='fa fa-times', icon_color='red'),
+    dict(start_raw='2025/11/17 09:00:00', service_cd='boat-2', bg='rgb(192, 192, 192)'),
+    dict(start_raw='2025-11-17T11:30', service_cd='boat-2', icon_class='fa fa-hourglass'),
+    dict(start_raw='2025/11/18 09:00:00', service_cd='', text='?'),
+    dict(start_raw='not a date', service_cd='boat-1', icon_class='fa fa-check'),
+]
+
+
+def compact(inputs, nf=False) -> dict:
+    """Python rendering of the in-page compact(): parallel columns plus dictionaries."""
+    cols = {'dates': [], 'cds': [], 'd': [], 't': [], 's': [], 'c': [], 'r': {}, 'nf': 1 if nf else 0}
+    for kw in inputs:
+        slot = make_slot(**kw)
+        date, tm, raw = slot['date'], slot['time'], slot['attrs']['start_raw']
+        if date is not None and date not in cols['dates']:
+            cols['dates'].append(date)
+        if nf and slot['status'] == 'full':
+            continue
+        cd = slot['attrs']['service_cd']
+        if cd not in cols['cds']:
+            cols['cds'].append(cd)
+        if date is None or raw != f"{date.replace('-', '/')} {tm}:00":
+            cols['r'][str(len(cols['d']))] = raw
+        cols['d'].append(-1 if date is None else cols['dates'].index(date))
+        cols['t'].append(tm)
+        cols['s'].append(STATUS_CODES.index(slot['status']))
+        cols['c'].append(cols['cds'].index(cd))
+    return cols
+
+
+def check_columns(nf: bool):
+    expected = [make_slot(**kw) for kw in COLUMN_INPUTS]
+    if nf:
+        expected = [x for x in expected if x['status'] != 'full']
+    # the JSON round trip turns `r` keys into strings, as the page payload does
+    records = slots_from_columns(json.loads(json.dumps(compact(COLUMN_INPUTS, nf))))
+    assert records.not_full_only == nf and len(records) == len(expected), (records, expected)
+    assert records.dates == {'2025-11-16', '2025-11-17', '2025-11-18'}, records.dates
+    for rec, slot in zip(records, expected):
+        for key in ('date', 'time', 'status'):
+            assert rec[key] == rec.get(key) == slot[key], (key, rec, slot)
+        for attr in ('service_cd', 'start_raw'):
+            assert rec.get('attrs')[attr] == slot['attrs'][attr], (attr, rec, slot)
+        d = rec.to_dict()
+        assert (d['date'], d['time'], d['status']) == (slot['date'], slot['time'], slot['status'])
+        assert d['attrs']['start_raw'] == slot['attrs']['start_raw'] and rec['raw_text'] == ''
+
+
+class FakeRequest:
+    def __init__(self, resource_type):
+        self.resource_type = resource_type
+
+
+class FakeResponse:
+    def __init__(self, resource_type, url, ctype, body):
+        self.request = FakeRequest(resource_type)
+        self.url = url
+        self.headers = {'content-type': ctype}
+        self._body = body
+
+    async def text(self):
+        return self._body
+
+
+class FakePage:
+    def __init__(self):
+        self.handlers = {}
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+
+async def main():
+    html_slots = slots_from_html(HTML)
+    assert summary(html_slots) == [
+        ('2025-11-16', '09:00', 'boat-1', 'available'),
+        ('2025-11-16', '10:00', 'boat-1', 'full'),
+        ('2025-11-17', '09:00', 'boat-2', 'full'),
+        ('2025-11-17', '11:00', 'boat-2', 'not_started'),
+    ], summary(html_slots)
+    first = next(s for s in html_slots if s['time'] == '09:00' and s['date'] == '2025-11-16')
+    assert first['attrs']['end_raw'] == '2025/11/16 10:00:00' and first['attrs']['multi_edit_key'] == 'k1'
+    print('html OK')
+
+    json_slots = slots_from_json(DOC)
+    assert summary(json_slots) == sorted(summary(html_slots) + [
+        ('2025-11-18', '09:00', 'boat-1', 'available'),
+        ('2025-11-18', '10:00', 'boat-1', 'full'),
+        ('2025-11-18', '11:00', 'boat-1', 'other'),
+    ]), summary(json_slots)
+    print('json OK')
+
+    body = json.dumps(DOC)
+    assert summary(slots_from_body(body, 'application/json')) == summary(json_slots)
+    assert summary(slots_from_body(body)) == summary(json_slots), 'JSON detected without content type'
+    assert summary(slots_from_body(HTML, 'text/html')) == summary(html_slots)
+    # a body that matches neither shape (or is broken JSON) gives no slots
+    assert slots_from_body('<html><body><p>maintenance</p></body></html>', 'text/html') == []
+    assert slots_from_body('{"result": "ok", "data": []}', 'application/json') == []
+    assert slots_from_body('{"broken": ', 'application/json') == []
+    assert slots_from_json({'units': [{'service_cd': 'boat-1', 'ordable': 1}]}) == []
+    print('body / non-matching OK')
+
+    # only XHR/fetch responses of the calendar host with JSON/HTML bodies are read
+    page = FakePage()
+    capture = ResponseCapture(page)
+    on_response = page.handlers['response']
+    url = 'https://eipro.jp/takachiho1/eventCalendars/index'
+    on_response(FakeResponse('document', url, 'text/html', HTML))
+    on_response(FakeResponse('xhr', 'https://cdn.example.com/units', 'application/json', body))
+    on_response(FakeResponse('xhr', url, 'text/css', HTML))
+    await capture.settle()
+    assert capture.slots == [] and capture.responses == 0
+    on_response(FakeResponse('xhr', url, 'text/html; charset=utf-8', HTML))
+    on_response(FakeResponse('fetch', url + '.json', 'application/json', body))
+    await capture.settle()
+    assert capture.responses == 2 and len(capture.slots) == len(html_slots) + len(json_slots)
+    capture.reset()
+    assert capture.slots == [] and capture.responses == 0
+    print('response capture OK')
+
+    statuses = [make_slot(**kw)['status'] for kw in COLUMN_INPUTS]
+    assert set(statuses) == set(STATUS_CODES), statuses
+    check_columns(nf=False)
+    check_columns(nf=True)
+    assert slots_from_columns({}) == [] and slots_from_columns(None).dates == set()
+    print('OK')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Test: digest windows, urgent first alerts and per-recipient rate caps.
+
+Runs the outbox against a stubbed SendGrid (httpx.MockTransport) with a
+1 s digest window and a cap of one email per second per recipient (burst
+1). A burst of changes for one recipient must arrive as one digest; for an
+urgent (high-priority) recipient the first change is sent at once and the
+rest of the burst follows as a digest; a crash-repeated change is not sent
+twice; a digest over the cap waits for a token and keeps collecting.
+
+Run from the project root: PYTHONPATH=. python scripts/test_digest.py
+"""
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+os.environ.update(DIGEST_WINDOW='1', NOTIFY_RATE_PER_HOUR='3600', NOTIFY_BURST='1', SENDGRID_API_KEY='x',
+                  OUTBOX_DB=os.path.join(tempfile.mkdtemp(), 'outbox.db'))
+for name in ('MAILGUN_API_KEY', 'SMTP_HOST', 'SMTP_PORT'):
+    os.environ.pop(name, None)
+
+import httpx
+
+import notifier
+
+notifier.append_history = lambda entry, path=None: None
+sent = []   # (seconds since start, recipient, number of lines)
+T0 = time.monotonic()
+
+
+async def handler(req: httpx.Request):
+    payload = json.loads(req.content)
+    to = payload['personalizations'][0]['to'][0]['email']
+    n = payload['content'][0]['value'].count('slot')
+    sent.append((round(time.monotonic() - T0, 1), to, n))
+    return httpx.Response(202)
+
+
+async def main():
+    ob = notifier.NotificationOutbox(workers=2)
+    await ob.start()
+    await ob.client.aclose()
+    ob.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    for i in range(5):
+        ob.add_digest('normal@example.com', 'changes ({n})', [f'slot {i}'], [f'n{i}'])
+        ob.add_digest('urgent@example.com', 'changes ({n})', [f'slot {i}'], [f'u{i}'], urgent=True)
+        await asyncio.sleep(0.1)
+    # a poll repeated after a crash re-reports a change already queued
+    assert not ob.add_digest('normal@example.com', 'changes ({n})', ['slot 0'], ['n0'])
+    await asyncio.sleep(2.5)
+    print('sent:', sent, ob.status()['stats'])
+    normal = [s for s in sent if s[1] == 'normal@example.com']
+    urgent = [s for s in sent if s[1] == 'urgent@example.com']
+    assert [s[2] for s in normal] == [5], normal
+    assert [s[2] for s in urgent] == [1, 4] and urgent[0][0] < 0.2, urgent
+    assert urgent[1][0] - urgent[0][0] >= 0.9, 'rate cap not applied'
+
+    # cap of one per 2 s: the digest due after 1 s is deferred until a token is free and keeps collecting
+    sent.clear()
+    ob.rate_per_hour = 1800
+    await asyncio.sleep(1.0)   # bucket refilled to one token
+    ob.add_digest('urgent@example.com', 'changes ({n})', ['slot 9'], ['u9'], urgent=True)
+    await asyncio.sleep(0.05)
+    ob.add_digest('urgent@example.com', 'changes ({n})', ['slot 10'], ['u10'], urgent=True)
+    await asyncio.sleep(1.5)
+    ob.add_digest('urgent@example.com', 'changes ({n})', ['slot 11'], ['u11'], urgent=True)
+    await asyncio.sleep(1.5)
+    print('after cap:', sent, ob.status()['stats']['deferred'])
+    assert [s[2] for s in sent] == [1, 2] and sent[1][0] - sent[0][0] >= 1.9, sent
+    assert ob.stats['deferred'] >= 1
+    await ob.stop()
+    print('OK')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
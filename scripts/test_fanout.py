@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Test: email fan-out to many recipients (SendGrid, Mailgun, SMTP sink).
+
+Provider APIs are stubbed with httpx.MockTransport; SMTP goes to the local
+sink (scripts/smtp_sink.py). Checks that every recipient gets exactly one
+individual message, that batches respect the provider sizes, that a batch
+which raises falls through to the next provider, and that rejected
+recipients are reported for retry.
+
+Run from the project root: PYTHONPATH=. python scripts/test_fanout.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from urllib.parse import parse_qs
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import notifier
+import provider_health
+from smtp_sink import start_sink
+
+N = 5000
+RECIPIENTS = [f'user{i}@example.com' for i in range(N)]
+
+for name in ('SENDGRID_API_KEY', 'MAILGUN_API_KEY', 'MAILGUN_DOMAIN', 'SMTP_HOST', 'SMTP_PORT', 'SMTP_USER', 'SMTP_PASS'):
+    os.environ.pop(name, None)
+# history/log lines of this test are not kept
+notifier.append_history = lambda entry, path=None: None
+notifier._log = lambda text: None
+
+sendgrid_to, mailgun_to = [], []
+state = {'raise_first': False, 'reject': None}
+
+
+async def handler(req: httpx.Request):
+    await asyncio.sleep(0.02)
+    if req.url.host == 'api.sendgrid.com':
+        payload = json.loads(req.content)
+        tos = [p['to'] for p in payload['personalizations']]
+        assert all(len(t) == 1 for t in tos), 'personalization with several recipients'
+        if state['raise_first']:
+            state['raise_first'] = False
+            raise httpx.ConnectError('boom')
+        if state['reject'] and any(t[0]['email'] == state['reject'] for t in tos):
+            return httpx.Response(400, text='rejected')
+        sendgrid_to.extend(t[0]['email'] for t in tos)
+        return httpx.Response(202)
+    form = parse_qs(req.content.decode())
+    assert set(json.loads(form['recipient-variables'][0])) == set(form['to'])
+    mailgun_to.extend(form['to'])
+    return httpx.Response(200)
+
+
+async def main():
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    os.environ['SENDGRID_API_KEY'] = 'x'
+    os.environ['SENDGRID_BATCH_SIZE'] = '1000'
+    t0 = time.monotonic()
+    assert await notifier.deliver_email(client, 's', 'b', RECIPIENTS + RECIPIENTS[:10]) == 'success'
+    print(f'sendgrid: {N} recipients in {time.monotonic() - t0:.2f}s')
+    assert sorted(sendgrid_to) == sorted(RECIPIENTS)
+
+    # first batch raises -> goes through Mailgun; a rejected batch is reported
+    sendgrid_to.clear()
+    os.environ['MAILGUN_API_KEY'] = 'y'
+    os.environ['MAILGUN_DOMAIN'] = 'mg.example.com'
+    os.environ['SENDGRID_BATCH_SIZE'] = '500'
+    state.update(raise_first=True, reject=RECIPIENTS[-1])
+    provider_health._health.clear()   # no latency samples: configured order (SendGrid first)
+    failed = []
+    assert await notifier.deliver_email(client, 's', 'b', RECIPIENTS, failed_recipients=failed) == 'failed'
+    assert len(mailgun_to) == 500 and len(failed) == 500 and RECIPIENTS[-1] in failed
+    assert len(sendgrid_to) + len(mailgun_to) + len(failed) == N
+    print('fallthrough and rejected batches OK')
+
+    # SMTP: one message per recipient over pooled sessions
+    for name in ('SENDGRID_API_KEY', 'MAILGUN_API_KEY', 'MAILGUN_DOMAIN'):
+        os.environ.pop(name)
+    sink = start_sink(connect_ms=50)
+    os.environ['SMTP_HOST'] = '127.0.0.1'
+    os.environ['SMTP_PORT'] = str(sink.server_address[1])
+    t0 = time.monotonic()
+    assert await notifier.deliver_email(client, 's', 'b', RECIPIENTS[:1000]) == 'success'
+    print(f'smtp: 1000 recipients in {time.monotonic() - t0:.2f}s over {sink.sessions} sessions')
+    assert sink.messages == 1000
+    await client.aclose()
+    print('OK')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Test: HTTP engine against a local stub calendar server, plus Playwright fallback.
+
+Starts a small http.server that serves an index page with a week <select> and
+returns service_unit markup for the selected week. Checks that
+`HttpCalendarEngine` emits the same slot dicts as the DOM path would, and that
+`EngineWithFallback` switches to the (stubbed) browser fetch when the engine
+fails or diverges, verifies a slot that turns not-full before returning it,
+and skips (and counts) a week whose change the browser could not verify.
+
+Run from the project root: PYTHONPATH=. python scripts/test_http_engine.py
+"""
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import metrics
+from http_engine import EngineError, EngineWithFallback, HttpCalendarEngine
+
+WEEKS = {
+    'w1': ('2025/11/16 ～ 2025/11/22', '2025/11/16'),
+    'w2': ('2025/11/23 ～ 2025/11/29', '2025/11/23'),
+}
+
+INDEX = (
+    '<html><body><select name="week">'
+    + ''.join(f'<option value="{k}">{v[0]}</option>' for k, v in WEEKS.items())
+    + '</select><div id="calendar"></div></body></html>'
+)
+
+
+def week_html(day: str) -> str:
+    return (
+        '<div class="service_unit">'
+        f'<input class="service_unit_service_start_datetime" value="{day} 09:00:00">'
+        f'<input class="service_unit_service_end_datetime" value="{day} 10:00:00">'
+        '<input class="service_unit_service_cd" value="boat-1">'
+        '<i class="fa fa-circle"></i> 〇</div>'
+        '<div class="service_unit">'
+        f'<input class="service_unit_service_start_datetime" value="{day} 10:00:00">'
+        '<input class="service_unit_service_cd" value="boat-1">'
+        '<i class="fa fa-times" style="color: red"></i></div>'
+    )
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = 0
+
+    def do_GET(self):
+        Handler.requests += 1
+        q = parse_qs(urlparse(self.path).query)
+        week = (q.get('week') or [None])[0]
+        body = week_html(WEEKS[week][1]) if week in WEEKS else INDEX
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+async def run_test():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/eventCalendars/index'
+    engine = HttpCalendarEngine(url=url)
+    try:
+        t0 = time.monotonic()
+        fetched = await engine.fetch_weeks(['2025-11-16', '2025-11-23'])
+        print(f'engine fetch took {(time.monotonic() - t0) * 1000:.1f} ms, requests={Handler.requests}')
+        for s, items in fetched:
+            print(s, [(i['date'], i['time'], i['status'], i['attrs']['service_cd']) for i in items])
+            assert [i['status'] for i in items] == ['available', 'full']
+            assert items[0]['attrs']['end_raw'].endswith('10:00:00')
+
+        # second poll reuses the cached week index: one request per week
+        before = Handler.requests
+        await engine.fetch_weeks(['2025-11-16', '2025-11-23'])
+        assert Handler.requests - before == 2, Handler.requests - before
+
+        browser_calls = {'n': 0}
+
+        async def same_as_engine(starts):
+            browser_calls['n'] += 1
+            return await engine.fetch_weeks(starts)
+
+        hybrid = EngineWithFallback(engine, same_as_engine, verify_every=100)
+        await hybrid.fetch_weeks(['2025-11-16'])
+        await hybrid.fetch_weeks(['2025-11-16'])
+        print('matching browser:', hybrid.stats, 'browser calls', browser_calls['n'])
+        assert hybrid.stats['verify_ok'] == 1 and browser_calls['n'] == 1 and hybrid.last_source == 'http'
+
+        async def diverging(starts):
+            return [(s, [dict(i, status='full') for i in items]) for s, items in await engine.fetch_weeks(starts)]
+
+        hybrid = EngineWithFallback(engine, diverging, verify_every=100)
+        res = await hybrid.fetch_weeks(['2025-11-16'])
+        print('diverging browser:', hybrid.stats, hybrid.last_source)
+        assert hybrid.stats['verify_fail'] == 1 and res[0][1][0]['status'] == 'full'
+        await hybrid.fetch_weeks(['2025-11-16'])
+        assert hybrid.last_source.startswith('playwright')
+
+        # a slot turning not-full is verified before it is returned, even between periodic checks
+        flip = {}
+
+        class FlipEngine:
+            async def fetch_weeks(self, starts):
+                return [(s, [dict(i, status=flip.get(i['time'], i['status'])) for i in items])
+                        for s, items in await engine.fetch_weeks(starts)]
+
+        browser_calls['n'] = 0
+        hybrid = EngineWithFallback(FlipEngine(), same_as_engine, verify_every=100)
+        await hybrid.fetch_weeks(['2025-11-16'])
+        await hybrid.fetch_weeks(['2025-11-16'])
+        assert browser_calls['n'] == 1
+        flip['10:00'] = 'available'
+        res = await hybrid.fetch_weeks(['2025-11-16'])
+        print('slot opened:', hybrid.stats, hybrid.last_source)
+        assert browser_calls['n'] == 2 and hybrid.stats['verify_fail'] == 1 and res[0][1][1]['status'] == 'full'
+
+        # a slot opens while the browser cannot verify: that week is skipped (counted), not
+        # returned unverified; the next poll with a working browser verifies and returns it
+        browser = {'down': False}
+
+        async def maybe_down(starts):
+            if browser['down']:
+                return [(s, RuntimeError('browser down')) for s in starts]
+            return await FlipEngine().fetch_weeks(starts)
+
+        flip.clear()
+        before = metrics.engine_verifications.get('error')
+        hybrid = EngineWithFallback(FlipEngine(), maybe_down, verify_every=100)
+        await hybrid.fetch_weeks(['2025-11-16', '2025-11-23'])
+        browser['down'] = True
+        res = await hybrid.fetch_weeks(['2025-11-16', '2025-11-23'])
+        assert hybrid.stats['verify_error'] == 0 and all(isinstance(r, list) for _, r in res), 'no change, no check'
+        flip['10:00'] = 'available'
+        res = await hybrid.fetch_weeks(['2025-11-16', '2025-11-23'])
+        print('unverifiable change:', hybrid.stats, [type(r).__name__ for _, r in res])
+        assert all(isinstance(r, EngineError) for _, r in res), res
+        assert hybrid.stats['verify_error'] == 1 and hybrid.stats['unverified_weeks'] == 2
+        assert metrics.engine_verifications.get('error') == before + 1
+        browser['down'] = False
+        res = await hybrid.fetch_weeks(['2025-11-16', '2025-11-23'])
+        assert hybrid.stats['verify_ok'] == 2 and res[0][1][1]['status'] == 'available', hybrid.stats
+
+        hybrid = EngineWithFallback(engine, same_as_engine)
+        res = await hybrid.fetch_weeks(['2030-01-01'])
+        print('unknown week:', hybrid.stats, hybrid.last_source)
+        assert hybrid.stats['fallbacks'] == 1
+        print('OK')
+    finally:
+        await engine.aclose()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(run_test())
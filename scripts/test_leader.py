@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Test: scraper leader election through two leases on one LEADER_DB.
+
+Runs in a temp directory. Checks that only one lease acquires, that the
+holder keeps it by renewing past the TTL, that the other takes over once
+the lease expires (and at once after release()), and that what the leader
+publish()es is what current() and app._follower_result return to a follower.
+
+Run from the project root: PYTHONPATH=. python scripts/test_leader.py
+"""
+import os
+import tempfile
+import time
+
+os.chdir(tempfile.mkdtemp())
+os.environ.update(LEADER_DB=os.path.join(os.getcwd(), 'leader.db'), LEADER_ELECTION='1', LOG_FLUSH_INTERVAL='0')
+
+import app  # noqa: E402
+from leader import LeaderLease  # noqa: E402
+
+
+def main():
+    a = LeaderLease(ttl=0.3, role='poller')
+    b = LeaderLease(ttl=0.3, role='cron')
+    assert a.acquire() and not b.acquire(), 'both leases acquired'
+    assert a.current()['is_me'] and not b.current()['is_me']
+
+    # the holder renews: it stays leader well past one TTL
+    for _ in range(4):
+        time.sleep(0.15)
+        assert a.acquire() and not b.acquire(), 'lease lost while renewed'
+    print('single holder and renewal OK')
+
+    # the holder stops renewing: the other takes over after the TTL
+    time.sleep(0.35)
+    assert b.acquire() and not a.acquire(), 'expired lease not taken over'
+    assert b.current()['leader'] == b.holder and not a.is_leader
+    print('takeover after TTL OK')
+
+    # only the leader publishes; followers read its snapshot
+    snapshot = {'new_count': 2, 'notified': ['2030-01-05 09:00'], 'weeks': ['2030-01-05']}
+    a.publish({'new_count': 99})
+    b.publish(snapshot)
+    cur = a.current()
+    assert cur['snapshot'] == snapshot and cur['leader'] == b.holder and cur['published_at'] <= time.time()
+    app._leader_lease = a
+    res = app._follower_result(['x@example.com'])
+    assert res['follower'] and res['recipients'] == ['x@example.com'] and res['new_count'] == 0
+    assert res['snapshot'] == snapshot and res['leader'] == b.holder and res['published_at'] == cur['published_at']
+    print('publish / follower result OK')
+
+    # release hands the lease back without waiting for the TTL
+    b.release()
+    assert a.acquire() and not b.acquire()
+    a.release()
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
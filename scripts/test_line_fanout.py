@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Test: concurrent LINE Notify fan-out against a stubbed API.
+
+Every request takes 200 ms. Checks that fan-out time stays flat as the
+token count grows (up to LINE_CONCURRENCY), that a short 429 Retry-After
+is waited out and the token retried, that a long one fails the token
+(reported for retry), that a token answered with 401 is skipped on the
+next send, and that a send with only invalid tokens reports 'invalid'.
+
+Run from the project root: PYTHONPATH=. python scripts/test_line_fanout.py
+"""
+import asyncio
+import time
+
+import httpx
+
+import notifier
+
+# history/log lines of this test are not kept
+notifier.append_history_many = lambda entries, path=None: None
+notifier._log = lambda text: None
+
+calls = {}
+
+
+async def handler(req: httpx.Request):
+    token = req.headers['Authorization'].split()[-1]
+    calls[token] = calls.get(token, 0) + 1
+    await asyncio.sleep(0.2)
+    if token.startswith('invalid'):
+        return httpx.Response(401, text='invalid token')
+    if token == 'limited' and calls[token] == 1:
+        return httpx.Response(429, headers={'Retry-After': '1'})
+    if token == 'limited-long':
+        return httpx.Response(429, headers={'Retry-After': '120'})
+    return httpx.Response(200)
+
+
+async def main():
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    for n in (8, 32, 128):
+        tokens = [f'tok{n}-{i}' for i in range(n)]
+        t0 = time.monotonic()
+        assert await notifier.deliver_line(client, 'm', tokens) == 'success'
+        print(f'{n} tokens: {time.monotonic() - t0:.2f}s')
+
+    failed = []
+    t0 = time.monotonic()
+    res = await notifier.deliver_line(client, 'm', ['ok', 'limited', 'limited-long', 'invalid'], failed_tokens=failed)
+    print('mixed:', res, failed, f'{time.monotonic() - t0:.2f}s', notifier.line_status())
+    assert res == 'success' and failed == ['limited-long']
+    assert calls['limited'] == 2 and calls['limited-long'] == 1
+
+    await notifier.deliver_line(client, 'm', ['ok', 'invalid', 'limited-long'])
+    assert calls['invalid'] == 1, 'invalid token was sent again'
+    assert calls['limited-long'] == 1, 'token was sent during its backoff'
+
+    # only invalid tokens: 'invalid' (not a dry-run), whether known or just answered 401
+    assert await notifier.deliver_line(client, 'm', ['invalid2']) == 'invalid' and calls['invalid2'] == 1
+    assert await notifier.deliver_line(client, 'm', ['invalid', 'invalid2']) == 'invalid'
+    assert calls['invalid'] == 1 and calls['invalid2'] == 1
+    assert await notifier.deliver_line(client, 'm', []) == 'dry-run'
+    await client.aclose()
+    print('OK')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
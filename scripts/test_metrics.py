@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Test: Prometheus metrics from a poll, a fallback and a delivery.
+
+Runs in a temp directory (state, leases and logs are not kept). Drives
+app.notify_once_with_fetcher with a stubbed fetcher (one week parsed, one
+unchanged, one missing), EngineWithFallback with a failing engine, and a
+dry-run email (sent directly, then queued and sent by the worker-less
+outbox as on the cron path), then checks the histograms, counters and
+poll-age gauge in both GET /metrics and the poller's metrics port.
+
+Run from the project root: PYTHONPATH=. python scripts/test_metrics.py
+"""
+import asyncio
+import os
+import re
+import socket
+import tempfile
+
+import httpx
+
+os.chdir(tempfile.mkdtemp())
+for name in ('SENDGRID_API_KEY', 'MAILGUN_API_KEY', 'SMTP_HOST'):
+    os.environ.pop(name, None)
+os.environ['LOG_FLUSH_INTERVAL'] = '0'
+
+import app          # noqa: E402
+import metrics      # noqa: E402
+import notifier     # noqa: E402
+from http_engine import EngineWithFallback  # noqa: E402
+
+SLOT = app.make_slot(start_raw='2025/11/16 09:00:00', end_raw='2025/11/16 10:00:00', service_cd='boat-1',
+                     multi=None, icon_class='fa fa-circle', icon_color='', bg='', text='〇')
+
+
+async def fetch_weeks(starts):
+    app._record_stage('evaluate', 12.0)
+    return [(starts[0], [SLOT]), (starts[1], app.WEEK_UNCHANGED), (starts[2], app.WeekNotFound('gone'))]
+
+
+class BrokenEngine:
+    async def fetch_weeks(self, starts):
+        raise RuntimeError('engine down')
+
+
+def value(text: str, sample: str) -> float:
+    m = re.search(r'^' + re.escape(sample) + r' (\S+)$', text, re.M)
+    assert m, f'missing sample {sample}'
+    return float(m.group(1))
+
+
+async def main():
+    assert not re.search(r'^\S+_age_seconds ', metrics.render(), re.M), 'poll age before any poll'
+    res = await app.notify_once_with_fetcher(fetch_weeks, ['2025-11-16', '2025-11-23', '2030-01-01'])
+    assert res['skipped_weeks'] == 1 and res['missing_weeks'] == ['2030-01-01']
+
+    async def browser_fetch(starts):
+        return [(s, []) for s in starts]
+    await EngineWithFallback(BrokenEngine(), browser_fetch).fetch_weeks(['2025-11-16'])
+
+    client = httpx.AsyncClient()
+    assert await notifier.deliver_email(client, 's', 'b', ['a@example.com']) == 'dry-run'
+    await client.aclose()
+    # one-shot path (no outbox workers): the queued email is sent and timed by run_due
+    assert not app.outbox().running and app.notify_email('s', 'b', ['b@example.com'], key='metrics-1')
+    await app._deliver_queued()
+
+    async with httpx.AsyncClient(app=app.app, base_url='http://app') as c:
+        resp = await c.get('/metrics')
+    text = resp.text
+    assert resp.headers['content-type'].startswith('text/plain; version=0.0.4')
+    p = metrics.PREFIX
+    for stage in ('evaluate', 'diff', 'persist', 'send'):
+        assert value(text, f'{p}poll_stage_seconds_count{{stage="{stage}"}}') >= 1, stage
+    assert value(text, f'{p}poll_stage_seconds_bucket{{stage="evaluate",le="0.025"}}') == 1
+    assert value(text, f'{p}poll_stage_seconds_bucket{{stage="evaluate",le="+Inf"}}') == 1
+    assert value(text, f'{p}skipped_weeks_total{{reason="unchanged"}}') == 1
+    assert value(text, f'{p}skipped_weeks_total{{reason="missing"}}') == 1
+    assert value(text, f'{p}fallbacks_total{{kind="http_engine"}}') == 1
+    assert value(text, f'{p}deliveries_total{{method="dry-run",status="dry-run"}}') == 2
+    assert 0 <= value(text, f'{p}last_poll_success_age_seconds') < 5
+    print('\n'.join(ln for ln in text.splitlines() if not ln.startswith('#') and '_bucket' not in ln))
+
+    # the poller serves the same registry on its own port
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = metrics.serve(port)
+    resp = await asyncio.to_thread(httpx.get, f'http://127.0.0.1:{port}/metrics')
+    assert resp.status_code == 200 and f'{p}fallbacks_total{{kind="http_engine"}} 1' in resp.text
+    server.shutdown()
+    print('OK')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
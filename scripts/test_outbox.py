@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Test: durable outbox contract against a temp OUTBOX_DB.
+
+Delivery is stubbed (no providers). Checks that a duplicate key is a no-op,
+that a failed send is rescheduled with doubling backoff capped at
+OUTBOX_BACKOFF_MAX and goes dead after OUTBOX_MAX_ATTEMPTS (at once when no
+destination is valid), that a claim is only taken over once
+OUTBOX_CLAIM_TTL has passed, that without workers enqueued jobs are sent by
+run_due() and a partly failed email is retried to the failed recipients
+only, and that run_due sends only due jobs.
+
+Run from the project root: PYTHONPATH=. python scripts/test_outbox.py
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.update(OUTBOX_DB=os.path.join(tempfile.mkdtemp(), 'outbox.db'), OUTBOX_BACKOFF_BASE='10',
+                  OUTBOX_BACKOFF_MAX='40', OUTBOX_MAX_ATTEMPTS='5', OUTBOX_CLAIM_TTL='60')
+
+import notifier  # noqa: E402
+
+notifier._log = lambda text: None
+
+sent = []
+outcome = {'value': 'success'}
+
+
+async def deliver(kind, payload, job_id=None):
+    sent.append(payload['n'])
+    return outcome['value']
+
+
+def job(ob, job_id):
+    return ob._db().execute('SELECT state, attempts, next_at FROM jobs WHERE id=?', (job_id,)).fetchone()
+
+
+async def main():
+    ob = notifier.NotificationOutbox()
+    ob._deliver = deliver
+
+    first = ob.add('email', {'n': 1}, key='k1')
+    assert first and ob.add('email', {'n': 1}, key='k1') is None, 'duplicate key stored twice'
+    assert await ob.run_due() == 1 and sent == [1] and job(ob, first)[0] == 'sent'
+    assert ob.add('email', {'n': 1}, key='k1') is None and await ob.run_due() == 0, 'sent key queued again'
+    print('duplicate keys OK')
+
+    # failures: backoff doubles up to the cap, then the job is dead
+    outcome['value'] = 'failed'
+    jid = ob.add('email', {'n': 2}, key='k2')
+    delays = []
+    for attempt in range(1, 6):
+        ob._db().execute('UPDATE jobs SET next_at=0 WHERE id=?', (jid,))   # make it due now
+        assert await ob.run_due() == 1
+        state, attempts, next_at = job(ob, jid)
+        assert attempts == attempt
+        if attempt < 5:
+            assert state == 'pending'
+            delays.append(next_at - time.time())
+    assert state == 'dead', state
+    print('backoff:', [round(d, 1) for d in delays], 'then', state)
+    for d, expected in zip(delays, (10, 20, 40, 40)):
+        assert expected * 0.8 - 0.1 <= d <= expected * 1.2 + 0.1, (d, expected)
+    ob._db().execute('UPDATE jobs SET next_at=0 WHERE id=?', (jid,))
+    assert await ob.run_due() == 0, 'dead job sent again'
+    # no valid destination left: dead at once, no retries
+    jid = ob.add('line', {'n': 0}, key='k-invalid')
+    ob._claim(jid)
+    ob.mark(jid, 'invalid')
+    assert job(ob, jid)[:2] == ('dead', 1)
+
+    # claims: a claimed job is not taken while the claim is fresh, only after CLAIM_TTL
+    other = notifier.NotificationOutbox()
+    other._deliver = deliver
+    other.claim_ttl = ob.claim_ttl = 0.3
+    jid = ob.add('email', {'n': 3}, key='k3')
+    assert ob._claim(jid) and not other._claim(jid), 'job claimed twice'
+    time.sleep(0.35)
+    assert other._claim(jid), 'expired claim not taken over'
+    print('claims OK')
+
+    # without workers enqueue only stores; run_due sends through _deliver, which
+    # narrows a partly failed email to the recipients that did not get it
+    outcome['value'] = 'success'
+    real_deliver_email = notifier.deliver_email
+
+    async def deliver_email(client, subject, body, recipients, failed_recipients=None):
+        sent.append(list(recipients))
+        failed_recipients.extend(r for r in recipients if r.startswith('bad'))
+        return 'failed' if failed_recipients else 'success'
+
+    notifier.deliver_email = deliver_email
+    inline = notifier.NotificationOutbox()
+    sent.clear()
+    assert inline.enqueue_email('s', 'b', ['ok@example.com', 'bad@example.com'], key='k4') and sent == []
+    assert await inline.run_due() == 1 and sent == [['ok@example.com', 'bad@example.com']]
+    jid = inline._db().execute("SELECT id FROM jobs WHERE key='k4'").fetchone()[0]
+    inline._db().execute('UPDATE jobs SET next_at=0 WHERE id=?', (jid,))
+    assert await inline.run_due() == 1 and sent[-1] == ['bad@example.com'], sent
+    # store unavailable: the payload is held and still sent once by run_due
+    inline.add = lambda *a, **k: 0
+    assert inline.enqueue_email('s', 'b', ['ok2@example.com'], key='k-held')
+    assert await inline.run_due() == 1 and sent[-1] == ['ok2@example.com']
+    notifier.deliver_email = real_deliver_email
+    print('inline delivery OK')
+
+    # run_due sends due jobs only
+    sent.clear()
+    ob._db().execute("DELETE FROM jobs WHERE state='sending'")
+    ob.add('email', {'n': 5}, key='k5', due=time.time() + 3600)
+    ob.add('email', {'n': 6}, key='k6')
+    assert await ob.run_due() == 1 and sent == [6], sent
+    print('OK')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Test: provider circuit breaker and latency-aware failover in deliver_email.
+
+SendGrid and Mailgun are stubbed with httpx.MockTransport. While SendGrid
+times out, the first alert waits for it and fails over to Mailgun; later
+alerts go straight to Mailgun. With SendGrid alone, repeated timeouts open
+its breaker and alerts fail fast (the outbox retries them); after the
+cooldown one probe closes it again. Finally, with fresh health windows,
+an unmeasured fallback does not take alerts from the measured primary, and
+once both are measured the faster one is picked; with PROVIDER_EXPLORE_EVERY
+the unmeasured one is tried on every Nth delivery. A half-open provider gets
+one batch as its probe, the rest only after it succeeds. Over SMTP (local sink), a
+refused single recipient is a failed recipient, not a provider outage: no
+failover and the breaker stays closed.
+
+Run from the project root: PYTHONPATH=. python scripts/test_provider_failover.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+os.environ.update(SENDGRID_API_KEY='x', MAILGUN_API_KEY='y', MAILGUN_DOMAIN='mg.example.com',
+                  PROVIDER_COOLDOWN='1', PROVIDER_MAX_FAILURES='3', PROVIDER_EXPLORE_EVERY='0')
+for name in ('SMTP_HOST', 'SMTP_PORT'):
+    os.environ.pop(name, None)
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import notifier
+import provider_health
+from smtp_sink import start_sink
+
+# history/log lines of this test are not kept
+notifier.append_history = lambda entry, path=None: None
+notifier._log = lambda text: None
+
+mode = {'sendgrid': 'timeout', 'sendgrid_ms': 0, 'mailgun_ms': 5}
+hits = []
+
+
+async def handler(req: httpx.Request):
+    if req.url.host == 'api.sendgrid.com':
+        hits.append('sendgrid')
+        if mode['sendgrid'] == 'timeout':
+            await asyncio.sleep(0.3)
+            raise httpx.ReadTimeout('timed out', request=req)
+        await asyncio.sleep(mode['sendgrid_ms'] / 1000)
+        return httpx.Response(202)
+    hits.append('mailgun')
+    await asyncio.sleep(mode['mailgun_ms'] / 1000)
+    return httpx.Response(200)
+
+
+async def alert(client):
+    hits.clear()
+    t0 = time.monotonic()
+    assert await notifier.deliver_email(client, 's', 'b', ['a@example.com']) == 'success'
+    return (time.monotonic() - t0) * 1000, list(hits)
+
+
+async def main():
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    sendgrid = provider_health.health('sendgrid')
+
+    for i in range(3):
+        ms, route = await alert(client)
+        print(f'outage alert {i}: {ms:.0f} ms via {route}')
+    assert route == ['mailgun'] and ms < 100
+
+    mailgun = {k: os.environ.pop(k) for k in ('MAILGUN_API_KEY', 'MAILGUN_DOMAIN')}
+    for i in range(3):
+        t0 = time.monotonic()
+        res = await notifier.deliver_email(client, 's', 'b', ['a@example.com'])
+        print(f'sendgrid only {i}: {res} in {(time.monotonic() - t0) * 1000:.0f} ms, breaker {sendgrid.state}')
+    assert sendgrid.state == provider_health.OPEN
+    t0 = time.monotonic()
+    assert await notifier.deliver_email(client, 's', 'b', ['a@example.com']) == 'failed'
+    assert time.monotonic() - t0 < 0.05, 'open breaker did not fail fast'
+
+    # half-open: one batch is the probe; while it fails the other batches are not sent
+    await asyncio.sleep(1.1)
+    os.environ['SENDGRID_BATCH_SIZE'] = '1'
+    hits.clear()
+    res = await notifier.deliver_email(client, 's', 'b', ['a@example.com', 'b@example.com', 'c@example.com'])
+    print(f'failed probe: {res} hits {hits} breaker {sendgrid.state}')
+    assert res == 'failed' and hits == ['sendgrid'] and sendgrid.state == provider_health.OPEN
+    del os.environ['SENDGRID_BATCH_SIZE']
+
+    mode['sendgrid'] = 'ok'
+    await asyncio.sleep(2.1)   # the cooldown doubled after the failed probe
+    ms, route = await alert(client)
+    print(f'after cooldown: {ms:.0f} ms via {route} breaker {sendgrid.state}')
+    assert route == ['sendgrid'] and sendgrid.state == provider_health.CLOSED
+
+    os.environ.update(mailgun)
+    provider_health._health.clear()
+    mode['sendgrid_ms'] = 80
+    routes = [(await alert(client))[1] for _ in range(3)]
+    assert routes == [['sendgrid']] * 3, 'unmeasured fallback ranked ahead of the primary'
+    provider_health.health('mailgun').record(True, 5)   # e.g. from an earlier failover
+    routes = [(await alert(client))[1] for _ in range(2)]
+    print('latency ranking:', routes, notifier.health_status())
+    assert routes == [['mailgun'], ['mailgun']]
+
+    # exploration: every PROVIDER_EXPLORE_EVERY-th delivery tries an unmeasured provider first
+    provider_health._health.clear()
+    provider_health.health('sendgrid').record(True, 80)
+    os.environ['PROVIDER_EXPLORE_EVERY'] = '3'
+    provider_health._rankings = 0
+    routes = [(await alert(client))[1] for _ in range(4)]
+    print('exploration:', routes)
+    assert routes == [['sendgrid'], ['sendgrid'], ['mailgun'], ['mailgun']], routes
+    os.environ['PROVIDER_EXPLORE_EVERY'] = '0'
+
+    # SMTP: a 550 for a one-recipient batch (every digest) must not count as an outage
+    for name in ('SENDGRID_API_KEY', 'MAILGUN_API_KEY', 'MAILGUN_DOMAIN'):
+        os.environ.pop(name)
+    sink = start_sink()
+    os.environ.update(SMTP_HOST='127.0.0.1', SMTP_PORT=str(sink.server_address[1]))
+    smtp = provider_health.health('smtp')
+    for i in range(4):
+        failed = []
+        res = await notifier.deliver_email(client, 's', 'b', [f'bounce{i}@example.com'], failed_recipients=failed)
+        assert res == 'failed' and failed == [f'bounce{i}@example.com'], (res, failed)
+    assert smtp.state == provider_health.CLOSED and smtp.consecutive_failures == 0
+    failed = []
+    res = await notifier.deliver_email(client, 's', 'b', ['bounce@example.com', 'ok@example.com'], failed_recipients=failed)
+    assert res == 'failed' and failed == ['bounce@example.com'] and sink.messages == 1
+    print('smtp recipient refusals: breaker', smtp.state)
+    await client.aclose()
+    print('OK')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 """Test: ensure slot transitions full->available produce a notification.
 
-This script monkeypatches `app.fetch_parsed_impl` and `app.send_email` to
-simulate the site and capture whether notify is triggered. It runs two
+This script monkeypatches `app.fetch_parsed_impl` (and the single-browser
+week fetcher used without the pool, to go through it) and
+`notifier.deliver_email` (the outbox delivers through it) to simulate the
+site and capture whether notify is triggered. It runs two
 iterations: first the slot is 'full' (no notify), then 'available' (notify).
 """
 import asyncio
@@ -11,6 +13,7 @@ import os
 from datetime import datetime, timedelta
 
 import app
+import notifier
 
 
 TEST_KEY = [
@@ -45,27 +48,27 @@ async def run_test():
     async def fetch_available(start_date=None):
         return [make_item('available')]
 
-    # Capture send_email calls
+    # Capture email deliveries
     sent = {'calls': []}
 
-    def fake_send_email(subject, body, recipients):
-        print(f"fake_send_email called: subject={subject} recipients={recipients}")
+    async def fake_deliver_email(client, subject, body, recipients, failed_recipients=None):
+        print(f"fake_deliver_email called: subject={subject} recipients={recipients}")
         sent['calls'].append({'subject': subject, 'body': body, 'recipients': recipients})
-        return True
+        return 'success'
 
     # Backup real functions
     real_fetch = app.fetch_parsed_impl
-    real_send = app.send_email
+    real_send = notifier.deliver_email
+    real_weeks = app._fetch_weeks_one_browser
 
-    try:
-        # Ensure a clean notified.json backup
-        if os.path.exists(app.NOTIFIED_PATH):
-            with open(app.NOTIFIED_PATH + '.bak', 'w', encoding='utf-8') as f:
-                f.write(open(app.NOTIFIED_PATH, 'r', encoding='utf-8').read())
+    async def fetch_weeks(starts):
+        return [(s, await app.fetch_parsed_impl(s)) for s in starts]
 
+    try:
         # 1) First run: slot is full -> no notification expected
         app.fetch_parsed_impl = fetch_full
-        app.send_email = fake_send_email
+        app._fetch_weeks_one_browser = fetch_weeks
+        notifier.deliver_email = fake_deliver_email
         print('Running first check (slot=full) ...')
         res1 = await app.notify_once_for_starts(starts)
         print('Result1:', res1)
@@ -78,10 +81,8 @@ async def run_test():
 
         print('\nSent calls:', sent['calls'])
 
-        # Show notified.json content
-        if os.path.exists(app.NOTIFIED_PATH):
-            print('\nnotified.json content:')
-            print(open(app.NOTIFIED_PATH, 'r', encoding='utf-8').read())
+        # Show the stored state of the test slot
+        print('\nstored state:', app._load_notified().get(app._key_to_str(TEST_KEY)))
 
         # Show notifications.jsonl tail
         if os.path.exists('notifications.jsonl'):
@@ -94,7 +95,8 @@ async def run_test():
     finally:
         # restore
         app.fetch_parsed_impl = real_fetch
-        app.send_email = real_send
+        notifier.deliver_email = real_send
+        app._fetch_weeks_one_browser = real_weeks
 
 
 if __name__ == '__main__':
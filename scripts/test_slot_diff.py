@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Test: DiffEngine events, notification keys and snapshot reloads (slot_diff.py).
+
+Uses a SlotStore in a temp directory. Checks each event kind (appeared,
+became_full, became_available, status_changed, disappeared), that the
+not-full-only payload turns missing known slots into became_full, that
+`seq` and notification_key() are stable when a transition is re-detected
+before commit and change for a later transition of the same slot, and that
+the snapshot is reloaded when another connection writes to the store.
+
+Run from the project root: PYTHONPATH=. python scripts/test_slot_diff.py
+"""
+import json
+import os
+import tempfile
+
+from slot_diff import (APPEARED, BECAME_AVAILABLE, BECAME_FULL, DISAPPEARED, STATUS_CHANGED, DiffEngine,
+                       notification_key, slot_key)
+from slot_store import SlotStore
+
+DAY = '2030-01-05'
+
+
+def slot(t, status, cd='boat-1'):
+    return {'date': DAY, 'time': t, 'status': status,
+            'attrs': {'service_cd': cd, 'start_raw': f'2030/01/05 {t}:00'}}
+
+
+def kinds(events):
+    return sorted(((ev.kind, ev.key[1], ev.notify) for ev in events), key=lambda k: k[1])
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), 'notified.db')
+    store = SlotStore(path)
+    engine = DiffEngine(store)
+
+    events = engine.diff([slot('09:00', 'available'), slot('10:00', 'full')], {DAY})
+    assert kinds(events) == [(APPEARED, '09:00', True), (APPEARED, '10:00', False)]
+    engine.commit(events)
+    assert engine.diff([slot('09:00', 'available'), slot('10:00', 'full')], {DAY}) == []
+
+    items = [slot('09:00', 'full'), slot('10:00', 'available')]
+    events = engine.diff(items, {DAY})
+    assert kinds(events) == [(BECAME_FULL, '09:00', False), (BECAME_AVAILABLE, '10:00', True)]
+    # re-detected before commit (crash between enqueue and commit): same seq, same key
+    again = engine.diff(items, {DAY})
+    notified = [ev for ev in events if ev.notify]
+    assert [ev.seq for ev in events] == [ev.seq for ev in again]
+    assert notification_key(notified) == notification_key([ev for ev in again if ev.notify])
+    first_key = notification_key(notified)
+    engine.commit(events)
+
+    events = engine.diff([slot('09:00', 'full'), slot('10:00', 'not_started')], {DAY})
+    assert kinds(events) == [(STATUS_CHANGED, '10:00', True)]
+    engine.commit(events)
+    # the same transition (full -> available) later is a new notification
+    engine.commit(engine.diff([slot('09:00', 'full'), slot('10:00', 'full')], {DAY}))
+    events = engine.diff([slot('09:00', 'full'), slot('10:00', 'available')], {DAY})
+    assert kinds(events) == [(BECAME_AVAILABLE, '10:00', True)]
+    assert notification_key(events) != first_key
+    engine.commit(events)
+    print('event kinds and keys OK')
+
+    # a known slot missing from a scraped date disappears; not on other dates
+    events = engine.diff([slot('09:00', 'full')], {DAY})
+    assert kinds(events) == [(DISAPPEARED, '10:00', False)]
+    assert engine.diff([slot('09:00', 'full')], {'2030-01-06'}) == []
+    # the not-full-only payload leaves full slots out: missing known slots became full
+    events = engine.diff([], {DAY}, not_full_only=True)
+    assert kinds(events) == [(BECAME_FULL, '10:00', False)]
+    print('disappeared / not-full-only OK')
+
+    # another process writes: the snapshot is reloaded
+    reloads = engine.stats['reloads']
+    other = SlotStore(path)
+    other.apply({json.dumps(list(slot_key(slot('09:00', ''))), ensure_ascii=False): 'available'})
+    events = engine.diff([slot('09:00', 'available'), slot('10:00', 'available')], {DAY})
+    assert engine.stats['reloads'] == reloads + 1
+    assert events == [], events
+    assert engine.diff([slot('09:00', 'available'), slot('10:00', 'available')], {DAY}) == []
+    assert engine.stats['reloads'] == reloads + 1, 'reloaded without a write'
+    other.close()
+    store.close()
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Test: SlotStore key repair, one-time notified.json import and pruning (slot_store.py).
+
+Runs against a temp NOTIFIED_DB. Checks that repair_key() accepts a valid
+key and keys split into characters once or twice (and rejects anything
+else), that the legacy JSON (dict and old list format) is imported on the
+first open only, and that prune() honours NOTIFIED_RETENTION_DAYS.
+
+Run from the project root: PYTHONPATH=. python scripts/test_slot_store.py
+"""
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+tmp = tempfile.mkdtemp()
+os.environ.update(NOTIFIED_RETENTION_DAYS='2', NOTIFIED_PRUNE_INTERVAL='3600')
+
+from slot_store import SlotStore, load_legacy_json, repair_key  # noqa: E402
+
+
+def key(date, t='09:00', cd='boat-1'):
+    return json.dumps([date, t, cd, f'{date} {t}'], ensure_ascii=False)
+
+
+def split(s):
+    return json.dumps(list(s), ensure_ascii=False)
+
+
+def main():
+    valid = key('2030-01-05')
+    assert repair_key(valid) == valid
+    assert repair_key(split(valid)) == valid, 'split once'
+    assert repair_key(split(split(valid))) == valid, 'split twice'
+    assert repair_key(json.dumps([None, '09:00', 'boat-1', ''])) is not None, 'dateless key'
+    for bad in ('not json', '{"a": 1}', '"2030-01-05"', json.dumps(['2030-01-05', '09:00', 'boat-1']),
+                json.dumps([1, 2, 3, 4]), split('xyz')):
+        assert repair_key(bad) is None, bad
+    print('repair_key OK')
+
+    # dict format: valid, repaired, a repaired duplicate of a valid key (valid wins), garbage
+    legacy = os.path.join(tmp, 'notified.json')
+    other = key('2030-01-06')
+    with open(legacy, 'w', encoding='utf-8') as f:
+        json.dump({valid: 'available', split(other): 'full', split(split(valid)): 'full',
+                   'garbage': 'full', key('2030-01-07'): 3}, f)
+    stats = {}
+    assert load_legacy_json(legacy, stats) == {valid: 'available', other: 'full'}
+    assert stats == {'repaired': 2, 'dropped': 2}, stats
+    # old list format: lists of key parts, status 'notified'
+    old = os.path.join(tmp, 'old.json')
+    with open(old, 'w', encoding='utf-8') as f:
+        json.dump([json.loads(valid), json.loads(other)], f)
+    assert load_legacy_json(old) == {valid: 'notified', other: 'notified'}
+    print('legacy json OK')
+
+    db = os.path.join(tmp, 'notified.db')
+    store = SlotStore(db, legacy_json=legacy)
+    assert store.load() == {valid: 'available', other: 'full'}
+    assert store.stats['migrated'] == 2 and store.stats['repaired'] == 2
+    store.apply({valid: 'full'})
+    store.close()
+    # second open: the (still present) JSON is not imported again over newer state
+    store = SlotStore(db, legacy_json=legacy)
+    assert store.stats['migrated'] == 0 and store.load()[valid] == 'full'
+    print('one-time import OK')
+
+    today = datetime.utcnow().date()
+    days = {n: (today - timedelta(days=n)).strftime('%Y-%m-%d') for n in (0, 2, 3, 10)}
+    # the first write of this store runs the (interval-limited) prune
+    store.apply({key(d): 'available' for d in days.values()})
+    left = {json.loads(k)[0] for k in store.load()}
+    assert days[0] in left and days[2] in left, left
+    assert days[3] not in left and days[10] not in left, left
+    assert store.stats['pruned'] == 2 and store.prune() == 0
+    store.apply({key(days[10], '10:00'): 'full'})
+    assert key(days[10], '10:00') in store.load(), 'pruned again before NOTIFIED_PRUNE_INTERVAL'
+    assert store.prune() == 1
+    store.close()
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Test: keep-alive SMTP pool against the local SMTP sink.
+
+Sends the same messages once with a new session per message (the old
+behaviour) and once through `SmtpPool`, and prints both throughputs and the
+pool's per-message latency. Then lets the sink drop the idle session and
+checks that the next send reconnects transparently.
+
+Run from the project root: PYTHONPATH=. python scripts/test_smtp_pool.py
+"""
+import os
+import smtplib
+import sys
+import time
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from smtp_pool import SmtpPool
+from smtp_sink import start_sink
+
+N = 40
+
+
+def message(i: int) -> EmailMessage:
+    msg = EmailMessage()
+    msg['Subject'] = f'test {i}'
+    msg['From'] = 'noreply@example.com'
+    msg['To'] = 'user@example.com'
+    msg.set_content('body')
+    return msg
+
+
+def main():
+    sink = start_sink(connect_ms=100, reply_ms=1, idle_timeout=1.0)
+    port = sink.server_address[1]
+
+    t0 = time.monotonic()
+    for i in range(N):
+        with smtplib.SMTP('127.0.0.1', port, timeout=10) as s:
+            s.ehlo()
+            s.send_message(message(i))
+    per_session = time.monotonic() - t0
+    print(f'new session per message: {N / per_session:.1f} msg/s ({sink.sessions} sessions)')
+
+    pool = SmtpPool('127.0.0.1', port, size=1)
+    sessions = sink.sessions
+    t0 = time.monotonic()
+    for i in range(N):
+        pool.send(message(i))
+    pooled = time.monotonic() - t0
+    print(f'pooled: {N / pooled:.1f} msg/s ({sink.sessions - sessions} sessions)', pool.status())
+    assert sink.sessions - sessions == 1, 'pool opened more than one session'
+
+    t0 = time.monotonic()
+    results = pool.send_many([message(i) for i in range(N)])
+    assert all(r is None for r in results), results
+    print(f'send_many: {N / (time.monotonic() - t0):.1f} msg/s')
+
+    # the sink closes the session after 1s idle; the next send must reconnect
+    pool.idle_check = 3600  # skip the NOOP probe so the send itself hits the dropped session
+    time.sleep(1.5)
+    pool.send(message(0))
+    print('after idle drop:', pool.stats)
+    assert pool.stats['reconnects'] == 1, pool.stats
+    assert sink.messages == 3 * N + 1, sink.messages
+    pool.close()
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Test: subscription filters, the inverted-index matcher and per-recipient routing.
+
+Compares `SubscriptionIndex.match` with a brute-force scan over random
+filters and slots, times matching against 10,000 subscribers, and checks
+that `app._diff_and_notify` sends each recipient only the slots its filters
+match (recipients without filters get all of them).
+
+Run from the project root: PYTHONPATH=. python scripts/test_subscriptions.py
+"""
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+tmp = tempfile.mkdtemp()
+os.environ['NOTIFIED_DB'] = os.path.join(tmp, 'notified.db')
+os.environ['SUBSCRIPTIONS_PATH'] = os.path.join(tmp, 'subscriptions.json')
+os.environ['LEADER_DB'] = os.path.join(tmp, 'leader.db')
+os.environ['OUTBOX_DB'] = os.path.join(tmp, 'outbox.db')
+
+from subscriptions import SubscriptionIndex, normalize_filter
+
+rnd = random.Random(7)
+START = date(2025, 11, 1)
+SERVICES = ['boat-1', 'boat-2', 'boat-3', 'boat-4']
+STATUSES = ['available', 'not_started', 'other']
+
+
+def random_filter() -> dict:
+    f = {}
+    if rnd.random() < 0.7:
+        lo = START + timedelta(days=rnd.randrange(60))
+        f['date_from'] = lo.isoformat()
+        if rnd.random() < 0.8:
+            f['date_to'] = (lo + timedelta(days=rnd.randrange(30))).isoformat()
+    if rnd.random() < 0.3:
+        f['weekdays'] = rnd.sample(['mon', 'tue', 'wed', 'thu', 'fri', '土', 6], 2)
+    if rnd.random() < 0.4:
+        h = rnd.randrange(8, 16)
+        f['time_from'], f['time_to'] = f'{h:02d}:00', f'{h + 2:02d}:00'
+    if rnd.random() < 0.6:
+        f['service_cd'] = rnd.sample(SERVICES, rnd.randrange(1, 3))
+    if rnd.random() < 0.2:
+        f['status'] = ['available']
+    return normalize_filter(f)
+
+
+def random_slot() -> dict:
+    d = START + timedelta(days=rnd.randrange(90))
+    return {'date': d.isoformat(), 'time': f'{rnd.randrange(8, 18):02d}:{rnd.choice(["00", "30"])}',
+            'status': rnd.choice(STATUSES), 'attrs': {'service_cd': rnd.choice(SERVICES)}}
+
+
+def brute_force(subs: dict, slot: dict) -> set:
+    check = SubscriptionIndex({})._accepts
+    cd = slot['attrs']['service_cd']
+    return {e for e, fs in subs.items()
+            if any(check(f, slot['date'], slot) and (not f.get('service_cd') or cd in f['service_cd']) for f in fs)}
+
+
+def main():
+    subs = {f'user{i}@example.com': [random_filter() for _ in range(rnd.randrange(1, 3))] for i in range(500)}
+    index = SubscriptionIndex(subs)
+    slots = [random_slot() for _ in range(500)]
+    for slot in slots:
+        assert index.match(slot) == brute_force(subs, slot), slot
+    print('index matches brute force on 500 slots x 500 subscribers')
+
+    big = {f'user{i}@example.com': [random_filter()] for i in range(10000)}
+    t0 = time.monotonic()
+    index = SubscriptionIndex(big)
+    build = time.monotonic() - t0
+    t0 = time.monotonic()
+    matched = sum(len(index.match(s)) for s in slots)
+    per_slot = (time.monotonic() - t0) / len(slots) * 1000
+    print(f'10000 subscribers: build {build:.2f}s, {per_slot:.3f} ms/slot, {matched} matches')
+
+    import app
+    sent = []
+    app.notify_email = lambda subject, body, recipients, key=None: sent.append((sorted(recipients), body))
+    app.leadership().enabled = False
+    app.subscriptions().set('weekend@example.com', [{'weekdays': ['sat', 'sun'], 'service_cd': ['boat-1']}])
+    app.subscriptions().set('morning@example.com', [{'time_to': '11:59'}])
+    items = [
+        {'date': '2025-11-01', 'time': '09:00', 'status': 'available', 'attrs': {'service_cd': 'boat-1', 'start_raw': 'a'}},
+        {'date': '2025-11-01', 'time': '14:00', 'status': 'available', 'attrs': {'service_cd': 'boat-2', 'start_raw': 'b'}},
+        {'date': '2025-11-03', 'time': '10:00', 'status': 'available', 'attrs': {'service_cd': 'boat-1', 'start_raw': 'c'}},
+    ]
+    recipients = ['all@example.com', 'weekend@example.com', 'morning@example.com', 'nobody@example.com']
+    app.subscriptions().set('nobody@example.com', [{'service_cd': ['boat-9']}])
+    app._diff_and_notify(items, recipients)
+    routed = {tuple(r): body.count('status=') for r, body in sent}
+    print('routed:', routed)
+    assert routed == {('all@example.com',): 3, ('weekend@example.com',): 1, ('morning@example.com',): 2}
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Test: slot transitions and GET /api/slots/{date}/timeline.
+
+Runs in a temp directory (NOTIFIED_DB is not kept). Transitions are written
+with fixed times, then the endpoint is checked for open-period boundaries
+(opened on -> available, closed on any other status, so a slot that first
+appears not_started is not open), a still-open last period, the truncated
+flag of a range over `limit`, an empty answer for a date without
+transitions and a 400 for a malformed one. Finally prune() drops
+transitions older than TRANSITION_RETENTION_DAYS.
+
+Run from the project root: PYTHONPATH=. python scripts/test_timeline.py
+"""
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+os.chdir(tempfile.mkdtemp())
+os.environ.update(TRANSITION_RETENTION_DAYS='30', LOG_FLUSH_INTERVAL='0')
+
+import app  # noqa: E402
+
+DAY = '2030-01-05'
+
+
+def iso(ts):
+    return datetime.utcfromtimestamp(ts).isoformat()
+
+
+async def main():
+    store = app._state_store()
+    t0 = int(time.time()) - 3600
+    rows = [
+        # 09:00: open from t0 to t0+300 (not_started is not bookable), again from t0+1800 (still open)
+        (t0, '09:00', None, 'available'),
+        (t0 + 300, '09:00', 'available', 'not_started'),
+        (t0 + 600, '09:00', 'not_started', 'full'),
+        (t0 + 1800, '09:00', 'full', 'available'),
+        # 10:00: appeared full, open for 120 s
+        (t0, '10:00', None, 'full'),
+        (t0 + 900, '10:00', 'full', 'available'),
+        (t0 + 1020, '10:00', 'available', 'full'),
+        # 11:30: appeared not bookable, open from t0+600
+        (t0, '11:30', None, 'not_started'),
+        (t0 + 600, '11:30', 'not_started', 'available'),
+    ]
+    with store._conn:
+        store._conn.executemany('INSERT INTO transitions(ts, date, time, service_cd, old, new) VALUES(?,?,?,?,?,?)',
+                                [(ts, DAY, t, 'boat-1', old, new) for ts, t, old, new in rows])
+        store._conn.execute('INSERT INTO transitions(ts, date, time, service_cd, old, new) VALUES(?,?,?,?,?,?)',
+                            (t0 - 40 * 86400, DAY, '11:00', 'boat-1', None, 'available'))
+
+    async with httpx.AsyncClient(app=app.app, base_url='http://app') as c:
+        body = (await c.get(f'/api/slots/{DAY}/timeline')).json()
+        assert body['ok'] and len(body['events']) == 10 and not body['truncated']
+        slots = {s['time']: s for s in body['slots']}
+        assert slots['09:00']['status'] == 'available'
+        first, last = slots['09:00']['open_periods']
+        assert first == {'from': iso(t0), 'to': iso(t0 + 300), 'seconds': 300}, first
+        assert last['from'] == iso(t0 + 1800) and last['to'] is None, last
+        assert abs(last['seconds'] - (time.time() - t0 - 1800)) < 5
+        assert slots['10:00']['status'] == 'full'
+        assert slots['10:00']['open_periods'] == [{'from': iso(t0 + 900), 'to': iso(t0 + 1020), 'seconds': 120}]
+        assert [p['from'] for p in slots['11:30']['open_periods']] == [iso(t0 + 600)]
+        print('open periods OK')
+
+        # a range with more transitions than `limit` says so and where to continue
+        body = (await c.get('/api/slots/timeline', params={'start': DAY, 'end': '2030-01-31', 'limit': 4})).json()
+        assert len(body['events']) == 4 and body['truncated'] and body['last_date'] == DAY, body
+        print('truncation OK')
+
+        resp = await c.get('/api/slots/2030-02-01/timeline')
+        assert resp.status_code == 200 and resp.json() == {'ok': True, 'slots': [], 'events': [],
+                                                           'truncated': False, 'last_date': None}
+        assert (await c.get('/api/slots/2030-1-5x/timeline')).status_code == 400
+        print('unknown / bad date OK')
+
+        # transitions older than TRANSITION_RETENTION_DAYS are pruned, the rest stays
+        store.prune()
+        body = (await c.get(f'/api/slots/{DAY}/timeline')).json()
+        assert len(body['events']) == 9 and '11:00' not in {s['time'] for s in body['slots']}
+    print('OK')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
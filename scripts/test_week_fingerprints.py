@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Test: week fingerprints seen during a poll are committed or dropped on every exit path.
+
+Runs in a temp directory. A stub fetcher records fingerprints the way
+`fetch_weeks_with_page` does (in `_pending_fingerprints`) and returns
+unchanged, failed and changed weeks. After each `notify_once_with_fetcher`
+call nothing may be left pending: a persisted changed week is committed, an
+unchanged or failed week keeps its last committed fingerprint, and a fetch
+that raises leaves nothing behind either.
+
+Run from the project root: PYTHONPATH=. python scripts/test_week_fingerprints.py
+"""
+import asyncio
+import os
+import tempfile
+
+os.chdir(tempfile.mkdtemp())
+os.environ.update(LOG_FLUSH_INTERVAL='0')
+
+import app  # noqa: E402
+
+SLOT = {'date': '2030-01-07', 'time': '09:00', 'status': 'full', 'raw_text': '',
+        'attrs': {'service_cd': 'boat-1', 'start_raw': '2030/01/07 09:00:00'}}
+
+
+def fetcher(results: dict, fps: dict):
+    async def fetch_weeks(starts):
+        app._pending_fingerprints.update({s: fps[s] for s in starts if s in fps})
+        out = [(s, results[s]) for s in starts]
+        for _, r in out:
+            if isinstance(r, Exception) and not isinstance(r, app.WeekNotFound):
+                raise r
+        return out
+    return fetch_weeks
+
+
+async def main():
+    starts = ['2030-01-06', '2030-01-13']
+
+    # first poll: one week changed (persisted -> committed), one missing
+    await app.notify_once_with_fetcher(
+        fetcher({starts[0]: [SLOT], starts[1]: app.WeekNotFound('gone')}, {starts[0]: 'fp-a1', starts[1]: 'fp-b1'}),
+        starts)
+    assert app._week_fingerprints == {starts[0]: 'fp-a1'}, app._week_fingerprints
+    assert app._pending_fingerprints == {}, app._pending_fingerprints
+
+    # every week unchanged or failed: the early return leaves nothing pending
+    await app.notify_once_with_fetcher(
+        fetcher({starts[0]: app.WEEK_UNCHANGED, starts[1]: app.WeekNotFound('gone')},
+                {starts[0]: 'fp-a1', starts[1]: 'fp-b2'}),
+        starts)
+    assert app._week_fingerprints == {starts[0]: 'fp-a1'} and app._pending_fingerprints == {}
+    print('unchanged weeks OK')
+
+    # a fetch that raises after recording fingerprints leaves nothing pending
+    try:
+        await app.notify_once_with_fetcher(
+            fetcher({starts[0]: [SLOT], starts[1]: RuntimeError('browser died')}, {starts[0]: 'fp-a2'}), starts)
+        raise AssertionError('fetch error must reach the caller')
+    except RuntimeError:
+        pass
+    assert app._week_fingerprints == {starts[0]: 'fp-a1'} and app._pending_fingerprints == {}
+    print('OK')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,175 @@
+"""Incremental slot diff: typed change events against an in-memory snapshot.
+
+`DiffEngine` keeps the last known status of every slot keyed by the hash
+of its key tuple (date, time, service_cd, start_raw), plus a date -> slots
+index. `diff(items, dates)` costs one dict lookup per scraped slot plus the
+known slots of the scraped dates, and only the changed slots are serialized
+and written by `commit()`.
+
+Event kinds:
+    appeared          slot not seen before (or seen again after disappearing)
+    disappeared       known slot missing from a scraped date
+    became_available  full -> not full
+    became_full       not full -> full
+    status_changed    any other status change (e.g. available -> not_started)
+
+`event.notify` marks the events the notification path reports: the slot is
+not full and its status differs from the last known one (the rule the old
+diff loops used).
+
+`event.seq` is the slot's change number in the store after the event is
+committed; `notification_key()` hashes (key, old, new, seq) of the notified
+events into the outbox idempotency key, so re-detecting a transition that
+was not committed yet (crash between enqueue and commit) yields the same
+key, while a later change of the same slot yields a new one.
+
+The snapshot is loaded from the SlotStore once and reused across polls; it
+is reloaded only when another process wrote to the store.
+"""
+import hashlib
+import json
+
+from calendar_parse import SlotRecord
+
+APPEARED = 'appeared'
+DISAPPEARED = 'disappeared'
+BECAME_AVAILABLE = 'became_available'
+BECAME_FULL = 'became_full'
+STATUS_CHANGED = 'status_changed'
+
+
+def slot_key(item) -> tuple:
+    """(date, time, service_cd, start_raw) of a slot dict or SlotRecord."""
+    if isinstance(item, SlotRecord):
+        return (item.date, item.time, item.service_cd, item.start_raw)
+    attrs = item.get('attrs') or {}
+    return (item.get('date'), item.get('time'), attrs.get('service_cd'), attrs.get('start_raw'))
+
+
+def notification_key(events, scope: str = '') -> str:
+    """Idempotency key of a notification reporting `events` (order-insensitive)."""
+    parts = sorted(json.dumps([list(ev.key), ev.old, ev.new, ev.seq], ensure_ascii=False) for ev in events)
+    return hashlib.sha256('\n'.join([scope] + parts).encode('utf-8')).hexdigest()
+
+
+class SlotEvent:
+    __slots__ = ('kind', 'key', 'old', 'new', 'item', 'notify', 'seq')
+
+    def __init__(self, kind, key, old, new, item=None, notify=False, seq=0):
+        self.kind = kind
+        self.key = key
+        self.old = old
+        self.new = new
+        self.item = item
+        self.notify = notify
+        self.seq = seq
+
+    def __repr__(self):
+        return f'SlotEvent({self.kind} {self.key[0]} {self.key[1]} {self.old}->{self.new})'
+
+    def to_dict(self) -> dict:
+        return {'kind': self.kind, 'date': self.key[0], 'time': self.key[1], 'service_cd': self.key[2],
+                'old': self.old, 'new': self.new}
+
+
+class DiffEngine:
+    def __init__(self, store):
+        self.store = store
+        self._status: dict[int, str] = {}     # hash -> last known status
+        self._keys: dict[int, tuple] = {}     # hash -> key tuple
+        self._by_date: dict[str, set] = {}    # date -> hashes
+        self._absent: set[int] = set()        # reported as disappeared, not seen since
+        self._seq: dict[int, int] = {}        # hash -> status changes stored
+        self._version = None
+        self.stats = {'polls': 0, 'slots': 0, 'events': 0, 'reloads': 0}
+
+    def _add(self, h: int, key: tuple, status: str):
+        self._status[h] = status
+        if h not in self._keys:
+            self._keys[h] = key
+            self._by_date.setdefault(key[0], set()).add(h)
+
+    def _sync(self):
+        """(Re)load the snapshot when this is the first use or another process wrote."""
+        version = self.store.version()
+        if self._version is not None and version == self._version:
+            return
+        self._status.clear()
+        self._keys.clear()
+        self._by_date.clear()
+        self._seq.clear()
+        seqs = self.store.sequences()
+        for key_str, status in self.store.load().items():
+            try:
+                key = tuple(json.loads(key_str))
+            except Exception:
+                continue
+            h = hash(key)
+            self._add(h, key, status)
+            self._seq[h] = seqs.get(key_str, 0)
+        self._version = version
+        self.stats['reloads'] += 1
+
+    def diff(self, items, dates=None, not_full_only: bool = False) -> list[SlotEvent]:
+        """Events for `items` against the snapshot (the snapshot is not changed).
+
+        `dates` are the dates the items fully cover: known slots on those
+        dates that are missing produce `disappeared` events, or `became_full`
+        when the scrape left full slots out (`not_full_only`).
+        """
+        self._sync()
+        events = []
+        seen = set()
+        status = self._status
+        for item in items:
+            key = slot_key(item)
+            h = hash(key)
+            if h in seen:
+                continue
+            seen.add(h)
+            cur = item.get('status') or ''
+            prev = status.get(h)
+            notify = cur != 'full' and prev != cur
+            seq = self._seq.get(h, 0) + (prev != cur)
+            if prev is None or h in self._absent:
+                events.append(SlotEvent(APPEARED, key, prev, cur, item, notify, seq))
+            elif prev == cur:
+                continue
+            elif cur == 'full':
+                events.append(SlotEvent(BECAME_FULL, key, prev, cur, item, seq=seq))
+            elif prev == 'full':
+                events.append(SlotEvent(BECAME_AVAILABLE, key, prev, cur, item, notify, seq))
+            else:
+                events.append(SlotEvent(STATUS_CHANGED, key, prev, cur, item, notify, seq))
+        for d in dates or ():
+            for h in self._by_date.get(d, ()):
+                if h in seen or h in self._absent:
+                    continue
+                prev = status[h]
+                if not_full_only:
+                    if prev != 'full':
+                        events.append(SlotEvent(BECAME_FULL, self._keys[h], prev, 'full', seq=self._seq.get(h, 0) + 1))
+                else:
+                    events.append(SlotEvent(DISAPPEARED, self._keys[h], prev, prev, seq=self._seq.get(h, 0)))
+        self.stats['polls'] += 1
+        self.stats['slots'] += len(seen)
+        self.stats['events'] += len(events)
+        return events
+
+    def commit(self, events: list[SlotEvent]) -> int:
+        """Apply `events` to the snapshot and write the changed statuses to the store."""
+        changes = {}
+        for ev in events:
+            h = hash(ev.key)
+            if ev.kind == DISAPPEARED:
+                # keep the last status (a reappearing slot with the same status is not news)
+                self._absent.add(h)
+                continue
+            self._absent.discard(h)
+            if self._status.get(h) != ev.new:
+                changes[json.dumps(list(ev.key), ensure_ascii=False)] = ev.new
+                self._seq[h] = self._seq.get(h, 0) + 1
+            self._add(h, ev.key, ev.new)
+        if changes:
+            self.store.apply(changes)
+        return len(changes)
@@ -0,0 +1,256 @@
+"""SQLite slot-state store (last known status per slot), replacing notified.json.
+
+The database runs in WAL mode; `save()` upserts only the statuses that
+changed since the last `load()`/`save()` in one transaction, so a crash
+leaves the previous state intact instead of a truncated JSON file. Slots
+whose date is more than NOTIFIED_RETENTION_DAYS in the past are pruned
+(at most once per NOTIFIED_PRUNE_INTERVAL seconds).
+
+Every status change written by `save()` is also appended to the
+`transitions` table in the same transaction (slot, old status, new status,
+time; old is NULL when the slot first appears). Transitions are kept for
+TRANSITION_RETENTION_DAYS and read back with `transitions()`.
+
+`seq` counts the status changes of a slot; with the transition it makes the
+idempotency key of the notification that reports it (see slot_diff).
+
+Keys are the serialized slot keys used by app.py
+('["date", "time", "service_cd", "start_raw"]'). On first open the legacy
+notified.json is imported once; keys that the old list->dict migration split
+into single characters are joined back, anything that still is not a slot
+key is dropped.
+"""
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS slots ("
+    " key TEXT PRIMARY KEY,"
+    " date TEXT,"
+    " time TEXT,"
+    " service_cd TEXT,"
+    " status TEXT NOT NULL,"
+    " updated_at REAL NOT NULL,"
+    " seq INTEGER NOT NULL DEFAULT 0)",
+    "CREATE INDEX IF NOT EXISTS slots_date ON slots(date)",
+    "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS transitions ("
+    " id INTEGER PRIMARY KEY,"
+    " ts REAL NOT NULL,"
+    " date TEXT,"
+    " time TEXT,"
+    " service_cd TEXT,"
+    " old TEXT,"
+    " new TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS transitions_date_ts ON transitions(date, ts)",
+    "CREATE INDEX IF NOT EXISTS transitions_ts ON transitions(ts)",
+)
+
+
+def repair_key(key_str: str):
+    """Return a valid serialized slot key for `key_str`, or None.
+
+    Undoes the character split (json.dumps(list('["2025-..."]'))) as many
+    times as it was applied.
+    """
+    for _ in range(4):
+        try:
+            k = json.loads(key_str)
+        except Exception:
+            return None
+        if not isinstance(k, list):
+            return None
+        if k and all(isinstance(c, str) and len(c) <= 1 for c in k):
+            key_str = ''.join(k)
+            continue
+        if len(k) == 4 and (k[0] is None or isinstance(k[0], str)):
+            return json.dumps(k, ensure_ascii=False)
+        return None
+    return None
+
+
+def load_legacy_json(path: str, stats: dict | None = None) -> dict:
+    """Read notified.json (dict or old list format) and return repaired key -> status.
+
+    A valid key wins over a repaired duplicate of it. `stats` (optional) gets
+    'repaired' and 'dropped' counts.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception:
+        return {}
+    if isinstance(data, list):
+        entries = []
+        for item in data:
+            # old format: list of key lists (a string here already is a serialized key)
+            key = item if isinstance(item, str) else json.dumps(list(item), ensure_ascii=False)
+            entries.append((key, 'notified'))
+    elif isinstance(data, dict):
+        entries = list(data.items())
+    else:
+        return {}
+    out, repaired = {}, {}
+    dropped = 0
+    for key, status in entries:
+        fixed = repair_key(key)
+        if fixed is None or not isinstance(status, str):
+            dropped += 1
+        elif fixed == key:
+            out[key] = status
+        else:
+            repaired[fixed] = status
+    for key, status in repaired.items():
+        out.setdefault(key, status)
+    if stats is not None:
+        stats['repaired'] = len(repaired)
+        stats['dropped'] = dropped
+    return out
+
+
+class SlotStore:
+    def __init__(self, path: str | None = None, legacy_json: str | None = None,
+                 retention_days: int | None = None, prune_interval: float | None = None):
+        self.path = path or os.environ.get('NOTIFIED_DB', 'notified.db')
+        self.retention_days = retention_days if retention_days is not None else int(os.environ.get('NOTIFIED_RETENTION_DAYS', '1'))
+        self.prune_interval = prune_interval if prune_interval is not None else float(os.environ.get('NOTIFIED_PRUNE_INTERVAL', '3600'))
+        self.transition_days = int(os.environ.get('TRANSITION_RETENTION_DAYS', '365'))
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            for stmt in _SCHEMA:
+                self._conn.execute(stmt)
+            columns = {r[1] for r in self._conn.execute('PRAGMA table_info(slots)')}
+            if 'seq' not in columns:
+                self._conn.execute('ALTER TABLE slots ADD COLUMN seq INTEGER NOT NULL DEFAULT 0')
+        self._cache: dict[str, str] | None = None
+        self._version = None
+        self._generation = 0
+        self._pruned_at = 0.0
+        self.stats = {'upserts': 0, 'transitions': 0, 'pruned': 0, 'migrated': 0, 'repaired': 0, 'dropped': 0}
+        if legacy_json:
+            self._migrate_json(legacy_json)
+
+    def close(self):
+        self._conn.close()
+
+    def _meta(self, name: str):
+        row = self._conn.execute('SELECT value FROM meta WHERE name=?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def _migrate_json(self, path: str):
+        if self._meta('json_migrated') or not os.path.exists(path):
+            return
+        state = load_legacy_json(path, self.stats)
+        with self._conn:
+            self._upsert(state)
+            self._conn.execute("INSERT OR REPLACE INTO meta(name, value) VALUES('json_migrated', ?)",
+                               (datetime.utcnow().isoformat(),))
+        self.stats['migrated'] = len(state)
+
+    def version(self):
+        """Changes when another connection commits or when this store pruned slots."""
+        return (self._conn.execute('PRAGMA data_version').fetchone()[0], self._generation)
+
+    def _current(self) -> dict:
+        version = self.version()
+        if self._cache is None or version != self._version:
+            self._cache = dict(self._conn.execute('SELECT key, status FROM slots'))
+            self._version = version
+        return self._cache
+
+    def load(self) -> dict:
+        """Return {key_str: status} for all stored slots.
+
+        The last read is cached until another connection (app, poller, cron
+        runner) commits, which PRAGMA data_version reports.
+        """
+        return dict(self._current())
+
+    def sequences(self) -> dict:
+        """Return {key_str: seq} (number of status changes written) for all stored slots."""
+        return dict(self._conn.execute('SELECT key, seq FROM slots'))
+
+    def _upsert(self, changes: dict, previous: dict | None = None):
+        """Write `changes`; with `previous` also append one transition per change."""
+        now = time.time()
+        rows = []
+        events = []
+        for key, status in changes.items():
+            try:
+                k = json.loads(key)
+            except Exception:
+                k = None
+            if not isinstance(k, list) or len(k) < 3:
+                k = [None, None, None]
+            rows.append((key, k[0], k[1], k[2], status, now, 1))
+            if previous is not None:
+                events.append((now, k[0], k[1], k[2], previous.get(key), status))
+        self._conn.executemany(
+            'INSERT INTO slots(key, date, time, service_cd, status, updated_at, seq) VALUES(?,?,?,?,?,?,?) '
+            'ON CONFLICT(key) DO UPDATE SET status=excluded.status, updated_at=excluded.updated_at, seq=slots.seq+1',
+            rows,
+        )
+        if events:
+            self._conn.executemany(
+                'INSERT INTO transitions(ts, date, time, service_cd, old, new) VALUES(?,?,?,?,?,?)', events)
+        self.stats['upserts'] += len(rows)
+        self.stats['transitions'] += len(events)
+
+    def save(self, state: dict) -> int:
+        """Persist `state`, writing only keys whose status changed. Returns the number written."""
+        current = self._current()
+        return self.apply({k: v for k, v in state.items() if current.get(k) != v})
+
+    def apply(self, changes: dict) -> int:
+        """Write `changes` ({key_str: status}, all assumed changed) with their transitions."""
+        if changes:
+            current = self._current()
+            with self._conn:
+                self._upsert(changes, current)
+            current.update(changes)
+        if time.monotonic() - self._pruned_at >= self.prune_interval:
+            self.prune()
+        return len(changes)
+
+    def prune(self, before: str | None = None) -> int:
+        """Delete slots dated before `before` (default: today - retention days)."""
+        self._pruned_at = time.monotonic()
+        if before is None:
+            before = (datetime.utcnow().date() - timedelta(days=self.retention_days)).strftime('%Y-%m-%d')
+        with self._conn:
+            cur = self._conn.execute('DELETE FROM slots WHERE date IS NOT NULL AND date < ?', (before,))
+            self._conn.execute('DELETE FROM transitions WHERE ts < ?', (time.time() - self.transition_days * 86400,))
+        if cur.rowcount:
+            self._cache = None
+            self._generation += 1
+            self.stats['pruned'] += cur.rowcount
+        return cur.rowcount
+
+    def transitions(self, date_from: str, date_to: str | None = None, service_cd: str | None = None,
+                    since: float | None = None, until: float | None = None, limit: int = 5000) -> list[dict]:
+        """Transitions of slots dated `date_from`..`date_to` (inclusive), oldest first.
+
+        `since`/`until` bound the event time (epoch seconds).
+        """
+        sql = 'SELECT ts, date, time, service_cd, old, new FROM transitions WHERE date >= ? AND date <= ?'
+        args = [date_from, date_to or date_from]
+        if service_cd:
+            sql += ' AND service_cd = ?'
+            args.append(service_cd)
+        if since is not None:
+            sql += ' AND ts >= ?'
+            args.append(since)
+        if until is not None:
+            sql += ' AND ts < ?'
+            args.append(until)
+        sql += ' ORDER BY date, ts LIMIT ?'
+        args.append(int(limit))
+        return [
+            {'ts': ts, 'date': d, 'time': t, 'service_cd': cd, 'old': old, 'new': new}
+            for ts, d, t, cd, old, new in self._conn.execute(sql, args)
+        ]
@@ -0,0 +1,202 @@
+"""Keep-alive SMTP sessions shared by all email deliveries.
+
+Opening an SMTP session (TCP, EHLO, STARTTLS, EHLO, AUTH) costs far more
+than sending a message over it, so `SmtpPool` keeps up to SMTP_POOL_SIZE
+authenticated sessions open and hands them to senders in turn. A session
+idle for more than SMTP_IDLE_CHECK seconds is probed with NOOP before use;
+a session the server closed (idle timeout, 421) is reopened and the message
+is sent again once. Sessions older than SMTP_MAX_AGE seconds are recycled.
+
+`send_many()` sends a batch over one session, so a batch pays for a single
+handshake, and returns one result per message (also for a batch of one);
+`send()` raises the error of its single message. smtplib waits for every
+reply, so commands are not pipelined on the wire; per-message cost is
+MAIL/RCPT/DATA round trips only.
+
+The pool is blocking (smtplib); async callers run it in a thread.
+"""
+import os
+import queue
+import smtplib
+import threading
+import time
+from collections import deque
+from email.message import EmailMessage
+
+
+def session_dropped(e: Exception) -> bool:
+    """True when `e` means the session is unusable (closed, reset, timed out, 421)."""
+    if isinstance(e, smtplib.SMTPResponseException):
+        return e.smtp_code == 421
+    return isinstance(e, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError))
+
+
+def _percentile(vals, q: float):
+    if not vals:
+        return None
+    vs = sorted(vals)
+    return vs[min(len(vs) - 1, int(q * len(vs)))]
+
+
+class _Session:
+    __slots__ = ('smtp', 'opened', 'used')
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.opened = self.used = time.monotonic()
+
+
+class SmtpPool:
+    def __init__(self, host: str, port: int, user: str | None = None, password: str | None = None,
+                 size: int | None = None, timeout: float = 20):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.size = size or int(os.environ.get('SMTP_POOL_SIZE', '2'))
+        self.idle_check = float(os.environ.get('SMTP_IDLE_CHECK', '30'))
+        self.max_age = float(os.environ.get('SMTP_MAX_AGE', '600'))
+        self._idle = queue.LifoQueue()          # open sessions not in use (most recent first)
+        self._slots = threading.Semaphore(self.size)
+        self._lock = threading.Lock()           # stats and latency (senders run in several threads)
+        self.stats = {'sent': 0, 'failed': 0, 'connects': 0, 'reconnects': 0}
+        self._latency = deque(maxlen=500)       # per message (ms), session setup excluded
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _connect(self) -> _Session:
+        if self.port == 465:
+            s = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            s = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            s.ehlo()
+            try:
+                s.starttls()
+                s.ehlo()
+            except Exception:
+                pass
+        if self.user and self.password:
+            s.login(self.user, self.password)
+        self._count('connects')
+        return _Session(s)
+
+    @staticmethod
+    def _close(sess: _Session):
+        try:
+            sess.smtp.quit()
+        except Exception:
+            try:
+                sess.smtp.close()
+            except Exception:
+                pass
+
+    def _checkout(self) -> _Session:
+        while True:
+            try:
+                sess = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            now = time.monotonic()
+            if now - sess.opened > self.max_age:
+                self._close(sess)
+                continue
+            if now - sess.used > self.idle_check:
+                try:
+                    if sess.smtp.noop()[0] != 250:
+                        raise smtplib.SMTPServerDisconnected('noop failed')
+                except Exception:
+                    self._close(sess)
+                    self._count('reconnects')
+                    continue
+            return sess
+
+    def _send(self, sess: _Session, msg: EmailMessage) -> _Session:
+        """Send over `sess`; reopen the session once if the server dropped it."""
+        t0 = time.monotonic()
+        try:
+            sess.smtp.send_message(msg)
+        except Exception as e:
+            if not session_dropped(e):
+                raise
+            self._close(sess)
+            self._count('reconnects')
+            sess = self._connect()
+            t0 = time.monotonic()
+            sess.smtp.send_message(msg)
+        sess.used = time.monotonic()
+        with self._lock:
+            self._latency.append((sess.used - t0) * 1000)
+        self._count('sent')
+        return sess
+
+    def send(self, msg: EmailMessage):
+        """Send one message; raises what the server (or connection) answered on failure."""
+        err = self.send_many([msg])[0]
+        if err is not None:
+            raise err
+
+    def send_many(self, msgs: list[EmailMessage]) -> list:
+        """Send `msgs` over one session; returns one None (sent) or exception per message."""
+        results = []
+        with self._slots:
+            sess = None
+            try:
+                sess = self._checkout()
+                for msg in msgs:
+                    try:
+                        sess = self._send(sess, msg)
+                        results.append(None)
+                    except Exception as e:
+                        self._count('failed')
+                        results.append(e)
+                        if session_dropped(e):
+                            # the session is gone and could not be reopened
+                            raise
+            except Exception as e:
+                results.extend([e] * (len(msgs) - len(results)))
+                if sess is not None:
+                    self._close(sess)
+                    sess = None
+            finally:
+                if sess is not None:
+                    self._idle.put(sess)
+        return results
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def status(self) -> dict:
+        with self._lock:
+            stats, latency = dict(self.stats), list(self._latency)
+        return {
+            'host': f'{self.host}:{self.port}',
+            'idle_sessions': self._idle.qsize(),
+            'stats': stats,
+            'latency_ms': {'p50': _percentile(latency, 0.5), 'p95': _percentile(latency, 0.95),
+                           'max': max(latency) if latency else None},
+        }
+
+
+_pools: dict[tuple, SmtpPool] = {}
+_pools_lock = threading.Lock()
+
+
+def smtp_pool(host: str, port: int, user: str | None = None, password: str | None = None) -> SmtpPool:
+    """Shared pool for one server/account (created on first use)."""
+    key = (host, port, user, password)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = SmtpPool(host, port, user, password)
+        return pool
+
+
+def pools_status() -> list[dict]:
+    return [p.status() for p in list(_pools.values())]
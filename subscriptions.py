@@ -0,0 +1,253 @@
+"""Per-recipient subscription filters and the index that matches slots to them.
+
+A subscription is a list of filters for one email address; a slot matches
+when any filter accepts it (fields within a filter must all match, a
+missing field matches everything):
+
+    {"date_from": "2025-11-01", "date_to": "2025-11-30",
+     "weekdays": ["sat", "sun"],            # or 0-6 (Mon=0) or 月..日
+     "time_from": "09:00", "time_to": "12:00",   # slot start time, inclusive
+     "service_cd": ["boat-1"],
+     "status": ["available"],
+     "priority": "high"}                    # first alert of a burst skips the digest window
+
+Recipients without filters receive every notified slot, as before.
+Subscriptions are stored in SUBSCRIPTIONS_PATH (subscriptions.json,
+{email: [filter, ...]}).
+
+`SubscriptionIndex` is an inverted index keyed by (date, weekday,
+service_cd), where None stands for "any": a filter with a date range of at
+most INDEX_MAX_DAYS days is listed under each of its dates (only those on
+its weekdays); open-ended filters are listed under their weekdays, or None.
+Matching a slot looks up six buckets and checks only the filters found
+there, so the cost follows the number of candidate filters, not the number
+of subscribers. Open-ended filters with neither weekdays nor service_cd
+(e.g. only a time window or date_from) stay candidates for every slot.
+"""
+import json
+import os
+import re
+from datetime import date as _date, datetime, timedelta
+
+import log_writer
+
+SUBSCRIPTIONS_PATH = 'subscriptions.json'
+INDEX_MAX_DAYS = 400
+
+_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_TIME_RE = re.compile(r'^\d{1,2}:\d{2}$')
+_WEEKDAYS = {name: i for i, names in enumerate(
+    [('mon', '月'), ('tue', '火'), ('wed', '水'), ('thu', '木'), ('fri', '金'), ('sat', '土'), ('sun', '日')])
+    for name in names}
+_FIELDS = ('date_from', 'date_to', 'weekdays', 'time_from', 'time_to', 'service_cd', 'status', 'priority')
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return [v.strip() for v in str(value).split(',') if v.strip()]
+
+
+def normalize_filter(raw: dict) -> dict:
+    """Validated copy of a filter (unknown fields or bad values raise ValueError)."""
+    if not isinstance(raw, dict):
+        raise ValueError('filter must be an object')
+    unknown = set(raw) - set(_FIELDS)
+    if unknown:
+        raise ValueError(f'unknown filter field(s): {", ".join(sorted(unknown))}')
+    out = {}
+    for name in ('date_from', 'date_to'):
+        if raw.get(name):
+            v = str(raw[name])
+            if not _DATE_RE.match(v):
+                raise ValueError(f'{name} must be YYYY-MM-DD')
+            datetime.strptime(v, '%Y-%m-%d')
+            out[name] = v
+    if out.get('date_from') and out.get('date_to') and out['date_from'] > out['date_to']:
+        raise ValueError('date_from is after date_to')
+    for name in ('time_from', 'time_to'):
+        if raw.get(name):
+            v = str(raw[name])
+            if not _TIME_RE.match(v):
+                raise ValueError(f'{name} must be HH:MM')
+            out[name] = v.zfill(5)
+    weekdays = []
+    for w in _as_list(raw.get('weekdays')):
+        if isinstance(w, int) or str(w).isdigit():
+            if not 0 <= int(w) <= 6:
+                raise ValueError('weekdays are 0 (Mon) .. 6 (Sun)')
+            weekdays.append(int(w))
+        elif str(w).lower()[:3] in _WEEKDAYS or str(w) in _WEEKDAYS:
+            weekdays.append(_WEEKDAYS.get(str(w).lower()[:3], _WEEKDAYS.get(str(w))))
+        else:
+            raise ValueError(f'unknown weekday: {w}')
+    if weekdays:
+        out['weekdays'] = sorted(set(weekdays))
+    for name in ('service_cd', 'status'):
+        values = [str(v) for v in _as_list(raw.get(name))]
+        if values:
+            out[name] = sorted(set(values))
+    if raw.get('priority'):
+        if raw['priority'] not in ('high', 'normal'):
+            raise ValueError('priority must be "high" or "normal"')
+        if raw['priority'] == 'high':
+            out['priority'] = 'high'
+    return out
+
+
+def _weekday(d: str, cache: dict) -> int | None:
+    wd = cache.get(d)
+    if wd is None:
+        try:
+            wd = cache[d] = _date.fromisoformat(d).weekday()
+        except Exception:
+            return None
+    return wd
+
+
+class SubscriptionIndex:
+    def __init__(self, subscriptions: dict[str, list[dict]]):
+        self._filters: list[tuple[str, dict]] = []
+        self._buckets: dict[tuple, list[int]] = {}
+        self.emails = set()
+        self._weekdays = {}
+        for email, filters in subscriptions.items():
+            if not filters:
+                continue
+            self.emails.add(email)
+            for f in filters:
+                fid = len(self._filters)
+                self._filters.append((email, f))
+                for key in self._keys(f):
+                    self._buckets.setdefault(key, []).append(fid)
+
+    @staticmethod
+    def _keys(f: dict):
+        weekdays = f.get('weekdays')
+        days = [(None, w) for w in weekdays or [None]]
+        if f.get('date_from') and f.get('date_to'):
+            lo = _date.fromisoformat(f['date_from'])
+            n = (_date.fromisoformat(f['date_to']) - lo).days
+            if n <= INDEX_MAX_DAYS:
+                dates = [lo + timedelta(days=i) for i in range(n + 1)]
+                days = [(d.isoformat(), None) for d in dates if not weekdays or d.weekday() in weekdays]
+        services = f.get('service_cd') or [None]
+        return [(d, w, s) for d, w in days for s in services]
+
+    def _accepts(self, f: dict, d: str, item) -> bool:
+        if f.get('date_from') and (not d or d < f['date_from']):
+            return False
+        if f.get('date_to') and (not d or d > f['date_to']):
+            return False
+        if f.get('weekdays') and _weekday(d or '', self._weekdays) not in f['weekdays']:
+            return False
+        t = (item.get('time') or '').zfill(5)
+        if f.get('time_from') and t < f['time_from']:
+            return False
+        if f.get('time_to') and t > f['time_to']:
+            return False
+        if f.get('status') and (item.get('status') or '') not in f['status']:
+            return False
+        return True
+
+    def match(self, item, urgent: set | None = None) -> set[str]:
+        """Emails with a filter accepting `item` (slot dict or SlotRecord).
+
+        Emails whose accepting filter has priority "high" are also added to `urgent`.
+        """
+        d = item.get('date')
+        wd = _weekday(d or '', self._weekdays)
+        cd = (item.get('attrs') or {}).get('service_cd')
+        out = set()
+        for key in ((d, None, cd), (d, None, None), (None, wd, cd), (None, wd, None), (None, None, cd),
+                    (None, None, None)):
+            for fid in self._buckets.get(key, ()):
+                email, f = self._filters[fid]
+                if email in out and (urgent is None or email in urgent or not f.get('priority')):
+                    continue
+                if self._accepts(f, d, item):
+                    out.add(email)
+                    if urgent is not None and f.get('priority') == 'high':
+                        urgent.add(email)
+        return out
+
+    def route(self, items: list, recipients: list[str], urgent: set | None = None) -> dict[str, list]:
+        """{email: matching items} for `recipients`; those without filters get all items.
+
+        Recipients matched through a high-priority filter are added to `urgent`.
+        """
+        allowed = set(recipients)
+        out = {r: items for r in recipients if r not in self.emails}
+        for item in items:
+            for email in self.match(item, urgent) & allowed:
+                out.setdefault(email, []).append(item)
+        if urgent is not None:
+            urgent &= allowed
+        return {r: v for r, v in out.items() if v}
+
+
+class SubscriptionStore:
+    """subscriptions.json with a cached index (rebuilt when the file changes)."""
+
+    def __init__(self, path: str | None = None):
+        self.path = path or os.environ.get('SUBSCRIPTIONS_PATH', SUBSCRIPTIONS_PATH)
+        self._mtime = None
+        self._data: dict[str, list[dict]] = {}
+        self._index = SubscriptionIndex({})
+
+    def _reload(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        data = {}
+        if mtime is not None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    raw = json.load(f)
+                for email, filters in (raw or {}).items():
+                    data[email] = [normalize_filter(x) for x in filters or []]
+            except Exception as e:
+                log_writer.log(f'subscriptions load error: {e}\n')
+                return
+        self._data = data
+        self._index = SubscriptionIndex(data)
+        self._mtime = mtime
+
+    def all(self) -> dict[str, list[dict]]:
+        self._reload()
+        return {k: list(v) for k, v in self._data.items()}
+
+    def get(self, email: str) -> list[dict]:
+        self._reload()
+        return list(self._data.get(email, []))
+
+    def index(self) -> SubscriptionIndex:
+        self._reload()
+        return self._index
+
+    def set(self, email: str, filters: list[dict] | None) -> bool:
+        """Replace the filters of `email` (None or [] removes them)."""
+        self._reload()
+        if not filters and email not in self._data:
+            return True
+        data = dict(self._data)
+        if filters:
+            data[email] = [normalize_filter(x) for x in filters]
+        else:
+            data.pop(email, None)
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except Exception:
+            return False
+        self._data = data
+        self._index = SubscriptionIndex(data)
+        self._mtime = os.path.getmtime(self.path)
+        return True